@@ -1,7 +1,16 @@
+from .aio import aiter_images, aiter_textures, extract_async
 from .extract import do_extract as _do_extract
+from .metrics import Profiler
+from .output_sink import DirectoryOutputSink, MemoryOutputSink, OutputSink, TarOutputSink, ZipOutputSink
 from .settings import Settings as _Settings
+from .stream import iter_images, iter_textures
 
 
 def extract(in_path: str, out_dir: str, *,
-            trimming: bool = True, blackening: bool = True, animations: bool = False):
-    _do_extract(_Settings(in_path, out_dir, trimming, blackening, animations))
+            trimming: bool = True, blackening: bool = True, animations: bool = False, jobs: int = 1,
+            force: bool = False, png_compression_level: int = None, profiler=None, output_format: str = "directory",
+            output_sink: OutputSink = None, dedup: str = None, png_threads: int = 1,
+            include: list = None, exclude: list = None):
+    return _do_extract(_Settings(in_path, out_dir, trimming, blackening, animations, jobs, force,
+                                 png_compression_level, profiler, output_format, dedup, png_threads, include, exclude),
+                       output_sink)
@@ -1,8 +1,21 @@
 import logging
 
 from .extract import do_extract
+from .index import do_index
 from .settings import get_settings_from_command_line
+from .watch import do_watch
 
 logging.basicConfig(level=logging.INFO)
 
-do_extract(get_settings_from_command_line())
+settings = get_settings_from_command_line()
+if settings.watch_path is not None:
+    do_watch(settings)
+elif settings.index_mode_enabled:
+    do_index(settings)
+else:
+    do_extract(settings)
+
+if settings.profiler is not None:
+    logging.info("\n" + settings.profiler.format_summary())
+    if settings.profile_report_path:
+        settings.profiler.write_report(settings.profile_report_path)
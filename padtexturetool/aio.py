@@ -0,0 +1,181 @@
+"""Asyncio versions of the extraction and streaming APIs, which keep blocking work off of the event loop.
+
+Reading, parsing and cache bookkeeping run in the event loop's default executor, and decoding and encoding images run
+in `executor` (which may be a process pool). Image files are written to the output sink by a background writer, as in
+padtexturetool.extract. At most `concurrency` textures are being exported or encoded at once. Cancelling an extraction
+stops any exports which have not yet started; those already running in the executor are left to finish, and whatever
+was exported before the cancellation is still written and recorded in the extraction cache.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import functools
+from typing import AsyncIterator, Tuple
+
+from .dedup import TextureDeduplicator
+from .extract import (encode_exported_texture_with_cpu_time, get_extracted_file_paths, get_extraction_cache,
+                      get_output_file_name, iter_export_arguments, log_extraction_summary, plan_extraction,
+                      record_exported_texture)
+from .output_sink import BackgroundOutputWriter, OutputSink, open_output_sink
+from .settings import Settings
+from .stream import encode_image, get_image_settings, iter_textures
+from .texture import Texture
+
+
+async def aiter_blocking(iterator, executor=None):
+    # Advances a blocking iterator in an executor. Iterators cannot be advanced from two threads at once, so only one
+    # step is ever in flight.
+    loop = asyncio.get_running_loop()
+    sentinel = object()
+    while True:
+        item = await loop.run_in_executor(executor, next, iterator, sentinel)
+        if item is sentinel:
+            return
+        yield item
+
+
+async def extract_file_async(input_file_path, settings, cached_texture_records=None, *, semaphore, output_writer,
+                             executor=None, deduplicator=None, bookkeeping_executor=None):
+    """The asyncio version of extract_file: returns (texture records, reused texture count) for an input file.
+
+    Image files are handed to `output_writer`. Reading the file and recording each export (which, with a
+    `deduplicator`, writes the duplicates waiting on it) run in `bookkeeping_executor`; it must have a single thread
+    when there is a deduplicator, which is not safe to use from more than one thread at a time.
+    """
+    loop = asyncio.get_running_loop()
+    texture_records = {}
+    export_arguments = iter_export_arguments(input_file_path, settings, cached_texture_records or {}, texture_records)
+    if deduplicator is not None:
+        export_arguments = deduplicator.filter_export_arguments(export_arguments, texture_records)
+
+    export_futures = []
+    try:
+        async for arguments in aiter_blocking(export_arguments, bookkeeping_executor):
+            await semaphore.acquire()
+            export_future = loop.run_in_executor(executor, encode_exported_texture_with_cpu_time, *arguments)
+            export_future.add_done_callback(lambda _: semaphore.release())
+            export_futures.append((arguments[1], export_future))
+        exported_texture_count = 0
+        for output_file_path, export_future in export_futures:
+            image_data, seconds = await export_future
+            exported_texture_count += await loop.run_in_executor(
+                bookkeeping_executor, record_exported_texture, texture_records, output_file_path, image_data, seconds,
+                output_writer.write, deduplicator)
+        if deduplicator is not None:
+            exported_texture_count += await loop.run_in_executor(
+                bookkeeping_executor, deduplicator.write_ready_duplicates, texture_records)
+    except BaseException:
+        for _, export_future in export_futures:
+            export_future.cancel()
+        raise
+
+    return texture_records, len(texture_records) - exported_texture_count
+
+
+async def extract_async(in_path: str, out_dir: str, *, trimming: bool = True, blackening: bool = True,
+                        animations: bool = False, force: bool = False, png_compression_level: int = None,
+                        profiler=None, output_format: str = "directory", output_sink: OutputSink = None,
+                        dedup: str = None, concurrency: int = 4, executor=None):
+    """The asyncio version of padtexturetool.extract: returns the paths of the extracted image files."""
+    loop = asyncio.get_running_loop()
+    settings = await loop.run_in_executor(None, functools.partial(
+        Settings, in_path, out_dir, trimming, blackening, animations, force=force,
+        png_compression_level=png_compression_level, profiler=profiler, output_format=output_format, dedup=dedup))
+    if output_sink is None:
+        output_sink = await loop.run_in_executor(None, open_output_sink, settings)
+    caches = {}
+    extract_arguments, unchanged_input_count = await loop.run_in_executor(None, plan_extraction, settings, caches,
+                                                                          output_sink.is_cached)
+    output_writer = BackgroundOutputWriter(output_sink, settings.profiler)
+
+    deduplicator = bookkeeping_executor = None
+    # Input files are limited separately from textures, so that every input being read cannot starve the exports.
+    input_semaphore = asyncio.Semaphore(concurrency)
+    if settings.dedup_mode is not None:
+        deduplicator = TextureDeduplicator(settings.dedup_mode, output_writer)
+        bookkeeping_executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="padtexturetool-dedup")
+        # Duplicates are recorded in the texture records of the input file being extracted, so input files take turns.
+        input_semaphore = asyncio.Semaphore(1)
+    semaphore = asyncio.Semaphore(concurrency)
+    reused_texture_count = exported_texture_count = 0
+
+    async def extract(input_file_path, *arguments):
+        nonlocal reused_texture_count, exported_texture_count
+        async with input_semaphore:
+            texture_records, reused_count = await extract_file_async(
+                input_file_path, *arguments, semaphore=semaphore, output_writer=output_writer, executor=executor,
+                deduplicator=deduplicator, bookkeeping_executor=bookkeeping_executor)
+        if output_sink.is_cached:
+            get_extraction_cache(caches, input_file_path, settings).update(input_file_path, settings.cache_key,
+                                                                           texture_records)
+        reused_texture_count += reused_count
+        exported_texture_count += len(texture_records) - reused_count
+
+    def finish_extraction(exc_type):
+        try:
+            for cache in caches.values():
+                if cache.is_modified:
+                    cache.save()
+        finally:
+            if bookkeeping_executor is not None:
+                bookkeeping_executor.shutdown()
+            output_writer.__exit__(exc_type)
+
+    exc_type = None
+    try:
+        if deduplicator is not None and output_sink.is_cached and not settings.force_enabled:
+            await loop.run_in_executor(bookkeeping_executor, deduplicator.add_earlier_extractions, caches,
+                                       settings.cache_key)
+        await asyncio.gather(*(extract(*arguments) for arguments in extract_arguments))
+        if deduplicator is not None:
+            await loop.run_in_executor(bookkeeping_executor, deduplicator.write_manifests, output_sink)
+    except BaseException as error:
+        exc_type = type(error)
+        raise
+    finally:
+        # Whatever was extracted before an error or cancellation is still written out and recorded.
+        await asyncio.shield(loop.run_in_executor(None, finish_extraction, exc_type))
+
+    log_extraction_summary(settings, unchanged_input_count, reused_texture_count, exported_texture_count)
+    if deduplicator is not None:
+        deduplicator.log_summary(output_sink)
+    if not output_sink.is_cached:
+        return output_sink.written_paths
+    return get_extracted_file_paths(settings, caches)
+
+
+async def aiter_textures(source) -> AsyncIterator[Texture]:
+    """The asyncio version of padtexturetool.iter_textures."""
+    async for texture in aiter_blocking(iter_textures(source)):
+        yield texture
+
+
+async def aiter_images(source, format: str = "png", *, trimming: bool = True, blackening: bool = True,
+                       png_compression_level: int = None, concurrency: int = 4,
+                       executor=None) -> AsyncIterator[Tuple[str, bytes]]:
+    """The asyncio version of padtexturetool.iter_images; up to `concurrency` images are encoded at once."""
+    loop = asyncio.get_running_loop()
+    settings = get_image_settings(format, trimming, blackening, png_compression_level)
+    files_written = {}
+    pending_images = collections.deque()
+
+    async def next_image():
+        output_file_name, encoding_future = pending_images.popleft()
+        return output_file_name, await encoding_future
+
+    try:
+        async for texture in aiter_textures(source):
+            output_file_name = get_output_file_name(texture.name, files_written)
+            pending_images.append(
+                (output_file_name, loop.run_in_executor(executor, encode_image, texture, settings)))
+            if len(pending_images) >= concurrency:
+                output_file_name, image_data = await next_image()
+                if image_data is not None:
+                    yield output_file_name, image_data
+        while pending_images:
+            output_file_name, image_data = await next_image()
+            if image_data is not None:
+                yield output_file_name, image_data
+    finally:
+        for _, encoding_future in pending_images:
+            encoding_future.cancel()
@@ -0,0 +1,179 @@
+"""Benchmarks for each stage of the extraction pipeline, run against synthetic Puzzle & Dragons texture data."""
+import io
+import platform
+import time
+import tracemalloc
+
+from ..encoding import *
+from ..png_writer import GREYSCALE, INDEXED, TRUECOLOR, TRUECOLOR_WITH_ALPHA, get_rows, write_png
+from ..texture import Texture
+from ..texture_reader import decrypt_and_decompress_binary_blob, extract_textures_from_binary_blob
+from ..texture_writer import (blacken_transparent_pixel_array, blacken_transparent_pixels, build_palette,
+                              build_palette_from_array, np, trim_transparent_edges, trim_transparent_edges_array,
+                              unpack_pixel_array, unpack_pixels)
+from .synthetic import synthesize_binary_blob
+
+benchmark_encodings = [R8G8B8A8, R5G6B5, R4G4B4A4, R5G5B5A1, L8, PVRTC4BPP, PVRTC2BPP]
+default_sizes = [256, 1024, 2048]
+target_bit_depth = 8
+
+
+def measure(function, repeat):
+    """Returns the best wall-clock time of `repeat` calls to a function, and the peak memory allocated by one call."""
+    best_duration = float("inf")
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        best_duration = min(best_duration, time.perf_counter() - start_time)
+
+    # Memory is traced in a separate call since tracing slows allocation down considerably.
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_allocation = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best_duration, peak_allocation
+
+
+def copy_texture(texture):
+    # Textures cache their unpacked pixels, so each measurement gets a fresh copy.
+    return Texture(texture.width, texture.height, texture.name, texture.buffer, texture.encoding,
+                   texture.given_width, texture.given_height)
+
+
+def expand(texture):
+    if np is not None:
+        return unpack_pixel_array(texture, target_bit_depth)
+    return unpack_pixels(texture, target_bit_depth)
+
+
+def trim_and_blacken(texture, pixels):
+    if not texture.encoding.has_alpha:
+        return pixels, texture.width, texture.height
+    if np is not None:
+        pixels = blacken_transparent_pixel_array(
+            trim_transparent_edges_array(pixels, texture.given_width, texture.given_height))
+        return pixels, pixels.shape[1], pixels.shape[0]
+
+    width, height, pixels = trim_transparent_edges(pixels, texture.width, texture.height, texture.encoding.channels,
+                                                   texture.given_width, texture.given_height)
+    return blacken_transparent_pixels(pixels, width, height, texture.encoding.channels), width, height
+
+
+def find_palette(texture, pixels):
+    if texture.encoding.is_greyscale:
+        return None, None
+    if np is not None:
+        return build_palette_from_array(pixels, texture.encoding.has_alpha)
+    return build_palette(pixels, len(texture.encoding.channels), texture.encoding.has_alpha)
+
+
+def encode(texture, pixels, width, height, palette, palette_indices):
+    png_stream = io.BytesIO()
+    if palette is not None:
+        rows = palette_indices if np is not None else get_rows(palette_indices, width)
+        write_png(png_stream, width, height, rows, INDEXED, target_bit_depth, palette=palette)
+    else:
+        if texture.encoding.is_greyscale:
+            colour_type = GREYSCALE
+        elif texture.encoding.has_alpha:
+            colour_type = TRUECOLOR_WITH_ALPHA
+        else:
+            colour_type = TRUECOLOR
+        rows = pixels if np is not None else get_rows(bytes(pixels), width * len(texture.encoding.channels))
+        write_png(png_stream, width, height, rows, colour_type, target_bit_depth)
+    return png_stream.getbuffer().nbytes
+
+
+def benchmark_binary_blob(binary_blob, repeat):
+    """Times each stage of extracting a blob, returning a {stage name: result} dict."""
+    results = {}
+
+    def record(stage_name, function, byte_count, texture_count):
+        duration, peak_allocation = measure(function, repeat)
+        results[stage_name] = {
+            "seconds": duration,
+            "megabytes_per_second": (byte_count / duration / 2 ** 20) if duration else None,
+            "textures_per_second": (texture_count / duration) if duration else None,
+            "peak_allocation_bytes": peak_allocation,
+        }
+
+    decrypted_blob = decrypt_and_decompress_binary_blob(binary_blob)
+    if decrypted_blob is not binary_blob:
+        record("decrypt", lambda: decrypt_and_decompress_binary_blob(binary_blob), len(decrypted_blob), 0)
+
+    textures, _ = extract_textures_from_binary_blob(decrypted_blob)
+    texture_count = len(textures)
+    record("parse", lambda: extract_textures_from_binary_blob(decrypted_blob), len(decrypted_blob), texture_count)
+
+    buffer_size = sum(len(texture.buffer) for texture in textures)
+    record("unpack", lambda: [copy_texture(texture).packed_pixels for texture in textures], buffer_size,
+           texture_count)
+
+    expanded = [expand(texture) for texture in textures]
+    record("expand", lambda: [expand(texture) for texture in textures], buffer_size, texture_count)
+
+    trimmed = [trim_and_blacken(texture, pixels) for texture, pixels in zip(textures, expanded)]
+    record("trim_blacken", lambda: [trim_and_blacken(texture, pixels) for texture, pixels in zip(textures, expanded)],
+           buffer_size, texture_count)
+
+    palettes = [find_palette(texture, pixels) for texture, (pixels, _, _) in zip(textures, trimmed)]
+    record("palette", lambda: [find_palette(texture, pixels) for texture, (pixels, _, _) in zip(textures, trimmed)],
+           buffer_size, texture_count)
+
+    def encode_all():
+        return [encode(texture, pixels, width, height, palette, palette_indices)
+                for texture, (pixels, width, height), (palette, palette_indices) in zip(textures, trimmed, palettes)]
+    record("png", encode_all, buffer_size, texture_count)
+
+    return results
+
+
+def run_benchmarks(encodings=None, sizes=None, textures_per_blob=2, colour_counts=(4096, 64), encrypted=True,
+                   repeat=3, progress=None):
+    """Benchmarks every combination of encoding, size and colour count and returns a JSON-serializable report."""
+    cases = []
+    for encoding in (encodings or benchmark_encodings):
+        if encoding.is_compressed and np is None:
+            if progress:
+                progress(f"Skipping {encoding.name}; decoding it requires NumPy.")
+            continue
+        for size in (sizes or default_sizes):
+            for colour_count in colour_counts:
+                binary_blob = synthesize_binary_blob(encoding, size, size, textures_per_blob,
+                                                     colour_count=colour_count, encrypted=encrypted)
+                if progress:
+                    progress(f"{encoding.name} {size}x{size}, {colour_count} colours...")
+                cases.append({
+                    "encoding": encoding.name,
+                    "width": size,
+                    "height": size,
+                    "colour_count": colour_count,
+                    "textures": textures_per_blob,
+                    "blob_bytes": len(binary_blob),
+                    "stages": benchmark_binary_blob(binary_blob, repeat),
+                })
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__ if np is not None else None,
+        "encrypted": encrypted,
+        "repeat": repeat,
+        "cases": cases,
+    }
+
+
+def format_report(report):
+    lines = ["{:<10} {:>11} {:>7} {:<13} {:>10} {:>10} {:>12} {:>12}".format(
+        "encoding", "size", "colours", "stage", "ms", "MB/s", "textures/s", "peak KiB")]
+    for case in report["cases"]:
+        for stage_name, stage in case["stages"].items():
+            lines.append("{:<10} {:>11} {:>7} {:<13} {:>10.2f} {:>10} {:>12} {:>12.0f}".format(
+                case["encoding"], "{}x{}".format(case["width"], case["height"]), case["colour_count"], stage_name,
+                stage["seconds"] * 1000,
+                "{:.1f}".format(stage["megabytes_per_second"]) if stage["megabytes_per_second"] else "-",
+                "{:.1f}".format(stage["textures_per_second"]) if stage["textures_per_second"] else "-",
+                stage["peak_allocation_bytes"] / 1024))
+    return "\n".join(lines)
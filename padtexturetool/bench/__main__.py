@@ -0,0 +1,46 @@
+import argparse
+import json
+import sys
+
+from .. import encoding as encoding_module
+from . import benchmark_encodings, default_sizes, format_report, run_benchmarks
+
+
+def encoding_name(value):
+    if value.upper() not in encoding_module.__all__:
+        raise argparse.ArgumentTypeError("Unknown encoding \"{}\"; expected one of {}.".format(
+            value, ", ".join(encoding_module.__all__)))
+    return getattr(encoding_module, value.upper())
+
+
+parser = argparse.ArgumentParser(
+    prog="python -m padtexturetool.bench",
+    description="Times each stage of the Puzzle & Dragons Texture Tool's extraction pipeline against synthetic texture data.")
+parser.add_argument("--encodings", metavar="ENCODING", nargs="+", type=encoding_name,
+                    default=benchmark_encodings,
+                    help="The encodings to benchmark. Defaults to {}.".format(
+                        ", ".join(encoding.name for encoding in benchmark_encodings)))
+parser.add_argument("--sizes", metavar="SIZE", nargs="+", type=int, default=default_sizes,
+                    help="The width and height of the synthetic textures. Defaults to {}.".format(
+                        " ".join(str(size) for size in default_sizes)))
+parser.add_argument("--textures", metavar="N", type=int, default=2,
+                    help="The number of textures in each synthetic blob. Defaults to 2.")
+parser.add_argument("--colours", metavar="N", nargs="+", type=int, default=[4096, 64],
+                    help="How many distinct colours the synthetic textures use; 256 or fewer exercises the palette path. Defaults to 4096 64.")
+parser.add_argument("--repeat", metavar="N", type=int, default=3,
+                    help="How many times each stage is timed; the best time is reported. Defaults to 3.")
+parser.add_argument("--no-encryption", dest="encrypted", action="store_false",
+                    help="Benchmark unencrypted blobs, skipping the decryption stage.")
+parser.add_argument("--json", metavar="PATH",
+                    help="Also write the results as JSON to this path (or \"-\" for standard output), for comparison across commits.")
+args = parser.parse_args()
+
+report = run_benchmarks(args.encodings, args.sizes, args.textures, args.colours, args.encrypted, args.repeat,
+                        progress=lambda message: print(message, file=sys.stderr))
+if args.json == "-":
+    json.dump(report, sys.stdout, indent=2)
+else:
+    print(format_report(report))
+    if args.json:
+        with open(args.json, 'w', encoding='UTF-8') as json_file:
+            json.dump(report, json_file, indent=2)
@@ -0,0 +1,88 @@
+import random
+import struct
+import zlib
+
+from ..encoding import *
+from ..texture_reader import (encodings, encrypted_texture_header_format, encrypted_texture_magic_string,
+                              get_decryption_table, texture_block_header_alignment, texture_block_header_format,
+                              texture_block_header_size, texture_manifest_format, texture_manifest_size,
+                              unencrypted_texture_magic_string)
+
+encoding_identifiers = dict((encoding, encoding_identifier) for encoding_identifier, encoding in encodings.items())
+# The size of the header and footer which surround PVR texture data.
+pvr_header_size = 52
+pvr_footer_size = 12
+
+
+def align(offset, alignment=texture_block_header_alignment):
+    return (offset + alignment - 1) & ~(alignment - 1)
+
+
+def synthesize_image_data(encoding, width, height, rng, colour_count=4096):
+    """Returns packed image data resembling a PAD texture: a block of colour surrounded by transparent padding.
+
+    The visible pixels are drawn from `colour_count` random colours; at most 256 colours lets the image be palettized.
+    """
+    byte_count = (width * height * encoding.stride_in_bits) // 8
+    if encoding in (PVRTC4BPP, PVRTC2BPP) or not encoding.has_alpha:
+        return rng.getrandbits(8 * byte_count).to_bytes(byte_count, 'little')
+
+    pixel_format = ">L" if encoding.stride_in_bits == 32 else "<H"
+    alpha_mask = encoding.bit_masks[-1]
+    colours = [struct.pack(pixel_format, rng.getrandbits(encoding.stride_in_bits) | alpha_mask)
+               for _ in range(colour_count)]
+    transparent_pixel = bytes(encoding.stride_in_bits // 8)
+
+    left, top = width // 8, height // 8
+    right, bottom = width - width // 4, height - height // 6
+    rows = []
+    for y in range(height):
+        if top <= y < bottom:
+            rows.append(transparent_pixel * left + b''.join(rng.choices(colours, k=right - left)) +
+                        transparent_pixel * (width - right))
+        else:
+            rows.append(transparent_pixel * width)
+    return b''.join(rows)
+
+
+def synthesize_texture_block(textures):
+    """Builds an unencrypted "TEX" block from (name, encoding, width, height, image data) tuples."""
+    manifest_end = texture_block_header_size + (texture_manifest_size * len(textures))
+    image_data_offset = align(manifest_end)
+
+    manifests = []
+    image_data_sections = []
+    for name, encoding, width, height, image_data in textures:
+        encoding_identifier = encoding_identifiers[encoding]
+        if encoding in (PVRTC4BPP, PVRTC2BPP):
+            image_data = bytes(pvr_header_size) + image_data + bytes(pvr_footer_size)
+        manifests.append(struct.pack(texture_manifest_format, image_data_offset,
+                                     width | (encoding_identifier << 12), height, name.encode('UTF-8')))
+        image_data_section = image_data + bytes(align(len(image_data)) - len(image_data))
+        if encoding == R4G4B4A4:
+            # MONS textures carry their visible size in a footer which follows the image data.
+            image_data_section += struct.pack('<8sHHHH', bytes(8), width - width // 8, height - height // 8, 1, 0)
+        image_data_sections.append(image_data_section)
+        image_data_offset += len(image_data_section)
+
+    header = struct.pack(texture_block_header_format, unencrypted_texture_magic_string, len(textures))
+    manifest_data = header + b''.join(manifests)
+    return manifest_data + bytes(align(manifest_end) - manifest_end) + b''.join(image_data_sections)
+
+
+def encrypt_binary_blob(binary_blob, decryption_key=0x5A):
+    """Wraps a blob in the "IOSCh" envelope: deflated, then XORed with the decryption key."""
+    compress = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed_blob = compress.compress(binary_blob) + compress.flush()
+    header = struct.pack(encrypted_texture_header_format, encrypted_texture_magic_string, decryption_key)
+    # XOR is its own inverse, so the decryption table also encrypts.
+    return header + compressed_blob.translate(get_decryption_table(decryption_key))
+
+
+def synthesize_binary_blob(encoding, width, height, texture_count, seed=0, colour_count=4096, encrypted=True):
+    rng = random.Random(seed)
+    textures = [("BENCH_{:03d}.PNG".format(texture_index), encoding, width, height,
+                 synthesize_image_data(encoding, width, height, rng, colour_count))
+                for texture_index in range(texture_count)]
+    binary_blob = synthesize_texture_block(textures)
+    return encrypt_binary_blob(binary_blob) if encrypted else binary_blob
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import logging
+import os
+
+CACHE_FILE_NAME = ".padtexturetool-cache.json"
+CACHE_FORMAT_VERSION = 2
+
+
+def get_texture_hash(texture):
+    texture_hash = hashlib.blake2b(digest_size=16)
+    texture_hash.update(texture.buffer)
+    texture_hash.update("{}:{}x{}:{}x{}".format(texture.encoding.name, texture.width, texture.height,
+                                                texture.given_width, texture.given_height).encode())
+    return texture_hash.hexdigest()
+
+
+class ExtractionCache:
+    """A record of which input files and textures have already been extracted into an output directory."""
+
+    def __init__(self, output_directory_path):
+        super(ExtractionCache, self).__init__()
+        self.output_directory_path = output_directory_path
+        self.cache_file_path = os.path.join(output_directory_path, CACHE_FILE_NAME)
+        self.inputs = {}
+        # Whether anything has been updated since the cache was loaded or last saved.
+        self.is_modified = False
+
+        try:
+            with open(self.cache_file_path, 'r', encoding='UTF-8') as cache_file:
+                cache_contents = json.load(cache_file)
+            if cache_contents.get("version") == CACHE_FORMAT_VERSION:
+                self.inputs = cache_contents["inputs"]
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, AttributeError):
+            logging.warning(f"Ignoring unreadable extraction cache {self.cache_file_path}.")
+
+    def get_texture_records(self, input_file_path, cache_key):
+        """Returns {output file name: [texture hash, whether a file was written]} from the last extraction."""
+        entry = self.inputs.get(input_file_path)
+        if entry is None or entry["settings"] != cache_key:
+            return {}
+        return entry["textures"]
+
+    def get_output_file_paths(self, input_file_path):
+        entry = self.inputs.get(input_file_path, {"textures": {}})
+        return [os.path.join(self.output_directory_path, output_file_name)
+                for output_file_name, (_, was_written) in entry["textures"].items() if was_written]
+
+    def iter_written_textures(self, cache_key):
+        """Yields (texture hash, output file path) for each file written by extractions with the given settings."""
+        for entry in self.inputs.values():
+            if entry["settings"] == cache_key:
+                for output_file_name, (texture_hash, was_written) in entry["textures"].items():
+                    if was_written:
+                        yield texture_hash, os.path.join(self.output_directory_path, output_file_name)
+
+    def is_input_unchanged(self, input_file_path, cache_key):
+        entry = self.inputs.get(input_file_path)
+        if entry is None or entry["settings"] != cache_key:
+            return False
+        input_file_stat = os.stat(input_file_path)
+        if (entry["size"], entry["mtime_ns"]) != (input_file_stat.st_size, input_file_stat.st_mtime_ns):
+            return False
+        # Anything deleted from the output directory since the last run has to be extracted again.
+        return all(os.path.isfile(output_file_path) for output_file_path in self.get_output_file_paths(input_file_path))
+
+    def update(self, input_file_path, cache_key, texture_records):
+        input_file_stat = os.stat(input_file_path)
+        self.inputs[input_file_path] = {
+            "size": input_file_stat.st_size,
+            "mtime_ns": input_file_stat.st_mtime_ns,
+            "settings": cache_key,
+            "textures": texture_records,
+        }
+        self.is_modified = True
+
+    def save(self):
+        os.makedirs(self.output_directory_path, exist_ok=True)
+        temporary_file_path = self.cache_file_path + ".tmp"
+        with open(temporary_file_path, 'w', encoding='UTF-8') as cache_file:
+            json.dump({"version": CACHE_FORMAT_VERSION, "inputs": self.inputs}, cache_file)
+        os.replace(temporary_file_path, self.cache_file_path)
+        self.is_modified = False
@@ -0,0 +1,191 @@
+"""Deduplication of byte-identical textures, so that each distinct texture is only decoded and encoded once."""
+import json
+import logging
+import os
+
+DEDUP_MANIFEST_FILE_NAME = "padtexturetool-duplicates.json"
+# Duplicates are either hardlinked to (or, where a sink cannot link, written as copies of) the first texture's image
+# file, or left unwritten and listed in a manifest in their output directory.
+dedup_modes = ("link", "manifest")
+
+
+class TextureDeduplicator:
+    """Tracks the first texture exported with each texture hash during an extraction, and writes its duplicates.
+
+    Texture hashes cover a texture's image data, encoding and dimensions, and the settings which affect its image file
+    are the same throughout an extraction, so textures with the same hash always have the same image file.
+
+    A deduplicator can be kept for successive extractions into the same directories with the same settings (as in
+    watch mode), so long as finish_extraction() is called after each one; `output_writer` is set for each extraction.
+    """
+
+    def __init__(self, mode, output_writer=None):
+        super(TextureDeduplicator, self).__init__()
+        self.mode = mode
+        self.output_writer = output_writer
+        # The output directories whose caches add_earlier_extractions has already looked through.
+        self.scanned_output_directory_paths = set()
+        # {texture hash: (output file path, image data, CPU seconds spent encoding it)}, or None while the first texture
+        # with the hash is still being encoded. Textures without visible pixels have neither a path nor image data;
+        # those whose file has since been replaced by another texture's have image data but no path.
+        self.originals = {}
+        # {output file path: hash of the texture whose image is in it}
+        self.texture_hashes_by_path = {}
+        self.written_paths = set()
+        self.waiting_duplicates = {}
+        self.ready_duplicates = []
+        # {output directory path: {duplicate file name: original output file path}}
+        self.manifests = {}
+        self.duplicate_count = 0
+        self.saved_seconds = 0.0
+        self.unwritten_byte_count = 0
+
+    def add_earlier_extractions(self, caches, cache_key):
+        """Treats the files written by earlier extractions with the same settings as originals, too. Caches which
+        have been looked through before are skipped."""
+        texture_hashes_by_path = {}
+        for cache in caches.values():
+            if cache.output_directory_path in self.scanned_output_directory_paths:
+                continue
+            self.scanned_output_directory_paths.add(cache.output_directory_path)
+            for texture_hash, output_file_path in cache.iter_written_textures(cache_key):
+                texture_hashes_by_path.setdefault(output_file_path, set()).add(texture_hash)
+        for output_file_path, texture_hashes in texture_hashes_by_path.items():
+            # A file claimed by textures with different hashes was overwritten by one of them, but which is unknown.
+            if len(texture_hashes) == 1 and os.path.isfile(output_file_path):
+                texture_hash = texture_hashes.pop()
+                self.texture_hashes_by_path[output_file_path] = texture_hash
+                self.originals.setdefault(texture_hash, (output_file_path, None, 0.0))
+
+    def filter_export_arguments(self, export_arguments, texture_records):
+        """Yields the export arguments of the first texture with each hash, and holds back the duplicates."""
+        for texture, output_file_path, settings in export_arguments:
+            texture_hash = texture_records[os.path.basename(output_file_path)][0]
+            original = self.originals.get(texture_hash)
+            if original is not None and original[0] is not None and original[1] is None and not os.path.isfile(
+                    original[0]):
+                # The file an earlier extraction wrote has since been deleted, so this texture becomes the original.
+                self.texture_hashes_by_path.pop(original[0], None)
+                del self.originals[texture_hash]
+            if texture_hash not in self.originals:
+                self.originals[texture_hash] = None
+                yield texture, output_file_path, settings
+            elif self.originals[texture_hash] is None:
+                self.waiting_duplicates.setdefault(texture_hash, []).append(output_file_path)
+            else:
+                self.ready_duplicates.append((output_file_path, texture_hash))
+
+    def claim_output_file_path(self, output_file_path, texture_hash):
+        # Called before a texture's image is written to a path. If another texture's original is in that file, its
+        # image has to be kept elsewhere: in memory for its next duplicate, and in files for any already listed in a
+        # manifest as duplicates of it.
+        replaced_texture_hash = self.texture_hashes_by_path.get(output_file_path)
+        self.texture_hashes_by_path[output_file_path] = texture_hash
+        self.written_paths.add(output_file_path)
+        if replaced_texture_hash in (None, texture_hash) or not self.originals.get(replaced_texture_hash):
+            return
+        original_output_file_path, image_data, seconds = self.originals[replaced_texture_hash]
+        if original_output_file_path != output_file_path:
+            return
+
+        if image_data is None:
+            # Files from earlier extractions are still intact, since nothing else has been written to them yet.
+            with open(output_file_path, 'rb') as original_file:
+                image_data = original_file.read()
+        self.originals[replaced_texture_hash] = (None, image_data, seconds)
+        for manifest_directory_path, manifest in self.manifests.items():
+            for output_file_name, manifest_original_path in list(manifest.items()):
+                if manifest_original_path == output_file_path:
+                    del manifest[output_file_name]
+                    self.unwritten_byte_count -= len(image_data)
+                    self.write_original(os.path.join(manifest_directory_path, output_file_name),
+                                        replaced_texture_hash, image_data, seconds)
+
+    def write_original(self, output_file_path, texture_hash, image_data, seconds):
+        self.claim_output_file_path(output_file_path, texture_hash)
+        self.output_writer.write(output_file_path, image_data)
+        self.originals[texture_hash] = (output_file_path, image_data, seconds)
+
+    def add_original(self, texture_hash, output_file_path, image_data, seconds):
+        """Records the image file exported for the first texture with a hash; the caller writes it."""
+        if image_data is not None:
+            self.claim_output_file_path(output_file_path, texture_hash)
+        self.originals[texture_hash] = (None if image_data is None else output_file_path, image_data, seconds)
+        for duplicate_output_file_path in self.waiting_duplicates.pop(texture_hash, ()):
+            self.ready_duplicates.append((duplicate_output_file_path, texture_hash))
+
+    def write_ready_duplicates(self, texture_records):
+        """Writes (or lists) every duplicate whose original has been exported; returns how many there were."""
+        ready_duplicates, self.ready_duplicates = self.ready_duplicates, []
+        for output_file_path, texture_hash in ready_duplicates:
+            original_output_file_path, image_data, seconds = self.originals[texture_hash]
+            self.duplicate_count += 1
+            self.saved_seconds += seconds
+
+            was_written = True
+            if image_data is None and original_output_file_path is None:
+                was_written = False
+            elif original_output_file_path is None:
+                # The original's file was replaced by another texture's, so this duplicate takes its place.
+                self.write_original(output_file_path, texture_hash, image_data, seconds)
+            elif output_file_path == original_output_file_path:
+                pass
+            elif self.mode == "link":
+                self.claim_output_file_path(output_file_path, texture_hash)
+                self.output_writer.link(output_file_path, original_output_file_path, image_data)
+            else:
+                self.manifests.setdefault(os.path.dirname(output_file_path), {})[
+                    os.path.basename(output_file_path)] = original_output_file_path
+                self.unwritten_byte_count += (os.path.getsize(original_output_file_path) if image_data is None
+                                              else len(image_data))
+                was_written = False
+            texture_records[os.path.basename(output_file_path)][1] = was_written
+        return len(ready_duplicates)
+
+    def write_manifests(self, output_sink):
+        """Writes {duplicate file name: path of its original, relative to the duplicate} to each output directory."""
+        output_directory_paths = set(self.manifests)
+        if output_sink.is_cached:
+            # Duplicates listed by earlier extractions into the same directory are kept, unless they have been
+            # written out since.
+            output_directory_paths.update(os.path.dirname(output_file_path) for output_file_path in self.written_paths)
+
+        for output_directory_path in sorted(output_directory_paths):
+            manifest_path = os.path.join(output_directory_path, DEDUP_MANIFEST_FILE_NAME)
+            manifest = dict((output_file_name, os.path.relpath(original_output_file_path,
+                                                               output_directory_path).replace(os.sep, "/"))
+                            for output_file_name, original_output_file_path in
+                            self.manifests.get(output_directory_path, {}).items())
+            if output_sink.is_cached and os.path.isfile(manifest_path):
+                try:
+                    with open(manifest_path, 'r', encoding='UTF-8') as manifest_file:
+                        earlier_manifest = json.load(manifest_file)
+                    manifest = dict(((output_file_name, original_path)
+                                     for output_file_name, original_path in earlier_manifest.items()
+                                     if os.path.join(output_directory_path, output_file_name) not in self.written_paths),
+                                    **manifest)
+                except (ValueError, TypeError, AttributeError):
+                    logging.warning(f"Replacing unreadable duplicate manifest {manifest_path}.")
+            elif not manifest:
+                continue
+            self.output_writer.write(manifest_path, json.dumps(manifest, indent=1, sort_keys=True).encode())
+
+    def finish_extraction(self):
+        """Keeps only what the next extraction needs: the path of each original's file, rather than its image data."""
+        for texture_hash, (output_file_path, image_data, seconds) in list(self.originals.items()):
+            if output_file_path is None and image_data is not None:
+                # The original's file has been replaced, and its image data is not worth keeping in memory.
+                del self.originals[texture_hash]
+            else:
+                self.originals[texture_hash] = (output_file_path, None, seconds)
+        self.output_writer = None
+        self.written_paths = set()
+        self.manifests = {}
+        self.duplicate_count = 0
+        self.saved_seconds = 0.0
+        self.unwritten_byte_count = 0
+
+    def log_summary(self, output_sink):
+        saved_byte_count = self.unwritten_byte_count + output_sink.linked_byte_count
+        logging.info(f"\n{self.duplicate_count} duplicate texture(s) were not decoded or encoded again, saving "
+                     f"{self.saved_seconds:.2f} s of CPU time and {saved_byte_count / 2 ** 20:.1f} MiB of image data.")
@@ -1,27 +1,177 @@
+import functools
+import struct
+
+from .pvrtc import decode_pvrtc_2bpp, decode_pvrtc_4bpp
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def convert_bit_depth(value, current_bit_depth, new_bit_depth):
+    return int(round(value * (float((2 ** new_bit_depth) - 1) / float((2 ** current_bit_depth) - 1))))
+
+
+# Every table below is built the first time it is needed, and kept from then on.
+
+
+@functools.lru_cache(maxsize=None)
+def get_bit_depth_conversion_table(current_bit_depth, new_bit_depth):
+    return bytes(convert_bit_depth(value, current_bit_depth, new_bit_depth) for value in range(2 ** current_bit_depth))
+
+
+@functools.lru_cache(maxsize=None)
+def get_bit_depth_conversion_array(current_bit_depth, new_bit_depth):
+    return np.frombuffer(get_bit_depth_conversion_table(current_bit_depth, new_bit_depth), dtype=np.uint8)
+
+
+# Encodings with at most this many bits per pixel are decoded through a table with an entry for every packed value
+# (65536 entries for 16-bit encodings), so that each pixel takes a single lookup rather than one per channel.
+maximum_pixel_table_bit_depth = 16
+
+
+@functools.lru_cache(maxsize=None)
+def get_pixel_table(encoding, target_bit_depth):
+    """Returns the bytes of each packed pixel value's channels, at the target bit depth, indexed by that value."""
+    conversion_tables = [get_bit_depth_conversion_table(bit_count, target_bit_depth)
+                         for bit_count in encoding.channels]
+    return tuple(bytes(conversion_table[(packed_pixel_value & bit_mask) >> bit_shift]
+                       for bit_shift, bit_mask, conversion_table in zip(encoding.bit_shifts, encoding.bit_masks,
+                                                                        conversion_tables))
+                 for packed_pixel_value in range(2 ** encoding.stride_in_bits))
+
+
+@functools.lru_cache(maxsize=None)
+def get_pixel_table_array(encoding, target_bit_depth):
+    """The NumPy version of get_pixel_table: a (packed values x channels) array of uint8 channel values."""
+    packed_pixel_values = np.arange(2 ** encoding.stride_in_bits, dtype=np.uint32)
+    pixel_table_array = np.empty((packed_pixel_values.size, len(encoding.channels)), dtype=np.uint8)
+    for channel_index, (bit_count, bit_shift, bit_mask) in enumerate(
+            zip(encoding.channels, encoding.bit_shifts, encoding.bit_masks)):
+        conversion_array = get_bit_depth_conversion_array(bit_count, target_bit_depth)
+        pixel_table_array[:, channel_index] = conversion_array[(packed_pixel_values & bit_mask) >> bit_shift]
+    return pixel_table_array
+
+
 class Encoding:
     """A packed pixel encoding."""
 
-    def __init__(self, channels=None):
+    def __init__(self, channels=None, name=None):
         super(Encoding, self).__init__()
         self.channels = channels
+        self.name = name
+        self.is_compressed = False
         if self.channels:
             self.stride_in_bits = sum(self.channels)
             self.has_alpha = (len(self.channels) == 4)
             self.is_greyscale = (len(self.channels) == 1)
+            self.bit_shifts = [sum(self.channels[channel_index + 1:])
+                               for channel_index in range(len(self.channels))]
+            self.bit_masks = [(((2 ** bit_count) - 1) << bit_shift)
+                              for bit_count, bit_shift in zip(self.channels, self.bit_shifts)]
         else:
             self.stride_in_bits = None
             self.has_alpha = None
             self.is_greyscale = None
+            self.bit_shifts = None
+            self.bit_masks = None
+
+    def __reduce__(self):
+        # Encodings are compared by identity, so they are pickled as references to the module-level instances.
+        return self.name
+
+    def unpack_packed_pixels(self, buffer, pixel_count):
+        """Splits a buffer into one packed integer per pixel; a NumPy array if available, else a tuple or list."""
+        if np is not None:
+            return self._unpack_packed_pixel_array(buffer, pixel_count)
+
+        if self.stride_in_bits == 32:
+            return struct.unpack(">{}L".format(pixel_count), buffer)
+        elif self.stride_in_bits == 16:
+            return struct.unpack("<{}H".format(pixel_count), buffer)
+        elif self.stride_in_bits == 8:
+            return struct.unpack("<{}B".format(pixel_count), buffer)
+
+        intermediate_packed_pixels = struct.unpack("<{}B".format((pixel_count * self.stride_in_bits) // 8), buffer)
+        packed_pixels = []
+        bit_mask = ((2 ** self.stride_in_bits) - 1)
+        pixels_per_byte = (8 // self.stride_in_bits)
+        for byte in intermediate_packed_pixels:
+            for i in range(pixels_per_byte):
+                packed_pixels.append((byte >> (self.stride_in_bits * (pixels_per_byte - i - 1))) & bit_mask)
+        return packed_pixels
+
+    def _unpack_packed_pixel_array(self, buffer, pixel_count):
+        if self.stride_in_bits == 32:
+            return np.frombuffer(buffer, dtype='>u4', count=pixel_count)
+        elif self.stride_in_bits == 16:
+            return np.frombuffer(buffer, dtype='<u2', count=pixel_count)
+        elif self.stride_in_bits == 8:
+            return np.frombuffer(buffer, dtype=np.uint8, count=pixel_count)
+
+        # Sub-byte strides store their first pixel in the most significant bits of each byte.
+        intermediate_packed_pixels = np.frombuffer(buffer, dtype=np.uint8,
+                                                   count=(pixel_count * self.stride_in_bits) // 8)
+        bit_mask = ((2 ** self.stride_in_bits) - 1)
+        pixels_per_byte = (8 // self.stride_in_bits)
+        bit_shifts = np.arange(pixels_per_byte - 1, -1, -1, dtype=np.uint8) * self.stride_in_bits
+        return ((intermediate_packed_pixels[:, np.newaxis] >> bit_shifts) & bit_mask).ravel()
+
+    def unpack_pixels(self, packed_pixels, target_bit_depth):
+        """Expands packed pixels into a flat list of channel values, without NumPy."""
+        if self.stride_in_bits <= maximum_pixel_table_bit_depth:
+            return list(b''.join(map(get_pixel_table(self, target_bit_depth).__getitem__, packed_pixels)))
+
+        conversion_tables = [get_bit_depth_conversion_table(bit_count, target_bit_depth) for bit_count in self.channels]
+        return [conversion_table[(packed_pixel_value & bit_mask) >> bit_shift]
+                for packed_pixel_value in packed_pixels
+                for bit_shift, bit_mask, conversion_table in zip(self.bit_shifts, self.bit_masks, conversion_tables)]
+
+    def unpack_pixel_array(self, packed_pixels, width, height, target_bit_depth):
+        """Expands packed pixels into a height x width x channels array of uint8 channel values. Requires NumPy."""
+        packed_pixel_array = np.asarray(packed_pixels).reshape(height, width)
+        if self.stride_in_bits <= maximum_pixel_table_bit_depth:
+            # np.take gathers whole rows of the table several times faster than fancy indexing does.
+            return np.take(get_pixel_table_array(self, target_bit_depth), packed_pixel_array, axis=0)
+        if packed_pixel_array.dtype == np.dtype('>u4') and target_bit_depth == 8 and self.channels == [8, 8, 8, 8]:
+            # Big-endian 32-bit pixels already hold one byte per channel, in order; they are copied so that they can
+            # be modified.
+            return packed_pixel_array.view(np.uint8).reshape(height, width, 4).copy()
+
+        pixel_array = np.empty((height, width, len(self.channels)), dtype=np.uint8)
+        for channel_index, (bit_count, bit_shift, bit_mask) in enumerate(
+                zip(self.channels, self.bit_shifts, self.bit_masks)):
+            conversion_array = get_bit_depth_conversion_array(bit_count, target_bit_depth)
+            pixel_array[..., channel_index] = conversion_array[(packed_pixel_array & bit_mask) >> bit_shift]
+        return pixel_array
+
+
+class CompressedEncoding(Encoding):
+    """A block-compressed encoding, whose image data is decoded straight to 8-bit RGBA. Requires NumPy."""
+
+    def __init__(self, bits_per_pixel, decode, name=None):
+        super(CompressedEncoding, self).__init__([8, 8, 8, 8], name)
+        self.stride_in_bits = bits_per_pixel
+        self.is_compressed = True
+        self.decode = decode
+
+    def unpack_packed_pixels(self, buffer, pixel_count):
+        # Blocks cannot be split into pixels on their own, so the image data is decoded as a whole instead.
+        return buffer
+
+    def unpack_pixel_array(self, packed_pixels, width, height, target_bit_depth):
+        return self.decode(packed_pixels, width, height)
 
 
-R8G8B8A8 = Encoding([8, 8, 8, 8])
-R5G6B5 = Encoding([5, 6, 5])
-R4G4B4A4 = Encoding([4, 4, 4, 4])
-R5G5B5A1 = Encoding([5, 5, 5, 1])
-L8 = Encoding([8])
-RAW = Encoding()
-PVRTC4BPP = Encoding([4])
-PVRTC2BPP = Encoding([2])
+R8G8B8A8 = Encoding([8, 8, 8, 8], "R8G8B8A8")
+R5G6B5 = Encoding([5, 6, 5], "R5G6B5")
+R4G4B4A4 = Encoding([4, 4, 4, 4], "R4G4B4A4")
+R5G5B5A1 = Encoding([5, 5, 5, 1], "R5G5B5A1")
+L8 = Encoding([8], "L8")
+RAW = Encoding(name="RAW")
+PVRTC4BPP = CompressedEncoding(4, decode_pvrtc_4bpp, "PVRTC4BPP")
+PVRTC2BPP = CompressedEncoding(2, decode_pvrtc_2bpp, "PVRTC2BPP")
 
 __all__ = [
     "R8G8B8A8",
@@ -1,12 +1,20 @@
+import collections
+import concurrent.futures
+import contextlib
 import logging
 import os
 import re
-import zipfile
+import signal
+import time
 from pathlib import Path
 
-from .encoding import *
+from .cache import ExtractionCache, get_texture_hash
+from .dedup import TextureDeduplicator
+from .input_reader import iter_binary_blobs
+from .metrics import measure_stage, take_worker_stage_records
+from .output_sink import BackgroundOutputWriter, open_output_sink
 from .texture_reader import extract_textures_from_binary_blob
-from .texture_writer import export_to_image_file
+from .texture_writer import encode_texture, export_to_image_file, np
 
 MONSTER_NAME_REGEX = re.compile(r'^(MONS_)(\d+)(\..+)$', flags=re.IGNORECASE)
 
@@ -33,20 +41,144 @@ def get_output_file_name(suggested_file_name, files_written):
     return output_file_name
 
 
-def do_extract(settings):
-    for input_file_path in settings.input_files:
-        output_directory_path = (settings.output_directory or os.path.dirname(input_file_path))
+def get_output_file_names(textures, is_animated, input_file_path, settings, files_written):
+    """Returns the output file name of each texture read from one blob of an input file, in order."""
+    output_file_names = []
+    basename = os.path.basename(input_file_path)
+    for c, texture in enumerate(textures, 1):
+        output_file_name = get_output_file_name(texture.name, files_written)
+        if is_animated and settings.rename_enabled:
+            try:
+                mid = int(re.search(r'\d+', basename).group())
+            except AttributeError:
+                raise ValueError(f"Unable to rename non-monster file {basename}.") from None
+            output_file_name = f"MONS_{mid:04d}_{c:03d}.PNG"
+        output_file_names.append(output_file_name)
+    return output_file_names
 
-        if zipfile.is_zipfile(input_file_path):
-            with zipfile.ZipFile(input_file_path, 'r') as apk_file:
-                file_contents = apk_file.read('assets/DATA001.BIN')
 
-        else:
-            with open(input_file_path, 'rb') as binary_file:
-                file_contents = binary_file.read()
+class LogRecordCollector(logging.Handler):
+    """A logging handler which keeps the records it receives so that a worker process can return them."""
+
+    def __init__(self):
+        super(LogRecordCollector, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        # Format the message now; its arguments and traceback may not survive being pickled.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+
+
+def initialize_worker(log_level, ignore_interrupts=False):
+    # Worker processes hand their log records back to the parent instead of writing them out themselves.
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+    root_logger.setLevel(log_level)
+    if ignore_interrupts:
+        # Leave it to the parent to stop (and shut the pool down) when interrupted.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def run_in_worker(function, *args):
+    log_record_collector = LogRecordCollector()
+    root_logger = logging.getLogger()
+    root_logger.addHandler(log_record_collector)
+    try:
+        return function(*args), log_record_collector.records, take_worker_stage_records()
+    finally:
+        root_logger.removeHandler(log_record_collector)
+
+
+def map_in_worker_pool(executor, function, argument_tuples, window_size, profiler=None):
+    # Yields each argument tuple with its result, in submission order, while keeping at most `window_size` jobs in
+    # flight so that large inputs are not all queued up (and pickled) at once. Log records from each job are replayed
+    # in the parent as it completes, and its stage measurements are merged into the parent's profiler.
+    pending_futures = collections.deque()
+    argument_tuples = iter(argument_tuples)
+    while True:
+        while len(pending_futures) < window_size:
+            arguments = next(argument_tuples, None)
+            if arguments is None:
+                break
+            pending_futures.append((arguments, executor.submit(run_in_worker, function, *arguments)))
+        if not pending_futures:
+            return
+        arguments, future = pending_futures.popleft()
+        result, log_records, stage_records = future.result()
+        for log_record in log_records:
+            logging.getLogger(log_record.name).handle(log_record)
+        if profiler is not None:
+            profiler.merge(stage_records)
+        yield arguments, result
+
+
+def can_decode_texture(texture, output_file_path):
+    if texture.encoding.is_compressed and np is None:
+        logging.warning(
+            f"Skipping {os.path.basename(output_file_path)}; it is encoded using PVR texture compression,"
+            " which can only be decoded when NumPy is installed.")
+        return False
+    return True
+
+
+def export_texture(texture, output_file_path, settings):
+    if not can_decode_texture(texture, output_file_path):
+        return False
+    return export_to_image_file(texture, output_file_path, settings)
 
-        logging.info("\nReading {}... ".format(input_file_path))
-        textures, is_animated = list(extract_textures_from_binary_blob(file_contents))
+
+def encode_exported_texture(texture, output_file_path, settings):
+    """Returns the contents of a texture's image file, or None if no file should be written for it."""
+    if not can_decode_texture(texture, output_file_path):
+        return None
+    image_data = encode_texture(texture, settings)
+    # Copied, so that it can be sent back from a worker process and holds no view of the input file.
+    return bytes(image_data) if any(image_data) else None
+
+
+def encode_exported_texture_with_cpu_time(texture, output_file_path, settings):
+    # Returns the CPU time spent encoding as well, which deduplication reports as saved for each duplicate.
+    start_time = time.process_time()
+    image_data = encode_exported_texture(texture, output_file_path, settings)
+    return image_data, time.process_time() - start_time
+
+
+def get_output_directory_path(input_file_path, settings):
+    return settings.output_directory or os.path.dirname(input_file_path)
+
+
+def iter_export_arguments(input_file_path, settings, cached_texture_records, texture_records):
+    """Yields (texture, output file path, settings) for each of an input file's textures which needs exporting.
+
+    Every texture is recorded in `texture_records` as {output file name: [texture hash, whether a file was written]},
+    including those left alone because `cached_texture_records` showed them to be up to date.
+    """
+    output_directory_path = get_output_directory_path(input_file_path, settings)
+    # Output names are always assigned here, in manifest order, so that collision numbering does not depend on the
+    # order in which worker processes finish.
+    files_written = {}
+    binary_blobs = iter_binary_blobs(input_file_path)
+    while True:
+        with measure_stage(settings.profiler, "read", input_file=input_file_path) as stage_record:
+            member_name, binary_blob = next(binary_blobs, (None, None))
+            stage_record.bytes_out = None if binary_blob is None else len(binary_blob)
+        if binary_blob is None:
+            break
+
+        if member_name is None:
+            logging.info("\nReading {}... ".format(input_file_path))
+        else:
+            logging.info("\nReading {} from {}... ".format(member_name, input_file_path))
+        with measure_stage(settings.profiler, "parse", input_file=input_file_path,
+                           bytes_in=len(binary_blob)) as stage_record:
+            textures, is_animated = extract_textures_from_binary_blob(binary_blob)
+            stage_record.bytes_out = sum(len(texture.buffer) for texture in textures)
         logging.info("{} texture{} found.\n".format(str(len(textures)) if any(textures) else "No",
                                                     "" if len(textures) == 1 else "s"))
 
@@ -57,23 +189,188 @@ def do_extract(settings):
             # to determine if we need to extract a video.
             # This is currently unused
             # Path(input_file_without_extension + '.isanimated').touch()
-            return
+            continue
 
-        basename = os.path.basename(input_file_path)
-        files_written = {}
-        for c, texture in enumerate(textures, 1):
-            output_file_name = get_output_file_name(texture.name, files_written)
-            if is_animated and settings.rename_enabled:
-                try:
-                    mid = int(re.search(r'\d+', basename).group())
-                except AttributeError:
-                    raise ValueError(f"Unable to rename non-monster file {basename}.") from None
-                output_file_name = f"MONS_{mid:04d}_{c:03d}.PNG"
+        for texture, output_file_name in zip(textures, get_output_file_names(
+                textures, is_animated, input_file_path, settings, files_written)):
+            if not settings.is_texture_included(output_file_name):
+                # Skipped before its image data is hashed, so none of it is ever read.
+                continue
+            output_file_path = os.path.join(output_directory_path, output_file_name)
+            texture_hash = get_texture_hash(texture)
+            cached_texture_record = cached_texture_records.get(output_file_name)
+            if cached_texture_record and cached_texture_record[0] == texture_hash and (
+                    not cached_texture_record[1] or os.path.isfile(output_file_path)):
+                logging.info(f"Skipping {output_file_name}; unchanged since the last extraction.")
+                texture_records[output_file_name] = cached_texture_record
+                continue
 
             logging.info(f"Writing {output_file_name} ({texture.width} x {texture.height})...")
-            if texture.encoding in (PVRTC2BPP, PVRTC4BPP):
-                logging.warning(
-                    f"{output_file_name} is encoded using PVR texture compression."
-                    " This format is not yet supported by the Puzzle & Dragons Texture Tool.")
-            output_file_path = os.path.join(output_directory_path, output_file_name)
-            export_to_image_file(texture, output_file_path, settings)
+            texture_records[output_file_name] = [texture_hash, False]
+            yield texture, output_file_path, settings
+
+
+def record_exported_texture(texture_records, output_file_path, image_data, seconds, write_image_file,
+                            deduplicator=None):
+    """Records an exported texture and writes its image file, along with any duplicates of it that were waiting on it.
+
+    Returns how many textures were exported, counting those duplicates.
+    """
+    texture_record = texture_records[os.path.basename(output_file_path)]
+    if deduplicator is not None:
+        deduplicator.add_original(texture_record[0], output_file_path, image_data, seconds)
+    if image_data is not None:
+        write_image_file(output_file_path, image_data)
+    texture_record[1] = image_data is not None
+    if deduplicator is None:
+        return 1
+    return 1 + deduplicator.write_ready_duplicates(texture_records)
+
+
+def extract_file(input_file_path, settings, cached_texture_records=None, executor=None, output_writer=None,
+                 deduplicator=None):
+    """Extracts one input file's textures.
+
+    Returns {output file name: [texture hash, whether a file was written]} for every texture in the file, along with
+    the number of textures which were left alone because `cached_texture_records` showed them to be up to date. Image
+    files are handed to `output_writer`; without one (as in a worker process), they are returned as a list of
+    (output file path, image data) for the caller to write instead. Textures identical to one already exported are
+    left to `deduplicator`, if there is one, rather than being exported again.
+    """
+    texture_records = {}
+    pending_output_files = []
+    export_arguments = iter_export_arguments(input_file_path, settings, cached_texture_records or {}, texture_records)
+    if deduplicator is not None:
+        export_arguments = deduplicator.filter_export_arguments(export_arguments, texture_records)
+    if executor is None:
+        export_results = ((arguments, encode_exported_texture_with_cpu_time(*arguments))
+                          for arguments in export_arguments)
+    else:
+        export_results = map_in_worker_pool(executor, encode_exported_texture_with_cpu_time, export_arguments,
+                                            2 * settings.jobs, settings.profiler)
+
+    if output_writer is None:
+        def write_image_file(output_file_path, image_data):
+            pending_output_files.append((output_file_path, image_data))
+    else:
+        write_image_file = output_writer.write
+
+    exported_texture_count = 0
+    for (_, output_file_path, _), (image_data, seconds) in export_results:
+        exported_texture_count += record_exported_texture(texture_records, output_file_path, image_data, seconds,
+                                                          write_image_file, deduplicator)
+    if deduplicator is not None:
+        exported_texture_count += deduplicator.write_ready_duplicates(texture_records)
+
+    return texture_records, len(texture_records) - exported_texture_count, pending_output_files
+
+
+def get_extraction_cache(caches, input_file_path, settings):
+    # Each output directory has a cache of its own; `caches` holds those loaded so far, by directory.
+    output_directory_path = get_output_directory_path(input_file_path, settings)
+    if output_directory_path not in caches:
+        caches[output_directory_path] = ExtractionCache(output_directory_path)
+    return caches[output_directory_path]
+
+
+def plan_extraction(settings, caches, is_cached=True):
+    """Returns argument tuples for extract_file for each input file which needs extracting, and how many do not."""
+    extract_arguments = []
+    unchanged_input_count = 0
+    for input_file_path in settings.input_files:
+        if settings.force_enabled or not is_cached:
+            extract_arguments.append((input_file_path, settings))
+            continue
+
+        cache = get_extraction_cache(caches, input_file_path, settings)
+        if cache.is_input_unchanged(input_file_path, settings.cache_key):
+            logging.info("\nSkipping {}; unchanged since the last extraction.".format(input_file_path))
+            unchanged_input_count += 1
+        else:
+            extract_arguments.append(
+                (input_file_path, settings, cache.get_texture_records(input_file_path, settings.cache_key)))
+    return extract_arguments, unchanged_input_count
+
+
+def get_extracted_file_paths(settings, caches):
+    return [output_file_path for input_file_path in settings.input_files
+            for output_file_path in get_extraction_cache(caches, input_file_path, settings).get_output_file_paths(
+                input_file_path)]
+
+
+def log_extraction_summary(settings, unchanged_input_count, reused_texture_count, exported_texture_count):
+    logging.info(f"\n{unchanged_input_count} of {len(settings.input_files)} input file(s) unchanged since the last "
+                 f"extraction; {reused_texture_count} texture(s) reused and {exported_texture_count} exported.")
+
+
+def do_extract(settings, output_sink=None, executor=None, caches=None, deduplicator=None):
+    """Extracts every input file's textures and returns the paths of the extracted image files.
+
+    Files are written to `output_sink`, or by default to the sink for the settings' output format. Only directory
+    extractions keep an extraction cache; anything else extracts every input file in full. With more than one job,
+    the work is shared out between the worker processes of `executor`, or of a process pool started for the purpose.
+
+    Successive extractions with the same settings (as in watch mode) can share `caches`, a dict of the extraction
+    caches loaded so far by output directory, and (for directory extractions) a `deduplicator`, so that neither is
+    loaded or built again for each one.
+    """
+    if output_sink is None:
+        output_sink = open_output_sink(settings)
+    if caches is None:
+        caches = {}
+    reused_texture_count = exported_texture_count = 0
+    extract_arguments, unchanged_input_count = plan_extraction(settings, caches, output_sink.is_cached)
+
+    with contextlib.ExitStack() as exit_stack:
+        output_writer = exit_stack.enter_context(BackgroundOutputWriter(output_sink, settings.profiler))
+        if settings.dedup_mode is None:
+            deduplicator = None
+        elif deduplicator is None:
+            deduplicator = TextureDeduplicator(settings.dedup_mode)
+        if deduplicator is not None:
+            deduplicator.output_writer = output_writer
+            if output_sink.is_cached and not settings.force_enabled:
+                deduplicator.add_earlier_extractions(caches, settings.cache_key)
+        try:
+            if settings.jobs <= 1:
+                extract_results = ((arguments, extract_file(*arguments, output_writer=output_writer,
+                                                            deduplicator=deduplicator))
+                                   for arguments in extract_arguments)
+            else:
+                if executor is None:
+                    executor = exit_stack.enter_context(concurrent.futures.ProcessPoolExecutor(
+                        settings.jobs, initializer=initialize_worker,
+                        initargs=(logging.getLogger().getEffectiveLevel(),)))
+                # A single input (such as an APK's DATA001.BIN) is split up by texture; otherwise each file is a job.
+                # Deduplication needs to see every texture before it is encoded, so it splits every input that way.
+                if len(extract_arguments) == 1 or deduplicator is not None:
+                    extract_results = ((arguments, extract_file(*arguments, executor=executor,
+                                                                output_writer=output_writer,
+                                                                deduplicator=deduplicator))
+                                       for arguments in extract_arguments)
+                else:
+                    extract_results = map_in_worker_pool(executor, extract_file, extract_arguments, 2 * settings.jobs,
+                                                         settings.profiler)
+
+            for (input_file_path, *_), (texture_records, reused_count, pending_output_files) in extract_results:
+                for output_file_path, image_data in pending_output_files:
+                    output_writer.write(output_file_path, image_data)
+                if output_sink.is_cached:
+                    get_extraction_cache(caches, input_file_path, settings).update(
+                        input_file_path, settings.cache_key, texture_records)
+                reused_texture_count += reused_count
+                exported_texture_count += len(texture_records) - reused_count
+            if deduplicator is not None:
+                deduplicator.write_manifests(output_sink)
+        finally:
+            for cache in caches.values():
+                if cache.is_modified:
+                    cache.save()
+
+    log_extraction_summary(settings, unchanged_input_count, reused_texture_count, exported_texture_count)
+    if deduplicator is not None:
+        deduplicator.log_summary(output_sink)
+        deduplicator.finish_extraction()
+    if not output_sink.is_cached:
+        return output_sink.written_paths
+    return get_extracted_file_paths(settings, caches)
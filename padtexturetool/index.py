@@ -0,0 +1,197 @@
+"""Indexes of the textures in input files, built from their manifests alone, which let selected textures be extracted
+by seeking straight to their image data instead of scanning every block of their blobs again."""
+import csv
+import json
+import logging
+import os
+
+from .extract import encode_exported_texture, get_output_directory_path, get_output_file_names
+from .input_reader import iter_binary_blobs, read_binary_blob
+from .output_sink import BackgroundOutputWriter, open_output_sink
+from .texture import Texture
+from .texture_reader import encodings, extract_textures_from_binary_blob
+
+INDEX_FORMAT_VERSION = 2
+index_fields = ("input_file", "input_size", "input_mtime_ns", "member", "name", "texture_name", "encoding", "width",
+                "height", "given_width", "given_height", "animated", "skipped", "offset", "byte_count")
+boolean_index_fields = ("animated", "skipped")
+integer_index_fields = ("input_size", "input_mtime_ns", "width", "height", "given_width", "given_height", "offset",
+                        "byte_count")
+encodings_by_name = dict((encoding.name, encoding) for encoding in encodings.values())
+
+
+def is_texture_entry(entry):
+    # Input files without any textures are indexed all the same, with a single entry which names no texture.
+    return entry["name"] is not None
+
+
+def index_input_file(input_file_path, settings):
+    """Returns an index entry for every texture in an input file, without decoding any of them.
+
+    Textures from animated blobs are marked as skipped unless animations are enabled, as extractions would skip them.
+    """
+    input_file_stat = os.stat(input_file_path)
+    entries = []
+    files_written = {}
+    for member_name, binary_blob in iter_binary_blobs(input_file_path):
+        textures, is_animated = extract_textures_from_binary_blob(binary_blob)
+        # Extractions skip animated blobs unless animations are enabled, so their textures' names must not take up
+        # any of the names the textures after them would otherwise be given.
+        is_skipped = is_animated and not settings.animations_enabled
+        output_file_names = get_output_file_names(textures, is_animated, input_file_path, settings,
+                                                  dict(files_written) if is_skipped else files_written)
+        for texture, output_file_name in zip(textures, output_file_names):
+            entries.append({
+                "input_file": input_file_path,
+                "input_size": input_file_stat.st_size,
+                "input_mtime_ns": input_file_stat.st_mtime_ns,
+                "member": member_name,
+                "name": output_file_name,
+                "texture_name": texture.name,
+                "encoding": texture.encoding.name,
+                "width": texture.width,
+                "height": texture.height,
+                "given_width": texture.given_width,
+                "given_height": texture.given_height,
+                "animated": is_animated,
+                "skipped": is_skipped,
+                "offset": texture.offset,
+                "byte_count": len(texture.buffer),
+            })
+    if not entries:
+        # Recorded so that the input file is not read again until it changes.
+        entries.append(dict((field, None) for field in index_fields))
+        entries[0].update({
+            "input_file": input_file_path,
+            "input_size": input_file_stat.st_size,
+            "input_mtime_ns": input_file_stat.st_mtime_ns,
+            "animated": False,
+            "skipped": False,
+        })
+    return entries
+
+
+def read_index(index_file_path):
+    """Reads the entries of an index written by write_index."""
+    if os.path.splitext(index_file_path)[1].lower() == ".csv":
+        with open(index_file_path, 'r', newline='', encoding='UTF-8') as index_file:
+            entries = list(csv.DictReader(index_file))
+        for entry in entries:
+            for field in integer_index_fields:
+                entry[field] = int(entry[field]) if entry[field] else None
+            for field in ("member", "name", "texture_name", "encoding"):
+                entry[field] = entry[field] or None
+            for field in boolean_index_fields:
+                # Indexes written before a field was added are missing it, and are indexed again.
+                entry[field] = entry.pop(field) == "True"
+        return entries
+
+    with open(index_file_path, 'r', encoding='UTF-8') as index_file:
+        index_contents = json.load(index_file)
+    if index_contents.get("version") != INDEX_FORMAT_VERSION:
+        return []
+    return index_contents["textures"]
+
+
+def write_index(entries, index_file_path):
+    """Writes index entries to a CSV file, or (for any other extension) a JSON file."""
+    if os.path.splitext(index_file_path)[1].lower() == ".csv":
+        with open(index_file_path, 'w', newline='', encoding='UTF-8') as index_file:
+            writer = csv.DictWriter(index_file, fieldnames=index_fields)
+            writer.writeheader()
+            writer.writerows(entries)
+    else:
+        with open(index_file_path, 'w', encoding='UTF-8') as index_file:
+            json.dump({"version": INDEX_FORMAT_VERSION, "textures": entries}, index_file, indent=1)
+
+
+def load_index(settings):
+    """Returns index entries for every input file, reusing any up-to-date entries from the settings' index file.
+
+    Input files which have changed since they were indexed (or which were never indexed, or were indexed with animations
+    enabled when they are now disabled, or the other way around) are indexed again, and the index file is rewritten to
+    include them. Only entries for textures are returned.
+    """
+    entries_by_input_file = {}
+    if settings.index_path and os.path.isfile(settings.index_path):
+        try:
+            for entry in read_index(settings.index_path):
+                entries_by_input_file.setdefault(entry["input_file"], []).append(entry)
+        except (ValueError, KeyError):
+            logging.warning(f"Ignoring unreadable index {settings.index_path}.")
+
+    entries = []
+    is_index_changed = False
+    for input_file_path in settings.input_files:
+        input_file_stat = os.stat(input_file_path)
+        input_entries = entries_by_input_file.get(input_file_path)
+        if not input_entries or (input_entries[0]["input_size"], input_entries[0]["input_mtime_ns"]) != (
+                input_file_stat.st_size, input_file_stat.st_mtime_ns) or any(
+                entry["animated"] and entry["skipped"] == settings.animations_enabled for entry in input_entries):
+            logging.info("Indexing {}...".format(input_file_path))
+            input_entries = index_input_file(input_file_path, settings)
+            is_index_changed = True
+        entries.extend(input_entries)
+
+    if settings.index_path and is_index_changed:
+        write_index(entries, settings.index_path)
+    return [entry for entry in entries if is_texture_entry(entry)]
+
+
+def format_index(entries):
+    lines = ["{:<32} {:>11} {:<10} {:>11} {:<8} {:>10} {:>10}  {}".format(
+        "name", "size", "encoding", "given size", "animated", "offset", "bytes", "source")]
+    for entry in entries:
+        lines.append("{:<32} {:>11} {:<10} {:>11} {:<8} {:>10} {:>10}  {}".format(
+            entry["name"], "{}x{}".format(entry["width"], entry["height"]), entry["encoding"],
+            "{}x{}".format(entry["given_width"], entry["given_height"]),
+            ("skipped" if entry["skipped"] else "yes") if entry["animated"] else "no",
+            entry["offset"], entry["byte_count"],
+            entry["input_file"] if entry["member"] is None else "{}:{}".format(entry["input_file"], entry["member"])))
+    return "\n".join(lines)
+
+
+def extract_selected_textures(entries, selected_names, settings, output_writer):
+    """Extracts the indexed textures with the given output file names to an output writer.
+
+    Each texture's image data is read straight from the offset recorded for it; unencrypted files are memory-mapped,
+    so only the selected textures' pages are ever read.
+    """
+    selected_entries = [entry for entry in entries if entry["name"] in selected_names]
+    for missing_name in sorted(set(selected_names) - set(entry["name"] for entry in selected_entries)):
+        logging.warning(f"{missing_name} is not in the index.")
+    for skipped_entry in (entry for entry in selected_entries if entry["skipped"]):
+        logging.warning(f"Skipping {skipped_entry['name']}; animations not enabled")
+    selected_entries = [entry for entry in selected_entries if not entry["skipped"]]
+
+    container_key, binary_blob_view = None, None
+    for entry in selected_entries:
+        if container_key != (entry["input_file"], entry["member"]):
+            container_key = (entry["input_file"], entry["member"])
+            binary_blob_view = memoryview(read_binary_blob(*container_key))
+
+        image_data = binary_blob_view[entry["offset"]:entry["offset"] + entry["byte_count"]]
+        texture = Texture(entry["width"], entry["height"], entry["texture_name"], image_data,
+                          encodings_by_name[entry["encoding"]], entry["given_width"], entry["given_height"],
+                          entry["offset"])
+        output_file_path = os.path.join(get_output_directory_path(entry["input_file"], settings), entry["name"])
+        logging.info(f"Writing {entry['name']} ({texture.width} x {texture.height})...")
+        image_data = encode_exported_texture(texture, output_file_path, settings)
+        if image_data is not None:
+            output_writer.write(output_file_path, image_data)
+
+
+def do_index(settings):
+    """Indexes every input file, then lists and/or extracts the textures selected by the settings."""
+    entries = load_index(settings)
+    # The index file keeps every texture; the texture globs only limit what is listed and extracted.
+    entries = [entry for entry in entries if settings.is_texture_included(entry["name"])]
+    if settings.list_enabled:
+        print(format_index(entries))
+    if not settings.selected_texture_names:
+        return []
+
+    output_sink = open_output_sink(settings)
+    with BackgroundOutputWriter(output_sink, settings.profiler) as output_writer:
+        extract_selected_textures(entries, settings.selected_texture_names, settings, output_writer)
+    return output_sink.written_paths
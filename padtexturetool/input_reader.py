@@ -0,0 +1,162 @@
+import io
+import mmap
+import os
+import zipfile
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from .texture_reader import (decrypt_and_decompress_binary_blob, decrypt_and_decompress_binary_stream,
+                             encrypted_texture_magic_string, texture_container_magic_strings)
+
+# Older versions of the tool only ever read this member of an APK, so it is read first to keep its output file names
+# (and their collision numbering) the same as they have always been.
+primary_apk_member_name = 'assets/DATA001.BIN'
+magic_string_sniff_size = max(len(magic_string) for magic_string in texture_container_magic_strings)
+# Files found by walking a directory are only read if their first few bytes show that they may hold textures.
+input_file_sniff_size = 16
+# A local file header, or the end of central directory record of an empty archive.
+zip_magic_strings = (b'PK\x03\x04', b'PK\x05\x06')
+
+
+def is_texture_container(header: bytes) -> bool:
+    return header.startswith(texture_container_magic_strings)
+
+
+def get_input_file_kind(file_path: str) -> Optional[str]:
+    """Returns "encrypted", "texture" or "zip" for a file which may hold textures, judging by its first few bytes, or
+    None for any other file."""
+    try:
+        with open(file_path, 'rb') as binary_file:
+            header = binary_file.read(input_file_sniff_size)
+    except OSError:
+        return None
+    if header.startswith(encrypted_texture_magic_string):
+        return "encrypted"
+    if is_texture_container(header):
+        return "texture"
+    if header.startswith(zip_magic_strings):
+        return "zip"
+    return None
+
+
+def iter_directory_files(directory_path: str) -> Iterator[os.DirEntry]:
+    """Yields an entry for each file in a directory and its sub-directories, in the same order as os.walk would."""
+    try:
+        with os.scandir(directory_path) as entries:
+            entries = list(entries)
+    except OSError:
+        return
+    sub_directory_paths = []
+    for entry in entries:
+        try:
+            is_directory = entry.is_dir()
+        except OSError:
+            is_directory = False
+        if not is_directory:
+            yield entry
+        elif not entry.is_symlink():
+            sub_directory_paths.append(entry.path)
+    for sub_directory_path in sub_directory_paths:
+        yield from iter_directory_files(sub_directory_path)
+
+
+def get_texture_apk_member_names(apk_file: zipfile.ZipFile) -> Iterator[str]:
+    member_names = [member.filename for member in apk_file.infolist() if not member.is_dir()]
+    if primary_apk_member_name in member_names:
+        yield primary_apk_member_name
+
+    for member_name in member_names:
+        if member_name == primary_apk_member_name:
+            continue
+        with apk_file.open(member_name) as member_file:
+            header = member_file.read(magic_string_sniff_size)
+        if is_texture_container(header):
+            yield member_name
+
+
+def map_unencrypted_file(binary_file) -> Optional[mmap.mmap]:
+    """Memory-maps a file which does not need decrypting, or returns None (leaving the file at its start) otherwise.
+
+    Textures read from a mapped file are views of it, so only the pages holding the image data which actually gets
+    decoded are ever read in.
+    """
+    header = binary_file.read(len(encrypted_texture_magic_string))
+    binary_file.seek(0)
+    if header == encrypted_texture_magic_string:
+        return None
+    try:
+        return mmap.mmap(binary_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # Empty files and anything else which cannot be mapped are read normally instead.
+        return None
+
+
+def iter_apk_binary_blobs(apk_file_path_or_stream) -> Iterator[Tuple[str, bytes]]:
+    with zipfile.ZipFile(apk_file_path_or_stream, 'r') as apk_file:
+        for member_name in get_texture_apk_member_names(apk_file):
+            # Members are decrypted and inflated as they are read, rather than read into memory whole first.
+            with apk_file.open(member_name) as member_file:
+                binary_blob = decrypt_and_decompress_binary_stream(member_file)
+            yield member_name, binary_blob
+
+
+def is_zip_stream(binary_stream: BinaryIO) -> bool:
+    if not binary_stream.seekable():
+        return False
+    start_position = binary_stream.tell()
+    try:
+        return zipfile.is_zipfile(binary_stream)
+    finally:
+        binary_stream.seek(start_position)
+
+
+def iter_binary_blobs(source) -> Iterator[Tuple[Optional[str], bytes]]:
+    """Yields (APK member name or None, decrypted and inflated contents) for each texture container in a source.
+
+    The source may be a path, a bytes-like object or a binary file object.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        if zipfile.is_zipfile(io.BytesIO(source)):
+            yield from iter_apk_binary_blobs(io.BytesIO(source))
+        else:
+            yield None, decrypt_and_decompress_binary_blob(source)
+
+    elif not isinstance(source, (str, os.PathLike)):
+        if is_zip_stream(source):
+            yield from iter_apk_binary_blobs(source)
+        else:
+            yield None, decrypt_and_decompress_binary_stream(source)
+
+    elif zipfile.is_zipfile(source):
+        yield from iter_apk_binary_blobs(source)
+
+    else:
+        with open(source, 'rb') as binary_file:
+            mapped_file = map_unencrypted_file(binary_file)
+            if mapped_file is None:
+                binary_blob = decrypt_and_decompress_binary_stream(binary_file)
+        if mapped_file is None:
+            yield None, binary_blob
+            return
+
+        try:
+            yield None, mapped_file
+        finally:
+            try:
+                mapped_file.close()
+            except BufferError:
+                # Textures still hold views into the mapping; it is unmapped once the last of them is released.
+                pass
+
+
+def read_binary_blob(input_file_path: str, member_name: Optional[str] = None) -> bytes:
+    """Reads the decrypted and inflated contents of one texture container: a file, or a member of an APK."""
+    if member_name is not None:
+        with zipfile.ZipFile(input_file_path, 'r') as apk_file, apk_file.open(member_name) as member_file:
+            return decrypt_and_decompress_binary_stream(member_file)
+
+    with open(input_file_path, 'rb') as binary_file:
+        mapped_file = map_unencrypted_file(binary_file)
+        if mapped_file is not None:
+            # The mapping is closed once the last view of it is released.
+            return mapped_file
+        return decrypt_and_decompress_binary_stream(binary_file)
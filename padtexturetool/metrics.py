@@ -0,0 +1,134 @@
+import collections
+import contextlib
+import csv
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# Profilers which have been sent to a worker process record into this list instead of their own, so that the records
+# can be handed back to the parent process (see take_worker_stage_records) after each job.
+worker_stage_records = []
+
+
+class StageRecord:
+    """The measurements taken for one run of one stage of the extraction pipeline."""
+
+    __slots__ = ("stage", "input_file", "texture", "seconds", "bytes_in", "bytes_out", "peak_allocation")
+    fields = __slots__
+
+    def __init__(self, stage, input_file=None, texture=None, seconds=None, bytes_in=None, bytes_out=None,
+                 peak_allocation=None):
+        super(StageRecord, self).__init__()
+        self.stage = stage
+        self.input_file = input_file
+        self.texture = texture
+        self.seconds = seconds
+        self.bytes_in = bytes_in
+        self.bytes_out = bytes_out
+        self.peak_allocation = peak_allocation
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in self.fields)
+
+
+class Profiler:
+    """Records the duration, data sizes and (optionally) peak memory allocation of each stage of an extraction.
+
+    Any object with a compatible `measure` method can be used in place of a Profiler.
+    """
+
+    def __init__(self, trace_memory=False):
+        super(Profiler, self).__init__()
+        self.trace_memory = trace_memory
+        self.stage_records = []
+        self.tracing_thread_id = None
+
+    def __getstate__(self):
+        return {"trace_memory": self.trace_memory}
+
+    def __setstate__(self, state):
+        self.trace_memory = state["trace_memory"]
+        self.stage_records = worker_stage_records
+        self.tracing_thread_id = None
+
+    @contextlib.contextmanager
+    def measure(self, stage, input_file=None, texture=None, bytes_in=None):
+        """Times the body of a `with` block. The block may set `bytes_out` on the StageRecord it is given."""
+        stage_record = StageRecord(stage, input_file, texture, bytes_in=bytes_in)
+        # Resetting the peak is process-wide, so only the first thread to measure a stage traces memory; stages measured
+        # on any other thread (such as the output writer's) are only timed, rather than wiping the peak being traced.
+        if self.trace_memory and self.tracing_thread_id is None:
+            self.tracing_thread_id = threading.get_ident()
+        trace_memory = self.trace_memory and self.tracing_thread_id == threading.get_ident()
+        if trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            allocation_before, _ = tracemalloc.get_traced_memory()
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+
+        start_time = time.perf_counter()
+        try:
+            yield stage_record
+        finally:
+            stage_record.seconds = time.perf_counter() - start_time
+            if trace_memory:
+                _, peak_allocation = tracemalloc.get_traced_memory()
+                stage_record.peak_allocation = max(0, peak_allocation - allocation_before)
+            self.stage_records.append(stage_record)
+
+    def merge(self, stage_records):
+        self.stage_records.extend(stage_records)
+
+    def summarize(self):
+        """Returns {stage: totals} for each stage, in the order the stages were first seen."""
+        summary = collections.OrderedDict()
+        for stage_record in self.stage_records:
+            totals = summary.setdefault(stage_record.stage, {
+                "count": 0, "seconds": 0.0, "bytes_in": 0, "bytes_out": 0, "peak_allocation": None})
+            totals["count"] += 1
+            totals["seconds"] += stage_record.seconds
+            totals["bytes_in"] += stage_record.bytes_in or 0
+            totals["bytes_out"] += stage_record.bytes_out or 0
+            if stage_record.peak_allocation is not None:
+                totals["peak_allocation"] = max(totals["peak_allocation"] or 0, stage_record.peak_allocation)
+        return summary
+
+    def format_summary(self):
+        summary = self.summarize()
+        total_seconds = sum(totals["seconds"] for totals in summary.values()) or 1
+        lines = ["{:<14} {:>7} {:>10} {:>6} {:>10} {:>10} {:>10} {:>12}".format(
+            "stage", "count", "total s", "%", "mean ms", "MiB in", "MiB out", "peak KiB")]
+        for stage, totals in summary.items():
+            lines.append("{:<14} {:>7} {:>10.3f} {:>6.1f} {:>10.2f} {:>10.1f} {:>10.1f} {:>12}".format(
+                stage, totals["count"], totals["seconds"], 100 * totals["seconds"] / total_seconds,
+                1000 * totals["seconds"] / totals["count"], totals["bytes_in"] / 2 ** 20, totals["bytes_out"] / 2 ** 20,
+                "-" if totals["peak_allocation"] is None else "{:.0f}".format(totals["peak_allocation"] / 1024)))
+        return "\n".join(lines)
+
+    def write_report(self, report_path):
+        """Writes every stage record to a CSV file, or (for any other extension) a JSON file."""
+        if os.path.splitext(report_path)[1].lower() == ".csv":
+            with open(report_path, 'w', newline='', encoding='UTF-8') as report_file:
+                writer = csv.DictWriter(report_file, fieldnames=StageRecord.fields)
+                writer.writeheader()
+                writer.writerows(stage_record.to_dict() for stage_record in self.stage_records)
+        else:
+            with open(report_path, 'w', encoding='UTF-8') as report_file:
+                json.dump({"summary": self.summarize(),
+                           "stages": [stage_record.to_dict() for stage_record in self.stage_records]},
+                          report_file, indent=2)
+
+
+def measure_stage(profiler, stage, input_file=None, texture=None, bytes_in=None):
+    if profiler is None:
+        return contextlib.nullcontext(StageRecord(stage))
+    return profiler.measure(stage, input_file, texture, bytes_in)
+
+
+def take_worker_stage_records():
+    stage_records = list(worker_stage_records)
+    del worker_stage_records[:]
+    return stage_records
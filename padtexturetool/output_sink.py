@@ -0,0 +1,261 @@
+"""Destinations for extracted image files, and a thread which writes to them in the background."""
+import io
+import os
+import queue
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+
+from .metrics import measure_stage
+
+output_formats = ("directory", "zip", "tar")
+
+
+class OutputSink:
+    """Somewhere to write extracted image files to.
+
+    Files are identified by the paths they would be written to by a directory extraction; `written_paths` records
+    what each one was written as, in order, and `linked_byte_count` how much image data links saved writing again.
+    """
+
+    # Only directory extractions keep an extraction cache, since the cache is only valid alongside the files it lists.
+    is_cached = False
+
+    def __init__(self):
+        super(OutputSink, self).__init__()
+        self.written_paths = []
+        self.linked_byte_count = 0
+
+    def write(self, output_file_path, image_data):
+        raise NotImplementedError
+
+    def link(self, output_file_path, original_output_file_path, image_data):
+        """Writes a file identical to one written earlier. Sinks which cannot link files simply write it again."""
+        self.write(output_file_path, image_data)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class DirectoryOutputSink(OutputSink):
+    """Writes each image to its own file."""
+
+    is_cached = True
+
+    def __init__(self):
+        super(DirectoryOutputSink, self).__init__()
+        self.created_directory_paths = set()
+
+    def write(self, output_file_path, image_data):
+        # Each output directory is only created (or checked for) once per run.
+        output_directory_path = os.path.dirname(output_file_path)
+        if output_directory_path not in self.created_directory_paths:
+            os.makedirs(output_directory_path, exist_ok=True)
+            self.created_directory_paths.add(output_directory_path)
+        # Files are replaced rather than overwritten in place, in case they are hardlinked to a duplicate.
+        try:
+            os.unlink(output_file_path)
+        except FileNotFoundError:
+            pass
+        with open(output_file_path, 'wb') as output_file_handle:
+            output_file_handle.write(image_data)
+        self.written_paths.append(output_file_path)
+
+    def link(self, output_file_path, original_output_file_path, image_data):
+        # The original may have been written by an earlier run, in which case its image data is not at hand.
+        try:
+            os.unlink(output_file_path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.link(original_output_file_path, output_file_path)
+            self.linked_byte_count += os.path.getsize(output_file_path)
+        except OSError:
+            # Not every file system supports hardlinks.
+            shutil.copyfile(original_output_file_path, output_file_path)
+        self.written_paths.append(output_file_path)
+
+
+class ArchiveOutputSink(OutputSink):
+    """Streams every image into a single archive file, named by its path relative to the archive's path.
+
+    Members cannot be replaced once they are written, so writing a second file to the same path raises a ValueError
+    rather than leaving two members of that name in the archive.
+    """
+
+    def __init__(self, archive_path):
+        super(ArchiveOutputSink, self).__init__()
+        self.archive_path = archive_path
+        self.member_names = set()
+        archive_directory_path = os.path.dirname(archive_path)
+        if archive_directory_path:
+            os.makedirs(archive_directory_path, exist_ok=True)
+
+    def get_member_name(self, output_file_path):
+        return os.path.relpath(output_file_path, self.archive_path).replace(os.sep, "/")
+
+    def add_member_name(self, output_file_path):
+        member_name = self.get_member_name(output_file_path)
+        if member_name in self.member_names:
+            raise ValueError("{} has already been written to {}; archives cannot replace their members.".format(
+                member_name, self.archive_path))
+        self.member_names.add(member_name)
+        return member_name
+
+    def write(self, output_file_path, image_data):
+        member_name = self.add_member_name(output_file_path)
+        self.write_member(member_name, image_data)
+        self.written_paths.append(member_name)
+
+    def write_member(self, member_name, image_data):
+        raise NotImplementedError
+
+
+class ZipOutputSink(ArchiveOutputSink):
+    def __init__(self, archive_path):
+        super(ZipOutputSink, self).__init__(archive_path)
+        # PNG and JPEG data is already compressed, so members are stored as they are.
+        self.zip_file = zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_STORED)
+
+    def write_member(self, member_name, image_data):
+        self.zip_file.writestr(zipfile.ZipInfo(member_name, time.localtime()[:6]), image_data)
+
+    def close(self):
+        self.zip_file.close()
+
+
+class TarOutputSink(ArchiveOutputSink):
+    def __init__(self, archive_path):
+        super(TarOutputSink, self).__init__(archive_path)
+        self.tar_file = tarfile.open(archive_path, 'w')
+
+    def write_member(self, member_name, image_data):
+        tar_info = tarfile.TarInfo(member_name)
+        tar_info.size = len(image_data)
+        tar_info.mtime = int(time.time())
+        self.tar_file.addfile(tar_info, io.BytesIO(image_data))
+
+    def link(self, output_file_path, original_output_file_path, image_data):
+        member_name = self.add_member_name(output_file_path)
+        tar_info = tarfile.TarInfo(member_name)
+        tar_info.type = tarfile.LNKTYPE
+        tar_info.linkname = self.get_member_name(original_output_file_path)
+        tar_info.mtime = int(time.time())
+        self.tar_file.addfile(tar_info)
+        self.linked_byte_count += len(image_data)
+        self.written_paths.append(member_name)
+
+    def close(self):
+        self.tar_file.close()
+
+
+class MemoryOutputSink(OutputSink):
+    """Keeps every image in `files`, as {output file path: image data}."""
+
+    def __init__(self):
+        super(MemoryOutputSink, self).__init__()
+        self.files = {}
+
+    def write(self, output_file_path, image_data):
+        self.files[output_file_path] = bytes(image_data)
+        self.written_paths.append(output_file_path)
+
+    def link(self, output_file_path, original_output_file_path, image_data):
+        # Both paths share a single bytes object.
+        self.files[output_file_path] = self.files[original_output_file_path]
+        self.linked_byte_count += len(image_data)
+        self.written_paths.append(output_file_path)
+
+
+def open_output_sink(settings):
+    if settings.output_format == "directory":
+        return DirectoryOutputSink()
+    if settings.output_directory is None:
+        raise ValueError("Writing {} archives requires an output path for the archive.".format(settings.output_format))
+    if settings.output_format == "zip":
+        return ZipOutputSink(settings.output_directory)
+    if settings.output_format == "tar":
+        return TarOutputSink(settings.output_directory)
+    raise ValueError("Unsupported output format \"{}\"; expected one of: {}.".format(
+        settings.output_format, ", ".join(output_formats)))
+
+
+class BackgroundOutputWriter:
+    """Writes image files to an output sink from a background thread, so that decoding and encoding never wait on
+    storage.
+
+    Whatever has been queued up by the time the thread wakes is written as one batch. At most `queue_size` files wait
+    at once; beyond that, write() blocks until the thread catches up. An error raised while writing is raised again
+    from the next call to write() or close(), and closing the writer also closes its sink.
+    """
+
+    def __init__(self, output_sink, profiler=None, queue_size=64):
+        super(BackgroundOutputWriter, self).__init__()
+        self.output_sink = output_sink
+        self.profiler = profiler
+        self.pending_files = queue.Queue(queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.write_pending_files, name="padtexturetool-writer", daemon=True)
+        self.thread.start()
+
+    def write_pending_files(self):
+        while True:
+            batch = [self.pending_files.get()]
+            while True:
+                try:
+                    batch.append(self.pending_files.get_nowait())
+                except queue.Empty:
+                    break
+
+            for pending_file in batch:
+                if pending_file is None:
+                    return
+                # Once writing has failed, the rest of the queue is only drained, so that write() never blocks.
+                if self.error is None:
+                    write, output_file_path, *arguments, image_data = pending_file
+                    try:
+                        with measure_stage(self.profiler, write.__name__, texture=os.path.basename(output_file_path),
+                                           bytes_in=None if image_data is None else len(image_data)):
+                            write(output_file_path, *arguments, image_data)
+                    except BaseException as error:
+                        self.error = error
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, output_file_path, image_data):
+        self.raise_error()
+        self.pending_files.put((self.output_sink.write, output_file_path, image_data))
+
+    def link(self, output_file_path, original_output_file_path, image_data=None):
+        self.raise_error()
+        self.pending_files.put((self.output_sink.link, output_file_path, original_output_file_path, image_data))
+
+    def close(self):
+        try:
+            if self.thread.is_alive():
+                self.pending_files.put(None)
+                self.thread.join()
+        finally:
+            self.output_sink.close()
+        self.raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        try:
+            self.close()
+        except BaseException:
+            # An error which is already being raised takes precedence over one from writing.
+            if exc_type is None:
+                raise
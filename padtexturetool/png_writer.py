@@ -0,0 +1,129 @@
+import collections
+import concurrent.futures
+import struct
+import zlib
+
+png_signature = b'\x89PNG\r\n\x1a\n'
+# Compressed image data is split into IDAT chunks of (at most) this many bytes.
+image_data_chunk_size = 2 ** 20
+# When several threads are allowed, images with at least this many bytes of (filtered) image data are compressed in
+# bands of about `parallel_compression_band_size` bytes, one band per thread at a time.
+parallel_compression_threshold = 2 ** 22
+parallel_compression_band_size = 2 ** 19
+# Deflate can refer back this many bytes, so each band is primed with this much of the band before it.
+deflate_window_size = 2 ** 15
+
+GREYSCALE = 0
+TRUECOLOR = 2
+INDEXED = 3
+TRUECOLOR_WITH_ALPHA = 6
+
+no_filter = b'\0'
+channels_per_colour_type = {GREYSCALE: 1, TRUECOLOR: 3, INDEXED: 1, TRUECOLOR_WITH_ALPHA: 4}
+
+
+def write_chunk(stream, chunk_type, data=b''):
+    stream.write(struct.pack(">I", len(data)))
+    stream.write(chunk_type)
+    stream.write(data)
+    stream.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+
+def get_rows(pixel_bytes, row_size):
+    pixel_view = memoryview(pixel_bytes).cast('B')
+    return (pixel_view[row_start:row_start + row_size] for row_start in range(0, len(pixel_view), row_size))
+
+
+def iter_compressed_image_data(rows, compression_level):
+    # Yields the zlib stream of the image data, one piece per row.
+    compressor = zlib.compressobj(compression_level)
+    for row in rows:
+        # Each row is prefixed with its filter type; rows are stored unfiltered.
+        yield compressor.compress(no_filter) + compressor.compress(row)
+    yield compressor.flush()
+
+
+def iter_bands(rows, band_size):
+    band = []
+    band_length = 0
+    for row in rows:
+        band.append(no_filter)
+        band.append(row)
+        band_length += len(no_filter) + memoryview(row).nbytes
+        if band_length >= band_size:
+            yield b''.join(band)
+            band, band_length = [], 0
+    if band:
+        yield b''.join(band)
+
+
+def compress_band(band, dictionary, compression_level):
+    # Each band is compressed as raw deflate data ending on a byte boundary, so that the bands can simply be joined.
+    # Priming the compressor with the end of the previous band lets it refer back into that band, as a single stream
+    # would, so splitting the image up costs very little compression.
+    dictionary_argument = {"zdict": dictionary} if dictionary else {}
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -zlib.MAX_WBITS, **dictionary_argument)
+    return compressor.compress(band) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def iter_compressed_image_data_in_parallel(rows, compression_level, threads):
+    """Yields the same zlib stream as iter_compressed_image_data (though not the same bytes), compressed by bands on
+    several threads; zlib releases the GIL while it compresses."""
+    # The zlib header only depends on the compression level.
+    yield zlib.compress(b'', compression_level)[:2]
+    checksum = zlib.adler32(b'')
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        pending_bands = collections.deque()
+        dictionary = None
+        for band in iter_bands(rows, parallel_compression_band_size):
+            checksum = zlib.adler32(band, checksum)
+            pending_bands.append(executor.submit(compress_band, band, dictionary, compression_level))
+            dictionary = band[-deflate_window_size:]
+            if len(pending_bands) > 2 * threads:
+                yield pending_bands.popleft().result()
+        while pending_bands:
+            yield pending_bands.popleft().result()
+    # An empty final block ends the deflate data, followed by the checksum of all of the bands.
+    yield zlib.compressobj(compression_level, zlib.DEFLATED, -zlib.MAX_WBITS).flush()
+    yield struct.pack(">I", checksum)
+
+
+def write_png(stream, width, height, rows, colour_type, bit_depth=8, palette=None, text=None,
+              compression_level=zlib.Z_DEFAULT_COMPRESSION, threads=1):
+    """Writes a PNG image to a stream.
+
+    `rows` yields one bytes-like object per row of pixels. Indexed images take a `palette` of RGB or RGBA tuples, in
+    which every RGBA colour must come before every RGB colour. `text` is a {keyword: bytes} dict of tEXt chunks. Large
+    images are compressed on up to `threads` threads.
+    """
+    stream.write(png_signature)
+    write_chunk(stream, b'IHDR', struct.pack(">IIBBBBB", width, height, bit_depth, colour_type, 0, 0, 0))
+
+    if palette is not None:
+        write_chunk(stream, b'PLTE', b''.join(bytes(colour[:3]) for colour in palette))
+        alpha_values = bytes(colour[3] for colour in palette if len(colour) == 4)
+        if alpha_values:
+            write_chunk(stream, b'tRNS', alpha_values)
+
+    image_data_size = height * (len(no_filter) + (width * channels_per_colour_type[colour_type] * bit_depth + 7) // 8)
+    if threads > 1 and image_data_size >= parallel_compression_threshold:
+        compressed_image_data = iter_compressed_image_data_in_parallel(rows, compression_level, threads)
+    else:
+        compressed_image_data = iter_compressed_image_data(rows, compression_level)
+
+    compressed_chunks = []
+    compressed_size = 0
+    for compressed_data in compressed_image_data:
+        if compressed_data:
+            compressed_chunks.append(compressed_data)
+            compressed_size += len(compressed_data)
+        if compressed_size >= image_data_chunk_size:
+            write_chunk(stream, b'IDAT', b''.join(compressed_chunks))
+            compressed_chunks, compressed_size = [], 0
+    write_chunk(stream, b'IDAT', b''.join(compressed_chunks))
+
+    # Text comes after the image data, where earlier versions of the tool (which added it to pypng's output) put it.
+    for keyword, value in (text or {}).items():
+        write_chunk(stream, b'tEXt', keyword.encode('latin-1') + b'\0' + value)
+
+    write_chunk(stream, b'IEND')
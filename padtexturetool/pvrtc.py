@@ -0,0 +1,202 @@
+"""A decoder for PowerVR texture compression (PVRTC) image data, vectorized across blocks with NumPy."""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Every block of 4x4 (4bpp) or 8x4 (2bpp) pixels is stored as a 64-bit word: 32 bits of modulation data followed by
+# 32 bits of colour data.
+block_height = 4
+# The modulation weights (out of 8) given to colour B by each 2-bit modulation value.
+standard_modulation_weights = [0, 3, 5, 8]
+punch_through_modulation_weights = [0, 4, 4, 8]
+# In punch-through mode, this modulation value also makes a pixel fully transparent.
+punch_through_modulation_value = 2
+
+
+def get_twiddled_indices(x_indices, y_indices, x_block_count, y_block_count):
+    # Blocks are stored in Morton order, with the Y bit of each pair of interleaved bits being the least significant.
+    # Once the smaller dimension's bits run out, the larger dimension's remaining bits are appended as they are.
+    twiddled_indices = np.zeros(np.broadcast(x_indices, y_indices).shape, dtype=np.int64)
+    shift_count = 0
+    while (1 << shift_count) < min(x_block_count, y_block_count):
+        twiddled_indices |= ((y_indices >> shift_count) & 1) << (2 * shift_count)
+        twiddled_indices |= ((x_indices >> shift_count) & 1) << (2 * shift_count + 1)
+        shift_count += 1
+    remaining_indices = x_indices if x_block_count > y_block_count else y_indices
+    twiddled_indices |= (remaining_indices >> shift_count) << (2 * shift_count)
+    return twiddled_indices
+
+
+def get_colours(colour_data):
+    """Returns the A and B colours of each block as arrays of 5-bit red, green and blue and 4-bit alpha."""
+    colour_data = colour_data.astype(np.int64)
+    colours_a = np.empty(colour_data.shape + (4,), dtype=np.int16)
+    colours_b = np.empty(colour_data.shape + (4,), dtype=np.int16)
+
+    # Colour A is stored in bits 1-15 as RGB554 when bit 15 is set, or as ARGB3443 otherwise.
+    opaque = (colour_data & 0x8000) != 0
+    colours_a[..., 0] = np.where(opaque, (colour_data >> 10) & 0x1F, expand_bits((colour_data >> 8) & 0xF, 4, 5))
+    colours_a[..., 1] = np.where(opaque, (colour_data >> 5) & 0x1F, expand_bits((colour_data >> 4) & 0xF, 4, 5))
+    colours_a[..., 2] = np.where(opaque, expand_bits((colour_data >> 1) & 0xF, 4, 5),
+                                 expand_bits((colour_data >> 1) & 0x7, 3, 5))
+    colours_a[..., 3] = np.where(opaque, 0xF, ((colour_data >> 12) & 0x7) << 1)
+
+    # Colour B is stored in bits 16-31 as RGB555 when bit 31 is set, or as ARGB3444 otherwise.
+    opaque = (colour_data & 0x80000000) != 0
+    colours_b[..., 0] = np.where(opaque, (colour_data >> 26) & 0x1F, expand_bits((colour_data >> 24) & 0xF, 4, 5))
+    colours_b[..., 1] = np.where(opaque, (colour_data >> 21) & 0x1F, expand_bits((colour_data >> 20) & 0xF, 4, 5))
+    colours_b[..., 2] = np.where(opaque, (colour_data >> 16) & 0x1F, expand_bits((colour_data >> 16) & 0xF, 4, 5))
+    colours_b[..., 3] = np.where(opaque, 0xF, ((colour_data >> 28) & 0x7) << 1)
+    return colours_a, colours_b
+
+
+def expand_bits(values, current_bit_count, new_bit_count):
+    # Widens values by repeating their most significant bits in the new low bits.
+    return (values << (new_bit_count - current_bit_count)) | (values >> (2 * current_bit_count - new_bit_count))
+
+
+def get_neighbour_weights(block_size):
+    # Returns the weights given to the previous, current and next block's colour at each pixel offset within a block.
+    offsets = np.arange(block_size, dtype=np.int16) - block_size // 2
+    second_block_weights = offsets % block_size
+    first_block_weights = block_size - second_block_weights
+    # Pixels in the first half of a block lie between the previous block's centre and this one's; the rest lie between
+    # this block's centre and the next one's.
+    is_first_half = offsets < 0
+    return (np.where(is_first_half, first_block_weights, 0),
+            np.where(is_first_half, second_block_weights, first_block_weights),
+            np.where(is_first_half, 0, second_block_weights))
+
+
+def upscale_colours(colours, block_width):
+    """Bilinearly upscales per-block colours to one 8-bit RGBA colour per pixel.
+
+    Each block's colour sits at the centre of the block, so every pixel is a blend of the (wrapped-around) 2x2 blocks
+    whose centres surround it.
+    """
+    y_block_count, x_block_count = colours.shape[:2]
+    height, width = y_block_count * block_height, x_block_count * block_width
+
+    # Blend vertically into one row of per-block colours for each row of pixels.
+    previous_weights, current_weights, next_weights = (weights[:, np.newaxis, np.newaxis]
+                                                       for weights in get_neighbour_weights(block_height))
+    colours = colours[:, np.newaxis]
+    rows = (np.roll(colours, 1, axis=0) * previous_weights + colours * current_weights +
+            np.roll(colours, -1, axis=0) * next_weights).reshape(height, x_block_count, 4)
+
+    # Then horizontally, working on whole rows of channel values (rather than 4-channel pixels) at a time since NumPy
+    # is much faster with long inner loops.
+    def get_row_weights(block_weights):
+        return np.repeat(np.tile(block_weights, x_block_count), 4)
+
+    previous_weights, current_weights, next_weights = (get_row_weights(weights)
+                                                       for weights in get_neighbour_weights(block_width))
+    upscaled_colours = np.repeat(np.roll(rows, 1, axis=1), block_width, axis=1).reshape(height, width * 4)
+    upscaled_colours *= previous_weights
+    upscaled_colours += np.repeat(rows, block_width, axis=1).reshape(height, width * 4) * current_weights
+    upscaled_colours += (np.repeat(np.roll(rows, -1, axis=1), block_width, axis=1).reshape(height, width * 4) *
+                         next_weights)
+
+    # The weights sum to 2^k, so the 5-bit colour and 4-bit alpha channels are now 5+k and 4+k bits wide.
+    k = (block_width * block_height).bit_length() - 1
+    high_bit_shifts = np.tile(np.array([k + 2, k + 2, k + 2, k], dtype=np.int16), width)
+    low_bit_shifts = np.tile(np.array([k - 3, k - 3, k - 3, k - 4], dtype=np.int16), width)
+    pixel_array = ((upscaled_colours >> high_bit_shifts) + (upscaled_colours >> low_bit_shifts)).astype(np.uint8)
+    return pixel_array.reshape(height, width, 4)
+
+
+def get_block_pixels(block_values, block_width):
+    # Rearranges (y blocks, x blocks, block height, block width) values into a (height, width) image.
+    y_block_count, x_block_count = block_values.shape[:2]
+    return block_values.transpose(0, 2, 1, 3).reshape(y_block_count * block_height, x_block_count * block_width)
+
+
+def get_4bpp_modulation(modulation_data, colour_data):
+    """Returns each pixel's modulation weight (out of 8) and whether it is punched through to full transparency."""
+    bit_shifts = (2 * np.arange(16, dtype=np.uint32)).reshape(block_height, 4)
+    modulation_values = get_block_pixels((modulation_data[..., np.newaxis, np.newaxis] >> bit_shifts) & 3, 4)
+    punch_through = get_block_pixels(np.broadcast_to(
+        (colour_data & 1).astype(bool)[..., np.newaxis, np.newaxis], modulation_data.shape + (block_height, 4)), 4)
+
+    modulation_weights = np.where(punch_through, np.array(punch_through_modulation_weights, dtype=np.uint8)[
+        modulation_values], np.array(standard_modulation_weights, dtype=np.uint8)[modulation_values])
+    return modulation_weights, punch_through & (modulation_values == punch_through_modulation_value)
+
+
+def get_2bpp_modulation(modulation_data, colour_data):
+    """Returns each pixel's modulation weight (out of 8); 2bpp textures have no punch-through alpha."""
+    block_shape = modulation_data.shape + (block_height, 8)
+    y_offsets, x_offsets = np.indices((block_height, 8), dtype=np.uint32)
+    is_direct = (colour_data & 1) == 0
+
+    # Blocks in the direct mode store one bit per pixel, which selects either colour A or colour B. Otherwise only the
+    # pixels in a checkerboard pattern store a 2-bit value, and the rest are interpolated from their neighbours: both
+    # horizontally and vertically if bit 0 is clear, or else horizontally if bit 20 is clear and vertically if it is
+    # set. Bits 0 and 20 are then replaced by copies of bits 1 and 21, the high bits of the values stored there.
+    is_stored = ((x_offsets ^ y_offsets) & 1) == 0
+    bit_shifts = np.where(is_direct[..., np.newaxis, np.newaxis], y_offsets * 8 + x_offsets, 0).astype(np.uint32)
+    bit_shifts[~is_direct] = np.where(is_stored, np.cumsum(is_stored).reshape(is_stored.shape) * 2 - 2, 0)
+    bit_masks = np.where(is_direct, 1, 3).astype(np.uint32)[..., np.newaxis, np.newaxis]
+
+    interpolation_modes = np.where(modulation_data & 1, np.where(modulation_data & (1 << 20), 3, 2), 1)
+    replaced_bits = np.where(is_direct, 0, 1 | ((modulation_data & 1) << 20)).astype(np.uint32)
+    modulation_data = modulation_data ^ ((modulation_data ^ (modulation_data >> 1)) & replaced_bits)
+    modulation_values = ((modulation_data[..., np.newaxis, np.newaxis] >> bit_shifts) & bit_masks).astype(np.uint8)
+    # Direct values of 1 stand for the same weight as stored values of 3.
+    modulation_values *= np.where(is_direct, 3, 1).astype(np.uint8)[..., np.newaxis, np.newaxis]
+
+    modes = get_block_pixels(np.broadcast_to(np.where(is_direct, 0, interpolation_modes).astype(np.uint8)[
+        ..., np.newaxis, np.newaxis], block_shape), 8)
+    is_stored = (modes == 0) | get_block_pixels(np.broadcast_to(is_stored, block_shape), 8)
+
+    # Neighbours wrap around the edges of the image, as block colours do.
+    weights = np.array(standard_modulation_weights, dtype=np.uint8)[get_block_pixels(modulation_values, 8)]
+    above, below = np.roll(weights, 1, axis=0), np.roll(weights, -1, axis=0)
+    left, right = np.roll(weights, 1, axis=1), np.roll(weights, -1, axis=1)
+    interpolated_weights = np.select(
+        [modes == 1, modes == 2],
+        [(above + below + left + right + 2) // 4, (left + right + 1) // 2],
+        (above + below + 1) // 2)
+    return np.where(is_stored, weights, interpolated_weights).astype(np.uint8)
+
+
+def decode_pvrtc(buffer, width, height, bits_per_pixel):
+    """Decodes PVRTC image data into a height x width x 4 array of 8-bit RGBA values."""
+    block_width = 4 if bits_per_pixel == 4 else 8
+    # Textures are made of at least 2x2 blocks; smaller images are cropped out of the top-left corner.
+    x_block_count = max(-(-width // block_width), 2)
+    y_block_count = max(-(-height // block_height), 2)
+    word_count = x_block_count * y_block_count
+    if len(buffer) < word_count * 8:
+        buffer = bytes(buffer) + bytes(word_count * 8 - len(buffer))
+
+    words = np.frombuffer(buffer, dtype='<u4', count=word_count * 2).reshape(word_count, 2)
+    y_indices, x_indices = np.indices((y_block_count, x_block_count))
+    words = words[get_twiddled_indices(x_indices, y_indices, x_block_count, y_block_count)]
+    modulation_data, colour_data = words[..., 0], words[..., 1]
+
+    if bits_per_pixel == 4:
+        modulation_weights, punch_through = get_4bpp_modulation(modulation_data, colour_data)
+    else:
+        modulation_weights, punch_through = get_2bpp_modulation(modulation_data, colour_data), None
+
+    # Each pixel is (A * (8 - weight) + B * weight) // 8, which is A + ((B - A) * weight) // 8.
+    colours_a, colours_b = get_colours(colour_data)
+    pixel_array = upscale_colours(colours_a, block_width)
+    blended_differences = upscale_colours(colours_b, block_width).astype(np.int16)
+    blended_differences -= pixel_array
+    blended_differences *= modulation_weights[..., np.newaxis]
+    blended_differences >>= 3
+    pixel_array += blended_differences.astype(np.uint8)
+    if punch_through is not None:
+        pixel_array[punch_through, 3] = 0
+    return pixel_array[:height, :width]
+
+
+def decode_pvrtc_4bpp(buffer, width, height):
+    return decode_pvrtc(buffer, width, height, 4)
+
+
+def decode_pvrtc_2bpp(buffer, width, height):
+    return decode_pvrtc(buffer, width, height, 2)
@@ -1,13 +1,28 @@
 import argparse
+import fnmatch
+import logging
 import os
 
+from .cache import CACHE_FILE_NAME
+from .dedup import DEDUP_MANIFEST_FILE_NAME, dedup_modes
+from .input_reader import get_input_file_kind, iter_directory_files
+from .metrics import Profiler
+from .output_sink import output_formats
+
 
 class Settings:
     """A group of user-configurable settings which control how the script operates."""
 
-    def __init__(self, input_path=None, output_dir=None, trimming=True, blackening=True, animations=False):
-        self._input_files = []
+    def __init__(self, input_path=None, output_dir=None, trimming=True, blackening=True, animations=False, jobs=1,
+                 force=False, png_compression_level=None, profiler=None, output_format="directory",
+                 dedup=None, png_threads=1, include=None, exclude=None):
+        self._input_path = None
+        self._input_files = None
         self._output_directory = None
+        self._included_input_patterns = []
+        self._excluded_input_patterns = []
+        self._included_texture_patterns = list(include or [])
+        self._excluded_texture_patterns = list(exclude or [])
 
         self.set_input_path(input_path)
         self.set_output_directory(output_dir)
@@ -15,9 +30,49 @@ class Settings:
         self._blackening_enabled = blackening
         self._animations_enabled = animations
         self._rename_enabled = animations
+        self._jobs = jobs
+        self._force_enabled = force
+        self._png_compression_level = png_compression_level
+        self._profiler = profiler
+        self._profile_report_path = None
+        self._list_enabled = False
+        self._index_path = None
+        self._selected_texture_names = []
+        self._output_format = output_format
+        self._dedup_mode = dedup
+        self._png_threads = png_threads
+        self._watch_path = None
+        self._watch_interval = 1.0
+        self._watch_queue_size = 16
+
+    def copy_for_input_path(self, input_path):
+        """Returns settings which extract `input_path` as these settings would extract theirs.
+
+        Nothing mutable is shared with these settings: the input files are found again, and a Profiler is replaced by
+        a new one, whose records the caller can merge back in once the extraction is over.
+        """
+        settings = Settings(input_path, self.output_directory, self.trimming_enabled, self.blackening_enabled,
+                            self.animations_enabled, self.jobs, self.force_enabled, self.png_compression_level,
+                            self.profiler, self.output_format, self.dedup_mode, self.png_threads,
+                            self.included_texture_patterns, self.excluded_texture_patterns)
+        settings.set_rename_enabled(self.rename_enabled)
+        settings.set_included_input_patterns(list(self.included_input_patterns))
+        settings.set_excluded_input_patterns(list(self.excluded_input_patterns))
+        if isinstance(self.profiler, Profiler):
+            settings.set_profiler(Profiler(self.profiler.trace_memory))
+        return settings
 
     @property
     def input_files(self):
+        # Found on first use, so that input globs given after the input path still apply to it.
+        if self._input_files is None:
+            if self._input_path is not None and os.path.isfile(self._input_path):
+                self._input_files = [self._input_path]
+            elif self._input_path is not None and os.path.isdir(self._input_path):
+                self._input_files = find_input_files(self._input_path, self.included_input_patterns,
+                                                     self.excluded_input_patterns)
+            else:
+                self._input_files = []
         return self._input_files
 
     def set_input_path(self, value):
@@ -26,11 +81,45 @@ class Settings:
             if not os.path.exists(value):
                 raise argparse.ArgumentTypeError(
                     "The input path you specified (\"{}\") does not exist.".format(value))
-            elif os.path.isfile(value):
-                self._input_files = [value]
-            elif os.path.isdir(value):
-                self._input_files = [os.path.join(root, file)
-                                     for root, dirs, files in os.walk(value) for file in files]
+            self._input_path = value
+            self._input_files = None
+
+    @property
+    def included_input_patterns(self):
+        # Globs matched against the path (relative to the input folder) and name of each file found in the folder.
+        return self._included_input_patterns
+
+    def set_included_input_patterns(self, value):
+        self._included_input_patterns = value
+        self._input_files = None
+
+    @property
+    def excluded_input_patterns(self):
+        return self._excluded_input_patterns
+
+    def set_excluded_input_patterns(self, value):
+        self._excluded_input_patterns = value
+        self._input_files = None
+
+    @property
+    def included_texture_patterns(self):
+        # Globs matched, regardless of case, against the output file name of each texture.
+        return self._included_texture_patterns
+
+    def set_included_texture_patterns(self, value):
+        self._included_texture_patterns = value
+
+    @property
+    def excluded_texture_patterns(self):
+        return self._excluded_texture_patterns
+
+    def set_excluded_texture_patterns(self, value):
+        self._excluded_texture_patterns = value
+
+    def is_texture_included(self, output_file_name):
+        return matches_globs((output_file_name.upper(),),
+                             [pattern.upper() for pattern in self.included_texture_patterns],
+                             [pattern.upper() for pattern in self.excluded_texture_patterns])
 
     @property
     def output_directory(self):
@@ -40,6 +129,14 @@ class Settings:
         if value is not None:
             self._output_directory = os.path.abspath(value)
 
+    @property
+    def output_format(self):
+        # How extracted images are written; see output_sink.output_formats.
+        return self._output_format
+
+    def set_output_format(self, value):
+        self._output_format = value
+
     @property
     def trimming_enabled(self):
         return self._trimming_enabled
@@ -68,6 +165,187 @@ class Settings:
     def set_rename_enabled(self, value):
         self._rename_enabled = value
 
+    @property
+    def jobs(self):
+        return self._jobs
+
+    def set_jobs(self, value):
+        self._jobs = value
+
+    @property
+    def force_enabled(self):
+        return self._force_enabled
+
+    def set_force_enabled(self, value):
+        self._force_enabled = value
+
+    @property
+    def png_compression_level(self):
+        return self._png_compression_level
+
+    def set_png_compression_level(self, value):
+        self._png_compression_level = value
+
+    @property
+    def png_threads(self):
+        return self._png_threads
+
+    def set_png_threads(self, value):
+        self._png_threads = value
+
+    @property
+    def watch_path(self):
+        # A directory to watch for input files, or "-" to read the paths of input files from standard input.
+        return self._watch_path
+
+    def set_watch_path(self, value):
+        if value != "-":
+            value = os.path.abspath(value)
+            if not os.path.isdir(value):
+                raise argparse.ArgumentTypeError(
+                    "The folder you asked to watch (\"{}\") does not exist.".format(value))
+        self._watch_path = value
+
+    @property
+    def watch_interval(self):
+        return self._watch_interval
+
+    def set_watch_interval(self, value):
+        self._watch_interval = value
+
+    @property
+    def watch_queue_size(self):
+        return self._watch_queue_size
+
+    def set_watch_queue_size(self, value):
+        self._watch_queue_size = value
+
+    @property
+    def profiler(self):
+        # Anything with a Profiler-compatible `measure` method; None disables instrumentation.
+        return self._profiler
+
+    def set_profiler(self, value):
+        self._profiler = value
+
+    @property
+    def profile_report_path(self):
+        return self._profile_report_path
+
+    def set_profile_report_path(self, value):
+        self._profile_report_path = value
+        if self._profiler is None:
+            self._profiler = Profiler()
+
+    @property
+    def dedup_mode(self):
+        # One of dedup.dedup_modes, or None to export every texture separately.
+        return self._dedup_mode
+
+    def set_dedup_mode(self, value):
+        self._dedup_mode = value
+
+    @property
+    def list_enabled(self):
+        return self._list_enabled
+
+    def set_list_enabled(self, value):
+        self._list_enabled = value
+
+    @property
+    def index_path(self):
+        return self._index_path
+
+    def set_index_path(self, value):
+        self._index_path = os.path.abspath(value) if value is not None else None
+
+    @property
+    def selected_texture_names(self):
+        return self._selected_texture_names
+
+    def set_selected_texture_names(self, value):
+        self._selected_texture_names = list(value)
+
+    @property
+    def index_mode_enabled(self):
+        # Listing, indexing or selecting textures replaces the usual extraction of everything.
+        return bool(self.list_enabled or self.index_path or self.selected_texture_names)
+
+    @property
+    def cache_key(self):
+        # The settings which affect the images written for a texture; changing any of them invalidates the cache.
+        return {
+            "trimming": self.trimming_enabled,
+            "blackening": self.blackening_enabled,
+            "animations": self.animations_enabled,
+            "rename": self.rename_enabled,
+            "png_compression_level": self.png_compression_level,
+            "dedup": self.dedup_mode,
+            "include": self.included_texture_patterns,
+            "exclude": self.excluded_texture_patterns,
+        }
+
+
+def matches_globs(names, include_patterns, exclude_patterns):
+    """Returns whether one of `names` matches one of `include_patterns` (if there are any) and none of them matches
+    any of `exclude_patterns`."""
+    def matches_any(patterns):
+        return any(fnmatch.fnmatchcase(name, pattern) for name in names for pattern in patterns)
+
+    return (not include_patterns or matches_any(include_patterns)) and not matches_any(exclude_patterns)
+
+
+def is_input_file_included(file_path, directory_path, include_patterns, exclude_patterns):
+    # Input globs match either a file's name or its path relative to the input folder.
+    return matches_globs((os.path.basename(file_path), os.path.relpath(file_path, directory_path).replace(os.sep, "/")),
+                         include_patterns, exclude_patterns)
+
+
+def iter_candidate_input_files(directory_path, include_patterns=(), exclude_patterns=()):
+    """Yields an entry for every file in a directory and its sub-directories which the input globs allow, other than
+    this script's own."""
+    for entry in iter_directory_files(directory_path):
+        if entry.name not in (CACHE_FILE_NAME, DEDUP_MANIFEST_FILE_NAME) and is_input_file_included(
+                entry.path, directory_path, include_patterns, exclude_patterns):
+            yield entry
+
+
+def find_input_files(directory_path, include_patterns=(), exclude_patterns=()):
+    """Returns the path of every file in a directory and its sub-directories which the input globs allow and whose
+    first few bytes show that it may hold textures. Nothing else is read."""
+    input_files = []
+    skipped_file_count = 0
+    for entry in iter_candidate_input_files(directory_path, include_patterns, exclude_patterns):
+        if get_input_file_kind(entry.path) is None:
+            skipped_file_count += 1
+        else:
+            input_files.append(entry.path)
+    if skipped_file_count:
+        logging.info("Skipping {} file(s) in {} which do not hold textures.".format(skipped_file_count,
+                                                                                   directory_path))
+    return input_files
+
+
+def png_compression_level(value):
+    number = int(value)
+    if not 0 <= number <= 9:
+        raise argparse.ArgumentTypeError("PNG compression levels range from 0 to 9 but got \"{}\".".format(value))
+    return number
+
+
+def positive_integer(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("Expected a positive whole number but got \"{}\".".format(value))
+    return number
+
+
+def positive_number(value):
+    number = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError("Expected a positive number but got \"{}\".".format(value))
+    return number
+
 
 def get_settings_from_command_line():
     settings = Settings()
@@ -90,11 +368,40 @@ def get_settings_from_command_line():
     group.add_argument("input_folder", metavar="IN_DIR", nargs="?",
                        help="A path to a folder containing one or more Puzzle & Dragons texture files. Each file in this folder and its sub-folders will be processed and have their textures extracted.",
                        action=call(settings.set_input_path))
+    group.add_argument("--watch", metavar="WATCH_DIR",
+                       help="Keeps running, and extracts each file in this folder (or its sub-folders) as soon as it is added or changed and has finished being written, rather than extracting a given input once. Use \"-\" to read the paths of files or folders to extract from standard input instead, one per line, until it ends. Worker processes are started once and kept for every file, and how long each file took is logged as it is extracted.",
+                       action=call(settings.set_watch_path))
+    input_group.add_argument("--watch-interval", metavar="SECONDS", type=positive_number,
+                             help="How often --watch looks for new and changed files. Defaults to 1 second.",
+                             action=call(settings.set_watch_interval))
+    input_group.add_argument("--watch-queue", metavar="N", type=positive_integer,
+                             help="The number of files --watch queues up for extraction before it waits for extraction to catch up (and, when reading from standard input, stops reading). Defaults to 16.",
+                             action=call(settings.set_watch_queue_size))
+
+    filter_group = parser.add_argument_group("Filtering")
+    filter_group.add_argument("--include-input", metavar="GLOB", nargs="+",
+                              help="Only reads the files in IN_DIR (or WATCH_DIR) whose names or paths relative to it match one of these globs, such as \"*.bc\". Files which do not begin like a texture file or an \".apk\" are always skipped.",
+                              action=call(settings.set_included_input_patterns))
+    filter_group.add_argument("--exclude-input", metavar="GLOB", nargs="+",
+                              help="Skips the files in IN_DIR (or WATCH_DIR) whose names or paths relative to it match any of these globs.",
+                              action=call(settings.set_excluded_input_patterns))
+    filter_group.add_argument("--include", metavar="GLOB", nargs="+",
+                              help="Only extracts (or lists) the textures whose output file names match one of these globs, such as \"MONS_*\", regardless of case. Other textures are skipped as soon as they are found, and are never decoded.",
+                              action=call(settings.set_included_texture_patterns))
+    filter_group.add_argument("--exclude", metavar="GLOB", nargs="+",
+                              help="Skips the textures whose output file names match any of these globs, regardless of case.",
+                              action=call(settings.set_excluded_texture_patterns))
 
     output_group = parser.add_argument_group("Output")
     output_group.add_argument("-o", "--outdir", metavar="OUT_DIR",
                               help="A path to a folder where extracted textures should be saved. This property is optional; by default, any extracted texture files will be saved in the same directory as the file from which they were extracted.",
                               action=call(settings.set_output_directory))
+    output_group.add_argument("--output-format", choices=output_formats,
+                              help="How extracted textures should be saved: as individual files in a folder (\"directory\", the default), or streamed into a single \"zip\" or \"tar\" archive. Archives are written to the path given by --outdir, which is required for them, and are always extracted in full.",
+                              action=call(settings.set_output_format))
+    output_group.add_argument("--png-level", metavar="LEVEL", type=png_compression_level,
+                              help="The zlib compression level, from 0 (fastest) to 9 (smallest), used when writing PNG files. By default, zlib's own default level (6) is used.",
+                              action=call(settings.set_png_compression_level))
 
     features_group = parser.add_argument_group("Optional Features")
     features_group.add_argument("-nt", "--notrim", nargs=0,
@@ -107,10 +414,52 @@ def get_settings_from_command_line():
                                 action=call(settings.set_animations_enabled, True))
     features_group.add_argument("--rename", nargs=0, help="Rename animated files to old-style",
                                 action=call(settings.set_rename_enabled, True))
+    features_group.add_argument("-f", "--force", nargs=0,
+                                help="Each output folder keeps a record of the files and textures extracted into it, so that files and textures which have not changed since the last run are skipped. Use this flag to extract everything again regardless.",
+                                action=call(settings.set_force_enabled, True))
+    features_group.add_argument("--dedup", metavar="MODE", nargs="?", const="link", choices=dedup_modes,
+                                help="Textures which are identical to one already extracted (within this run, or by an earlier run into the same output folder) are not decoded and encoded again. With \"link\" (the default), each duplicate's file is a hardlink to the first one's; with \"manifest\", duplicates are not written at all, and are instead listed in a \"padtexturetool-duplicates.json\" file in their output folder.",
+                                action=call(settings.set_dedup_mode))
+
+    index_group = parser.add_argument_group("Indexing")
+    index_group.add_argument("--list", nargs=0,
+                             help="Lists every texture in the input files (with its size, encoding, whether it is animated, and where its image data is) without extracting anything.",
+                             action=call(settings.set_list_enabled, True))
+    index_group.add_argument("--index", metavar="INDEX_FILE",
+                             help="Saves an index of every texture in the input files to a JSON file (or a CSV file, if its name ends in \".csv\") without extracting anything. If the index file already exists, only the input files which have changed since they were indexed are read again.",
+                             action=call(settings.set_index_path))
+    index_group.add_argument("--select", metavar="NAME", nargs="+",
+                             help="Extracts only the textures with these output file names. Combined with --index, each texture is read straight from where the index says its image data is, rather than by scanning the whole input file.",
+                             action=call(settings.set_selected_texture_names))
+
+    performance_group = parser.add_argument_group("Performance")
+    performance_group.add_argument("-j", "--jobs", metavar="N", type=positive_integer,
+                                   help="The number of worker processes to extract textures with. When several files are given, each file is handled by one worker; a single large file (such as an \".apk\") has its textures shared out between the workers instead. Defaults to 1, which does all of the work in this process.",
+                                   action=call(settings.set_jobs))
+    performance_group.add_argument("--png-threads", metavar="N", type=positive_integer,
+                                   help="The number of threads with which to compress each very large PNG file (of 4 MiB of pixel data or more), in separate bands. Defaults to 1; the files written decode to the same pixels either way, and are only slightly larger when compressed in bands.",
+                                   action=call(settings.set_png_threads))
+
+    performance_group.add_argument("--profile", nargs=0,
+                                   help="Times each stage of the extraction (reading, parsing, unpacking, trimming and blackening, palette building, PNG encoding and writing) and prints a summary table once all files have been extracted.",
+                                   action=call(settings.set_profiler, Profiler()))
+    performance_group.add_argument("--profile-memory", nargs=0,
+                                   help="As --profile, but also traces the peak memory allocated by each stage. Tracing memory slows every stage down considerably.",
+                                   action=call(settings.set_profiler, Profiler(trace_memory=True)))
+    performance_group.add_argument("--profile-report", metavar="REPORT_FILE",
+                                   help="Implies --profile, and also writes every measurement to a report file: a CSV file if its name ends in \".csv\", or a JSON file otherwise.",
+                                   action=call(settings.set_profile_report_path))
 
     help_group = parser.add_argument_group("Help")
     help_group.add_argument("-h", "--help", action="help",
                             help="Displays this help message and exits.")
     args = parser.parse_args()
+    if settings.output_format != "directory" and settings.output_directory is None:
+        parser.error("--output-format {} requires --outdir, the path of the archive to write.".format(
+            settings.output_format))
+    if settings.watch_path is not None and settings.output_format != "directory":
+        parser.error("--watch can only extract into folders, not --output-format {}.".format(settings.output_format))
+    if settings.watch_path is not None and settings.index_mode_enabled:
+        parser.error("--watch cannot be combined with --list, --index or --select.")
 
     return settings
@@ -0,0 +1,49 @@
+"""Iterators over the textures (and encoded images) in a source, for callers which do not want files written."""
+from typing import Iterator, Optional, Tuple
+
+from .extract import get_output_file_name
+from .input_reader import iter_binary_blobs
+from .settings import Settings
+from .texture import Texture
+from .texture_reader import iter_textures_from_binary_blob
+from .texture_writer import encode_texture
+
+image_formats = ("png",)
+
+
+def iter_textures(source) -> Iterator[Texture]:
+    """Yields every texture in a source, one at a time, without decoding any of them.
+
+    The source may be a path to a file (such as a ".bc" file or an APK), a bytes-like object or a binary file object.
+    Only one texture container is held in memory at a time, and each texture's pixels are only decoded once asked for.
+    """
+    for _, binary_blob in iter_binary_blobs(source):
+        yield from iter_textures_from_binary_blob(binary_blob)
+
+
+def get_image_settings(format, trimming, blackening, png_compression_level):
+    if format not in image_formats:
+        raise ValueError("Unsupported image format \"{}\"; expected one of: {}.".format(format, ", ".join(image_formats)))
+    return Settings(trimming=trimming, blackening=blackening, png_compression_level=png_compression_level)
+
+
+def encode_image(texture: Texture, settings: Settings) -> Optional[bytes]:
+    """Encodes a texture as an image, or returns None if it has no visible pixels."""
+    image_data = encode_texture(texture, settings)
+    return bytes(image_data) if any(image_data) else None
+
+
+def iter_images(source, format: str = "png", *, trimming: bool = True, blackening: bool = True,
+                png_compression_level: int = None) -> Iterator[Tuple[str, bytes]]:
+    """Yields (file name, encoded image) for every texture in a source with any visible pixels.
+
+    File names are the ones an extraction would write the images under. Raw textures (usually JPEG data) are yielded
+    as they are stored, whatever the format.
+    """
+    settings = get_image_settings(format, trimming, blackening, png_compression_level)
+    files_written = {}
+    for texture in iter_textures(source):
+        output_file_name = get_output_file_name(texture.name, files_written)
+        image_data = encode_image(texture, settings)
+        if image_data is not None:
+            yield output_file_name, image_data
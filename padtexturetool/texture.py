@@ -1,34 +1,31 @@
-import struct
-
-
 class Texture:
     """An instance of a texture."""
 
-    def __init__(self, width, height, name, buffer, encoding, given_width=0, given_height=0):
+    __slots__ = ("width", "height", "name", "buffer", "encoding", "given_width", "given_height", "offset",
+                 "_packed_pixels")
+
+    def __init__(self, width, height, name, buffer, encoding, given_width=0, given_height=0, offset=None):
         super(Texture, self).__init__()
         self.width = width
         self.height = height
         self.name = name
         self.buffer = buffer
         self.encoding = encoding
-        self.packed_pixels = None
         self.given_width = given_width or self.width
         self.given_height = given_height or self.height
+        # Where the image data starts within the (decrypted) blob it was read from, if known.
+        self.offset = offset
+        self._packed_pixels = None
+
+    @property
+    def packed_pixels(self):
+        # Pixels are only unpacked the first time they are needed, so that textures which end up being skipped cost
+        # nothing more than their manifest entry.
+        if self._packed_pixels is None and self.encoding.stride_in_bits:
+            self._packed_pixels = self.encoding.unpack_packed_pixels(self.buffer, self.width * self.height)
+        return self._packed_pixels
 
-        if self.encoding.stride_in_bits:
-            if self.encoding.stride_in_bits == 32:
-                self.packed_pixels = struct.unpack(">{}L".format(self.width * self.height), self.buffer)
-            elif self.encoding.stride_in_bits == 16:
-                self.packed_pixels = struct.unpack("<{}H".format(self.width * self.height), self.buffer)
-            elif self.encoding.stride_in_bits == 8:
-                self.packed_pixels = struct.unpack("<{}B".format(self.width * self.height), self.buffer)
-            elif self.encoding.stride_in_bits < 8:
-                intermediate_packed_pixels = struct.unpack("<{}B".format(
-                    (self.width * self.height * self.encoding.stride_in_bits) // 8), self.buffer)
-                self.packed_pixels = []
-                bit_mask = ((2 ** self.encoding.stride_in_bits) - 1)
-                pixels_per_byte = (8 // self.encoding.stride_in_bits)
-                for byte in intermediate_packed_pixels:
-                    for i in range(pixels_per_byte):
-                        self.packed_pixels.append(
-                            (byte >> (self.encoding.stride_in_bits * (pixels_per_byte - i - 1))) & bit_mask)
+    def __reduce__(self):
+        # Views cannot be pickled, so a texture sent to another process takes a copy of its image data with it.
+        return (Texture, (self.width, self.height, self.name, bytes(self.buffer), self.encoding,
+                          self.given_width, self.given_height, self.offset))
@@ -1,8 +1,9 @@
+import functools
 import logging
 import re
 import struct
 import zlib
-from typing import List, Tuple
+from typing import BinaryIO, Generator, Iterator, List, Tuple
 
 from .encoding import *
 from .texture import Texture
@@ -11,11 +12,29 @@ encrypted_texture_magic_string = struct.pack("<5B", 0x49, 0x4F, 0x53, 0x43, 0x68
 encrypted_texture_header_format = "<5sBxxxxxx"
 encrypted_texture_header_format_size = struct.calcsize(encrypted_texture_header_format)
 unencrypted_texture_magic_string = struct.pack("<3B", 0x54, 0x45, 0x58)  # "TEX"
+animated_texture_magic_string = struct.pack("<3B", 0x49, 0x53, 0x43)  # "ISC"
+texture_container_magic_strings = (encrypted_texture_magic_string, unencrypted_texture_magic_string,
+                                   animated_texture_magic_string)
 texture_block_header_format = "<3sxB11x"
-texture_block_header_size = struct.calcsize(texture_block_header_format)
+texture_block_header_struct = struct.Struct(texture_block_header_format)
+texture_block_header_size = texture_block_header_struct.size
 texture_block_header_alignment = 16
+# Each magic string is searched for separately; sre only uses its fast substring search for patterns without alternation.
+texture_block_magic_string_patterns = (re.compile(re.escape(unencrypted_texture_magic_string)),
+                                       re.compile(re.escape(animated_texture_magic_string)))
+texture_block_magic_string_size = len(unencrypted_texture_magic_string)
+# Block headers are searched for this many bytes at a time, so that finding the next one never reads much further into
+# a memory-mapped blob than it has to.
+texture_block_search_window_size = 2 ** 16
 texture_manifest_format = "<IHH24s"
-texture_manifest_size = struct.calcsize(texture_manifest_format)
+texture_manifest_struct = struct.Struct(texture_manifest_format)
+texture_manifest_size = texture_manifest_struct.size
+raw_texture_name_struct = struct.Struct("<20sI")
+# 8 bytes of idk perhaps image size | img width | img height | # of frames | idk maybe palette related
+texture_footer_struct = struct.Struct("<8sHHHH")
+# Encrypted blobs are decrypted and inflated in chunks of this many bytes so that the encrypted, decrypted and inflated
+# copies of a blob never have to be held in memory at the same time.
+decryption_chunk_size = 2 ** 20
 
 encodings = {
     # Encoding 0x0 is four bytes per pixel; one byte per red, green, blue and alpha channel.
@@ -45,42 +64,103 @@ encodings = {
 }
 
 
+@functools.lru_cache(maxsize=None)
+def get_decryption_table(decryption_key: int) -> bytes:
+    # A 256-entry translation table mapping each encrypted byte to its decrypted value.
+    return bytes(byte ^ decryption_key for byte in range(256))
+
+
+def decrypt(encrypted_bytes: bytes, decryption_key: int) -> bytes:
+    # XOR each byte using the decryption key
+    return bytes(encrypted_bytes).translate(get_decryption_table(decryption_key))
+
+
+def iter_decrypted_and_decompressed_chunks(encrypted_chunks: Iterator[bytes], decryption_key: int) -> Iterator[bytes]:
+    decompress = zlib.decompressobj(-zlib.MAX_WBITS)
+    for encrypted_chunk in encrypted_chunks:
+        yield decompress.decompress(decrypt(encrypted_chunk, decryption_key))
+    yield decompress.flush()
+
+
 def decrypt_and_decompress_binary_blob(binary_blob: bytes) -> bytes:
     magic_string, decryption_key = struct.unpack_from(encrypted_texture_header_format, binary_blob)
 
     if magic_string != encrypted_texture_magic_string:
         return binary_blob
 
-    # XOR each byte using the decryption key
-    binary_blob = bytearray(byte ^ decryption_key
-                            for byte in bytearray(binary_blob[encrypted_texture_header_format_size:]))
+    encrypted_data = memoryview(binary_blob)[encrypted_texture_header_format_size:]
+    encrypted_chunks = (encrypted_data[chunk_start:chunk_start + decryption_chunk_size]
+                        for chunk_start in range(0, len(encrypted_data), decryption_chunk_size))
+    return b''.join(iter_decrypted_and_decompressed_chunks(encrypted_chunks, decryption_key))
 
-    # Inflate
-    decompress = zlib.decompressobj(-zlib.MAX_WBITS)
-    binary_blob = decompress.decompress(bytes(binary_blob))
-    binary_blob += decompress.flush()
 
-    return binary_blob
+def decrypt_and_decompress_binary_stream(binary_stream: BinaryIO) -> bytes:
+    # Unbuffered streams (such as pipes and sockets) may return less than was asked for, even before they end.
+    header = b''
+    while len(header) < encrypted_texture_header_format_size:
+        header_part = binary_stream.read(encrypted_texture_header_format_size - len(header))
+        if not header_part:
+            break
+        header += header_part
+    if len(header) < encrypted_texture_header_format_size:
+        return header + binary_stream.read()
 
+    magic_string, decryption_key = struct.unpack(encrypted_texture_header_format, header)
 
-def extract_textures_from_binary_blob(binary_blob: bytes) -> Tuple[List[Texture], bool]:
+    if magic_string != encrypted_texture_magic_string:
+        return header + binary_stream.read()
+
+    encrypted_chunks = iter(functools.partial(binary_stream.read, decryption_chunk_size), b'')
+    return b''.join(iter_decrypted_and_decompressed_chunks(encrypted_chunks, decryption_key))
+
+
+def find_texture_block_header(binary_blob: bytes, offset: int) -> int:
+    """Returns the offset of the first TEX or ISC block header at `offset` or a multiple of 16 bytes after it, or -1.
+
+    The magic strings are searched for in C rather than by unpacking a block header every 16 bytes, so image data which
+    no manifest accounts for is skipped over quickly.
+    """
+    while offset + texture_block_header_size < len(binary_blob):
+        search_window_end = offset + texture_block_search_window_size
+        block_start = search_window_end
+        for pattern in texture_block_magic_string_patterns:
+            # Only matches which start before the earliest one found so far are of interest.
+            match = pattern.search(binary_blob, offset, block_start + texture_block_magic_string_size - 1)
+            if match:
+                block_start = match.start()
+
+        if block_start == search_window_end:
+            # Resume at the first aligned offset at or after the end of the window; nothing before it can match.
+            offset += -(-texture_block_search_window_size // texture_block_header_alignment) * \
+                texture_block_header_alignment
+        elif block_start + texture_block_header_size >= len(binary_blob):
+            return -1
+        elif (block_start - offset) % texture_block_header_alignment:
+            # Block headers are only looked for where the block alignment evenly divides the distance from `offset`.
+            offset = block_start + (offset - block_start) % texture_block_header_alignment
+        else:
+            return block_start
+    return -1
+
+
+def iter_textures_from_binary_blob(binary_blob: bytes) -> Generator[Texture, None, bool]:
+    """Yields each texture in a blob as soon as its manifest entry is read, then returns whether the blob is animated."""
     binary_blob = decrypt_and_decompress_binary_blob(binary_blob)
+    # Textures reference their image data through views of the blob rather than copies of it.
+    binary_blob_view = memoryview(binary_blob)
 
-    offset = 0x0
-    textures = []
+    offset = find_texture_block_header(binary_blob, 0x0)
     is_animated = False
-    while (offset + texture_block_header_size) < len(binary_blob):
-        magic_string, number_of_textures_in_block = struct.unpack_from(texture_block_header_format, binary_blob, offset)
+    while offset != -1:
+        magic_string, number_of_textures_in_block = texture_block_header_struct.unpack_from(binary_blob, offset)
         if magic_string == unencrypted_texture_magic_string:
             texture_block_header_start = offset
             texture_block_header_end = texture_block_header_start + texture_block_header_size
 
             for texture_manifest_index in range(0, number_of_textures_in_block):
                 texture_manifest_start = texture_block_header_end + (texture_manifest_size * texture_manifest_index)
-                texture_manifest_end = texture_manifest_start + texture_manifest_size
-
-                starting_offset, width, height, name = struct.unpack(
-                    texture_manifest_format, binary_blob[texture_manifest_start:texture_manifest_end])
+                starting_offset, width, height, name = texture_manifest_struct.unpack_from(binary_blob,
+                                                                                           texture_manifest_start)
 
                 encoding_identifier = (width >> 12)
                 width = width & 0x0FFF
@@ -98,7 +178,7 @@ def extract_textures_from_binary_blob(binary_blob: bytes) -> Tuple[List[Texture]
                 if (encoding != RAW):
                     byte_count = (width * height * encoding.stride_in_bits) // 8
                 else:
-                    name, byte_count = struct.unpack("<20sI", name)
+                    name, byte_count = raw_texture_name_struct.unpack(name)
 
                 if byte_count <= 0:
                     logging.warning(f"{name} has no associated image data.")
@@ -121,14 +201,24 @@ def extract_textures_from_binary_blob(binary_blob: bytes) -> Tuple[List[Texture]
                 # MONS images mostly have size data in their footer, use this for trimming
                 given_width, given_height = 0, 0
                 if encoding == R4G4B4A4 and len(binary_blob) >= offset + 16:
-                    # 8 bytes of idk perhaps image size | img width | img height | # of frames | idk maybe palette related
-                    _, given_width, given_height, _, _ = struct.unpack('<8sHHHH', binary_blob[offset:offset + 16])
+                    _, given_width, given_height, _, _ = texture_footer_struct.unpack_from(binary_blob, offset)
                 if not given_width or not given_height:
                     # if either dimension is 0, use the full image size instead
                     given_width, given_height = width, height
-                textures.append(Texture(width, height, name, binary_blob[image_data_start:image_data_end], encoding,
-                                        min(width, given_width), min(height, given_height)))
-        elif magic_string == b"ISC":
+                image_data = binary_blob_view[image_data_start:image_data_end]
+                yield Texture(width, height, name, image_data, encoding, min(width, given_width),
+                              min(height, given_height), image_data_start)
+        else:
             is_animated = True
-        offset += texture_block_header_alignment
-    return textures, is_animated
+        offset = find_texture_block_header(binary_blob, offset + texture_block_header_alignment)
+    return is_animated
+
+
+def extract_textures_from_binary_blob(binary_blob: bytes) -> Tuple[List[Texture], bool]:
+    textures = []
+    texture_iterator = iter_textures_from_binary_blob(binary_blob)
+    while True:
+        try:
+            textures.append(next(texture_iterator))
+        except StopIteration as stop_iteration:
+            return textures, stop_iteration.value
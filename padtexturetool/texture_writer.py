@@ -1,21 +1,22 @@
-# Build the bit-depth conversion table
 import io
 import itertools
 import os
-import png
-
-from crc import Calculator, Crc32
+import zlib
 
 from .encoding import *
+from .metrics import measure_stage
+from .png_writer import GREYSCALE, INDEXED, TRUECOLOR, TRUECOLOR_WITH_ALPHA, get_rows, write_png
 
-CRC32 = Calculator(Crc32.CRC32.value)
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-bit_depth_conversion_table = [[[0 for i in range(256)] for j in range(9)] for k in range(9)]
-for current_bit_depth in range(1, 9):
-    for new_bit_depth in range(current_bit_depth, 9):
-        for value in range(2 ** current_bit_depth):
-            bit_depth_conversion_table[current_bit_depth][new_bit_depth][value] = int(
-                round(value * (float((2 ** new_bit_depth) - 1) / float((2 ** current_bit_depth) - 1))))
+# Palettes cannot contain more than 256 colors.
+maximum_palette_size = 2 ** 8
+# The (rough) number of pixels whose colours are gathered at a time while searching for a palette, so that images with
+# far too many colours can be rejected early.
+palette_search_chunk_size = 2 ** 16
 
 software_text = b'Exported using the Puzzle & Dragons Texture Tool! (https://github.com/TsubakiBotPad/padtexturetool)'
 
@@ -38,8 +39,9 @@ def trim_transparent_edges(flat_pixel_array, width, height, channels, given_widt
             max_index -= 1
         return min_index, max_index
 
-    top, bottom = find_trim_edges(0, given_height - 1, get_row)
-    left, right = find_trim_edges(0, given_width - 1, get_column)
+    # Given sizes larger than the image are clamped to it; columns beyond its width would wrap onto the next row.
+    top, bottom = find_trim_edges(0, min(given_height, height) - 1, get_row)
+    left, right = find_trim_edges(0, min(given_width, width) - 1, get_column)
 
     trimmed_width = (right - left) + 1
     trimmed_height = (bottom - top) + 1
@@ -67,92 +69,193 @@ def blacken_transparent_pixels(flat_pixel_array, width, height, channels):
     return flat_pixel_array
 
 
-def unpack_pixels(texture, target_bit_depth):
-    bits_per_channel = texture.encoding.channels
+def trim_transparent_edges_array(pixel_array, given_width, given_height):
+    # Rows are only trimmed within the given height and columns within the given width, but (as above) a row or
+    # column only counts as transparent if it is transparent across the whole image.
+    alpha_channel = pixel_array[..., -1]
+    opaque_row_indices = np.flatnonzero(alpha_channel[:given_height].any(axis=1))
+    opaque_column_indices = np.flatnonzero(alpha_channel[:, :given_width].any(axis=0))
+    # Without an opaque row (or column), only the height (or width) is trimmed to nothing, as above.
+    top, bottom = (opaque_row_indices[0], opaque_row_indices[-1] + 1) if opaque_row_indices.size else (0, 0)
+    left, right = (opaque_column_indices[0], opaque_column_indices[-1] + 1) if opaque_column_indices.size else (0, 0)
+    return pixel_array[top:bottom, left:right]
+
+
+def blacken_transparent_pixel_array(pixel_array):
+    pixel_array[pixel_array[..., -1] == 0, :-1] = 0
+    return pixel_array
+
+
+def get_palette_colour(colour_key, has_alpha):
+    # Opaque colours are written without their alpha channel.
+    colour = tuple(colour_key[1:] + colour_key[:1])
+    return colour[:-1] if has_alpha and colour[-1] == 0xFF else colour
+
+
+def build_palette(flat_pixel_array, channels_per_pixel, has_alpha):
+    """Returns (palette, palette index bytes) for an image of at most 256 colours, or (None, None) otherwise."""
+    pixel_bytes = bytes(flat_pixel_array)
+    pixel_starts = range(0, len(pixel_bytes), channels_per_pixel)
+
+    # Colours are gathered one pixel at a time, so that images with too many of them are rejected as soon as the first
+    # colour too many is found.
+    colours = set()
+    for i in pixel_starts:
+        colours.add(pixel_bytes[i:i + channels_per_pixel])
+        if len(colours) > maximum_palette_size:
+            return None, None
+
+    # Colours are sorted by their bytes with the last channel (alpha, when there is one) moved to the front, so that
+    # the palette is sorted by alpha.
+    colour_keys = sorted(colour[-1:] + colour[:-1] for colour in colours)
+    colour_to_index = dict((colour_key[1:] + colour_key[:1], palette_index)
+                           for palette_index, colour_key in enumerate(colour_keys))
+    palette = [get_palette_colour(colour_key, has_alpha) for colour_key in colour_keys]
+    return palette, bytes(colour_to_index[pixel_bytes[i:i + channels_per_pixel]] for i in pixel_starts)
+
+
+def pack_pixel_array(pixel_array):
+    # Packs each pixel into a single integer, with the last channel (alpha, when there is one) in the most significant
+    # byte, so that sorting the packed values sorts the palette by alpha.
+    packed_pixel_array = pixel_array[..., -1].astype(np.uint32)
+    for channel_index in range(pixel_array.shape[-1] - 1):
+        packed_pixel_array <<= 8
+        packed_pixel_array |= pixel_array[..., channel_index]
+    return packed_pixel_array
+
+
+def build_palette_from_array(pixel_array, has_alpha):
+    """Returns (palette, palette index array) for an image of at most 256 colours, or (None, None) otherwise."""
+    height, width, channels_per_pixel = pixel_array.shape
+    # Pixels are packed a band of rows at a time, so that images with too many colours are rejected having only packed
+    # the first few bands.
+    rows_per_chunk = max(palette_search_chunk_size // max(width, 1), 1)
+    row_starts = range(0, height, rows_per_chunk)
+    packed_colours = np.empty(0, dtype=np.uint32)
+    for row_start in row_starts:
+        packed_colours = np.union1d(packed_colours, pack_pixel_array(pixel_array[row_start:row_start + rows_per_chunk]))
+        if packed_colours.size > maximum_palette_size:
+            return None, None
+
+    palette = [get_palette_colour(packed_colour.to_bytes(channels_per_pixel, 'big'), has_alpha)
+               for packed_colour in packed_colours.tolist()]
+    palette_index_array = np.empty((height, width), dtype=np.uint8)
+    for row_start in row_starts:
+        palette_index_array[row_start:row_start + rows_per_chunk] = np.searchsorted(
+            packed_colours, pack_pixel_array(pixel_array[row_start:row_start + rows_per_chunk]))
+    return palette, palette_index_array
+
+
+def unpack_pixel_array(texture, target_bit_depth):
+    return texture.encoding.unpack_pixel_array(texture.packed_pixels, texture.width, texture.height, target_bit_depth)
 
-    bit_shifts = [sum(bits_per_channel[channel_index + 1:])
-                  for channel_index, channel_bit_count in enumerate(bits_per_channel)]
-    bit_masks = [(((2 ** bit_count) - 1) << bit_shift)
-                 for bit_count, bit_shift in zip(bits_per_channel, bit_shifts)]
-    conversion_tables = [bit_depth_conversion_table[current_bit_count][target_bit_depth]
-                         for current_bit_count in bits_per_channel]
 
-    return [conversion_table[(packed_pixel_value & bit_mask) >> bit_shift]
-            for packed_pixel_value in texture.packed_pixels
-            for bit_shift, bit_mask, conversion_table in zip(bit_shifts, bit_masks, conversion_tables)]
+def unpack_pixels(texture, target_bit_depth):
+    if np is not None:
+        return unpack_pixel_array(texture, target_bit_depth).ravel().tolist()
+    return texture.encoding.unpack_pixels(texture.packed_pixels, target_bit_depth)
 
 
-def export_to_image_file(texture, output_file_path, settings):
-    binary_file_data = bytes()
+def encode_texture(texture, settings):
+    """Encodes a texture as the contents of an image file; returns an empty buffer if it has no visible pixels."""
     if texture.encoding is RAW:
-        binary_file_data = texture.buffer
-
+        return texture.buffer
+    if texture.encoding.is_compressed and np is None:
+        # Compressed image data can only be decoded with NumPy.
+        return bytes()
+
+    target_bit_depth = 8
+    channels_per_pixel = len(texture.encoding.channels)
+    profiler = settings.profiler
+
+    with measure_stage(profiler, "unpack", texture=texture.name, bytes_in=len(texture.buffer)) as stage_record:
+        if np is not None:
+            pixel_array = unpack_pixel_array(texture, target_bit_depth)
+            stage_record.bytes_out = pixel_array.nbytes
+        else:
+            width, height = texture.width, texture.height
+            flat_pixel_array = unpack_pixels(texture, target_bit_depth)
+            stage_record.bytes_out = len(flat_pixel_array)
+
+    if texture.encoding.has_alpha and (settings.trimming_enabled or settings.blackening_enabled):
+        with measure_stage(profiler, "trim_blacken", texture=texture.name,
+                           bytes_in=stage_record.bytes_out) as stage_record:
+            if np is not None:
+                if settings.trimming_enabled:
+                    pixel_array = trim_transparent_edges_array(pixel_array, texture.given_width, texture.given_height)
+                if settings.blackening_enabled:
+                    pixel_array = blacken_transparent_pixel_array(pixel_array)
+                stage_record.bytes_out = pixel_array.nbytes
+            else:
+                if settings.trimming_enabled:
+                    width, height, flat_pixel_array = trim_transparent_edges(
+                        flat_pixel_array, width, height, texture.encoding.channels, texture.given_width,
+                        texture.given_height)
+                if settings.blackening_enabled:
+                    flat_pixel_array = blacken_transparent_pixels(
+                        flat_pixel_array, width, height, texture.encoding.channels)
+                stage_record.bytes_out = len(flat_pixel_array)
+
+    if np is not None:
+        height, width = pixel_array.shape[:2]
+        if not pixel_array.any():
+            return bytes()
+        # Each row of a trimmed view is still contiguous, so rows can be compressed without copying the image.
+        pixel_rows = pixel_array
     else:
-        width, height = texture.width, texture.height
-        target_bit_depth = 8
-        flat_pixel_array = unpack_pixels(texture, target_bit_depth)
-
-        if texture.encoding.has_alpha:
-            if settings.trimming_enabled:
-                width, height, flat_pixel_array = trim_transparent_edges(
-                    flat_pixel_array, width, height, texture.encoding.channels, texture.given_width,
-                    texture.given_height)
-            if settings.blackening_enabled:
-                flat_pixel_array = blacken_transparent_pixels(
-                    flat_pixel_array, width, height, texture.encoding.channels)
-
-        if any(flat_pixel_array):
-            # Create an in-memory stream to which we can write the png data.
-            png_stream = io.BytesIO()
-
-            # Attempt to create a palette
-            channels_per_pixel = len(texture.encoding.channels)
-            pixels = list(zip(*(flat_pixel_array[i::channels_per_pixel]
-                                for i in range(channels_per_pixel))))
-            palette = list(set(pixels))
-
-            # Palettes cannot contain more than 256 colors. Also, using palettes for
-            # greyscale images typically takes more memory, not less.
-            if len(palette) <= (2 ** 8) and not texture.encoding.is_greyscale:
-                def get_alpha_value(color):
-                    return color[channels_per_pixel - 1]
-
-                palette.sort(key=get_alpha_value)
-                color_to_index = dict((color, palette_index)
-                                      for palette_index, color in enumerate(palette))
-                palette_index_array = [color_to_index[color] for color in pixels]
-
-                # Remove alpha from opaque pixels
-                if texture.encoding.has_alpha:
-                    palette = [(color if get_alpha_value(color) < 0xFF else color[:-1])
-                               for color in palette]
-                elif texture.encoding.is_greyscale:
-                    palette = [(color[0],) * 3 for color in palette]
-
-                # Write the png data to the stream.
-                png_writer = png.Writer(width, height, palette=palette, bitdepth=target_bit_depth)
-                png_writer.write_array(png_stream, palette_index_array)
-
+        if not any(flat_pixel_array):
+            return bytes()
+        pixel_rows = get_rows(bytes(flat_pixel_array), width * channels_per_pixel)
+
+    # Attempt to create a palette. Using palettes for greyscale images typically takes more memory, not less.
+    palette = None
+    if not texture.encoding.is_greyscale:
+        with measure_stage(profiler, "palette", texture=texture.name, bytes_in=stage_record.bytes_out):
+            if np is not None:
+                palette, palette_indices = build_palette_from_array(pixel_array, texture.encoding.has_alpha)
             else:
-                # Write the png data to the stream.
-                png_writer = png.Writer(width, height, alpha=texture.encoding.has_alpha,
-                                        greyscale=texture.encoding.is_greyscale,
-                                        bitdepth=target_bit_depth, planes=len(texture.encoding.channels))
-                png_writer.write_array(png_stream, flat_pixel_array)
-
-            # Add the penultimate chunk.
-            final_chunk_size = 12
-            png_file_byte_array = bytearray(png_stream.getvalue())
-            # Turn the text into a PNG tEXt chunk (size + data + checksum)
-            data = b'tEXtSoftware\0' + software_text
-            penultimate_chunk = (len(data)-4).to_bytes(4, 'big') + data + CRC32.checksum(data).to_bytes(4, 'big')
-            binary_file_data = bytes(
-                png_file_byte_array[:-final_chunk_size]) + penultimate_chunk + bytes(
-                png_file_byte_array[-final_chunk_size:])
-
-    if any(binary_file_data):
-        output_directory = os.path.dirname(output_file_path)
-        if not os.path.isdir(output_directory):
-            os.makedirs(output_directory)
+                palette, palette_indices = build_palette(
+                    flat_pixel_array, channels_per_pixel, texture.encoding.has_alpha)
+
+    with measure_stage(profiler, "png", texture=texture.name, bytes_in=stage_record.bytes_out) as stage_record:
+        # Create an in-memory stream to which we can write the png data.
+        png_stream = io.BytesIO()
+        png_text = {"Software": software_text}
+        compression_level = settings.png_compression_level
+        if compression_level is None:
+            compression_level = zlib.Z_DEFAULT_COMPRESSION
+
+        if palette is not None:
+            palette_index_rows = palette_indices if np is not None else get_rows(palette_indices, width)
+            write_png(png_stream, width, height, palette_index_rows, INDEXED, target_bit_depth, palette=palette,
+                      text=png_text, compression_level=compression_level, threads=settings.png_threads)
+
+        else:
+            if texture.encoding.is_greyscale:
+                colour_type = GREYSCALE
+            elif texture.encoding.has_alpha:
+                colour_type = TRUECOLOR_WITH_ALPHA
+            else:
+                colour_type = TRUECOLOR
+
+            write_png(png_stream, width, height, pixel_rows, colour_type, target_bit_depth, text=png_text,
+                      compression_level=compression_level, threads=settings.png_threads)
+
+        binary_file_data = png_stream.getbuffer()
+        stage_record.bytes_out = binary_file_data.nbytes
+
+    return binary_file_data
+
+
+def export_to_image_file(texture, output_file_path, settings):
+    """Writes a texture to an image file; returns whether a file was written."""
+    binary_file_data = encode_texture(texture, settings)
+    if not any(binary_file_data):
+        return False
+
+    with measure_stage(settings.profiler, "write", texture=texture.name, bytes_in=len(binary_file_data)):
+        # Several worker processes may try to create the same directory at once.
+        os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
         with open(output_file_path, 'wb') as output_file_handle:
             output_file_handle.write(binary_file_data)
+    return True
@@ -0,0 +1,130 @@
+"""A long-running mode which extracts input files as they arrive, keeping the process and its workers warm."""
+import argparse
+import concurrent.futures
+import contextlib
+import logging
+import queue
+import sys
+import threading
+import time
+
+from .dedup import TextureDeduplicator
+from .extract import do_extract, initialize_worker
+from .input_reader import get_input_file_kind
+from .settings import iter_candidate_input_files
+
+# Reading job paths from standard input, rather than watching a directory.
+WATCH_STDIN = "-"
+
+
+def get_file_signature(entry):
+    file_status = entry.stat()
+    return file_status.st_size, file_status.st_mtime_ns
+
+
+def watch_directory(settings, job_queue):
+    """Queues each input file under the watched directory whenever it is new or has changed, once it has stopped
+    changing.
+
+    A file is only queued once its size and modification time are the same in two scans in a row, so that files which
+    are still being downloaded or copied are not extracted half-written. Only then is it opened, to check that it may
+    hold textures at all.
+    """
+    scanned_signatures = {}
+    checked_signatures = {}
+    while True:
+        signatures = {}
+        for entry in iter_candidate_input_files(settings.watch_path, settings.included_input_patterns,
+                                                settings.excluded_input_patterns):
+            try:
+                signatures[entry.path] = get_file_signature(entry)
+            except OSError:
+                continue
+        for input_file_path, signature in sorted(signatures.items()):
+            if scanned_signatures.get(input_file_path) == signature != checked_signatures.get(input_file_path):
+                checked_signatures[input_file_path] = signature
+                if get_input_file_kind(input_file_path) is not None:
+                    # Blocks while the queue is full, so that scanning waits for extraction to catch up.
+                    job_queue.put((input_file_path, time.perf_counter()))
+        scanned_signatures = signatures
+        time.sleep(settings.watch_interval)
+
+
+def read_job_paths(input_stream, job_queue):
+    """Queues each path read from a stream, one per line, then queues None once the stream ends."""
+    for line in input_stream:
+        job_path = line.strip()
+        if job_path:
+            # Blocks while the queue is full, so that whatever is writing to the stream is held back in turn.
+            job_queue.put((job_path, time.perf_counter()))
+    job_queue.put(None)
+
+
+def format_latencies(latencies):
+    latencies = sorted(latencies)
+    return "{} job(s); latency mean {:.2f} s, median {:.2f} s, max {:.2f} s.".format(
+        len(latencies), sum(latencies) / len(latencies), latencies[len(latencies) // 2], latencies[-1])
+
+
+def do_watch(settings):
+    """Extracts input files as they arrive, until interrupted (or, when reading paths from standard input, until the
+    input ends). Each input file is a job, extracted with the settings given and (for more than one job) a process
+    pool which is started once and kept for every job. Extraction caches are kept loaded from one job to the next, as is
+    the deduplicator for directory extractions, so that neither is read or built again for each job. Returns the
+    latency of each job: how long it took from being queued to being extracted.
+    """
+    job_queue = queue.Queue(settings.watch_queue_size)
+    if settings.watch_path == WATCH_STDIN:
+        job_source = threading.Thread(target=read_job_paths, args=(sys.stdin, job_queue), daemon=True)
+        logging.info("Reading paths to extract from standard input...")
+    else:
+        job_source = threading.Thread(target=watch_directory, args=(settings, job_queue), daemon=True)
+        logging.info("Watching {} for input files...".format(settings.watch_path))
+
+    latencies = []
+    caches = {}
+    deduplicator = None
+    with contextlib.ExitStack() as exit_stack:
+        executor = None
+        if settings.jobs > 1:
+            executor = exit_stack.enter_context(concurrent.futures.ProcessPoolExecutor(
+                settings.jobs, initializer=initialize_worker,
+                initargs=(logging.getLogger().getEffectiveLevel(), True)))
+        job_source.start()
+        try:
+            while True:
+                job = job_queue.get()
+                if job is None:
+                    break
+                job_path, queued_time = job
+                start_time = time.perf_counter()
+                # Archives are written afresh for each job, so files from earlier jobs cannot be linked to.
+                if deduplicator is None and settings.dedup_mode is not None and settings.output_format == "directory":
+                    deduplicator = TextureDeduplicator(settings.dedup_mode)
+                job_settings = None
+                try:
+                    job_settings = settings.copy_for_input_path(job_path)
+                    output_file_paths = do_extract(job_settings, executor=executor, caches=caches,
+                                                   deduplicator=deduplicator)
+                except argparse.ArgumentTypeError as error:
+                    logging.error(str(error))
+                    continue
+                except Exception:
+                    # One bad input file should not stop the files after it from being extracted. What the
+                    # deduplicator knew may no longer match the output directory, so it is built again.
+                    logging.exception("Failed to extract {}.".format(job_path))
+                    deduplicator = None
+                    continue
+                finally:
+                    if job_settings is not None and job_settings.profiler is not settings.profiler:
+                        settings.profiler.merge(job_settings.profiler.stage_records)
+                end_time = time.perf_counter()
+                latencies.append(end_time - queued_time)
+                logging.info("Extracted {} in {:.2f} s ({:.2f} s after it was queued); {} image file(s).".format(
+                    job_path, end_time - start_time, end_time - queued_time, len(output_file_paths)))
+        except KeyboardInterrupt:
+            logging.info("\nStopped watching.")
+
+    if latencies:
+        logging.info("\n" + format_latencies(latencies))
+    return latencies
@@ -14,10 +14,10 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/TsubakiBotPad/padtexturetool",
     packages=setuptools.find_packages(),
-    install_requires=[
-        "pypng==0.0.20",
-        "crc"
-    ],
+    install_requires=[],
+    extras_require={
+        "numpy": ["numpy"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
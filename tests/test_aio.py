@@ -0,0 +1,145 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from unittest import mock
+
+from padtexturetool import aio, cache
+from padtexturetool.aio import extract_async
+from padtexturetool.bench.synthetic import synthesize_image_data, synthesize_texture_block
+from padtexturetool.encoding import R8G8B8A8
+from padtexturetool.extract import encode_exported_texture_with_cpu_time
+from padtexturetool.output_sink import MemoryOutputSink
+
+# {input file name: [(texture name, seed for its image data)]}; B1.PNG is a duplicate of A1.PNG.
+input_files = {
+    "a.bin": [("A1.PNG", 1), ("A2.PNG", 2), ("A3.PNG", 3)],
+    "b.bin": [("B1.PNG", 1), ("B2.PNG", 4), ("B3.PNG", 5)],
+}
+
+
+class ExtractAsyncTest(unittest.TestCase):
+
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.directory_path = temporary_directory.name
+        self.input_directory_path = os.path.join(self.directory_path, "in")
+        self.output_directory_path = os.path.join(self.directory_path, "out")
+        os.makedirs(self.input_directory_path)
+        for input_file_name, textures in input_files.items():
+            with open(os.path.join(self.input_directory_path, input_file_name), 'wb') as input_file:
+                input_file.write(synthesize_texture_block([
+                    (name, R8G8B8A8, 16, 16, synthesize_image_data(R8G8B8A8, 16, 16, random.Random(seed)))
+                    for name, seed in textures]))
+        executor = concurrent.futures.ThreadPoolExecutor(8)
+        self.addCleanup(executor.shutdown)
+        self.executor = executor
+        logging.disable(logging.INFO)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def extract(self, output_dir=None, **keyword_arguments):
+        return asyncio.run(extract_async(self.input_directory_path, output_dir or self.output_directory_path,
+                                         executor=self.executor, **keyword_arguments))
+
+    def get_output_file_path(self, output_file_name):
+        return os.path.join(self.output_directory_path, output_file_name)
+
+    def test_concurrency_is_limited(self):
+        lock = threading.Lock()
+        active_counts = [0]
+        max_active_count = 0
+
+        def encode(*arguments):
+            nonlocal max_active_count
+            with lock:
+                active_counts[0] += 1
+                max_active_count = max(max_active_count, active_counts[0])
+            try:
+                time.sleep(0.02)
+                return encode_exported_texture_with_cpu_time(*arguments)
+            finally:
+                with lock:
+                    active_counts[0] -= 1
+
+        with mock.patch.object(aio, "encode_exported_texture_with_cpu_time", side_effect=encode):
+            written_paths = self.extract(concurrency=2)
+        self.assertEqual(max_active_count, 2)
+        self.assertEqual(sorted(written_paths), sorted(self.get_output_file_path(name)
+                                                       for textures in input_files.values() for name, _ in textures))
+        self.assertTrue(all(os.path.isfile(written_path) for written_path in written_paths))
+
+    def test_output_sinks(self):
+        archive_path = os.path.join(self.directory_path, "textures.zip")
+        written_paths = self.extract(archive_path, output_format="zip")
+        with zipfile.ZipFile(archive_path) as zip_file:
+            self.assertEqual(sorted(zip_file.namelist()), sorted(
+                name for textures in input_files.values() for name, _ in textures))
+        self.assertEqual(len(written_paths), 6)
+        self.assertFalse(os.path.exists(self.output_directory_path))
+
+        memory_output_sink = MemoryOutputSink()
+        written_paths = self.extract(output_sink=memory_output_sink)
+        self.assertEqual(sorted(memory_output_sink.files), sorted(written_paths))
+        self.assertEqual(len(written_paths), 6)
+        # Nothing is cached, or written anywhere else.
+        self.assertFalse(os.path.exists(self.output_directory_path))
+
+    def test_duplicates(self):
+        with mock.patch.object(aio, "encode_exported_texture_with_cpu_time",
+                               wraps=encode_exported_texture_with_cpu_time) as encode:
+            self.extract(dedup="link")
+        self.assertEqual(sorted(os.path.basename(call[0][1]) for call in encode.call_args_list),
+                         ["A1.PNG", "A2.PNG", "A3.PNG", "B2.PNG", "B3.PNG"])
+        self.assertTrue(os.path.samefile(self.get_output_file_path("A1.PNG"), self.get_output_file_path("B1.PNG")))
+
+        memory_output_sink = MemoryOutputSink()
+        self.extract(output_sink=memory_output_sink, dedup="manifest")
+        self.assertEqual(len(memory_output_sink.files), 6)
+        self.assertNotIn(os.path.join(self.output_directory_path, "B1.PNG"), memory_output_sink.files)
+
+    def test_cancellation(self):
+        # b.bin's textures are held up until the extraction has been cancelled.
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def encode(texture, output_file_path, settings):
+            if os.path.basename(output_file_path).startswith("B"):
+                release.wait()
+            return encode_exported_texture_with_cpu_time(texture, output_file_path, settings)
+
+        async def extract_and_cancel():
+            extraction = asyncio.ensure_future(extract_async(self.input_directory_path, self.output_directory_path,
+                                                             executor=self.executor))
+            while not any(call[0][1] == os.path.join(self.input_directory_path, "a.bin")
+                          for call in update.call_args_list):
+                await asyncio.sleep(0.01)
+            extraction.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await extraction
+
+        with mock.patch.object(aio, "encode_exported_texture_with_cpu_time", side_effect=encode), \
+                mock.patch.object(cache.ExtractionCache, "update", autospec=True,
+                                  side_effect=cache.ExtractionCache.update) as update:
+            asyncio.run(extract_and_cancel())
+        release.set()
+
+        # a.bin was recorded before the cancellation, so only b.bin is extracted again.
+        cached_inputs = cache.ExtractionCache(self.output_directory_path).inputs
+        self.assertEqual([os.path.basename(input_file_path) for input_file_path in cached_inputs], ["a.bin"])
+        self.assertTrue(os.path.isfile(self.get_output_file_path("A1.PNG")))
+        with mock.patch.object(aio, "encode_exported_texture_with_cpu_time",
+                               wraps=encode_exported_texture_with_cpu_time) as encode:
+            self.extract()
+        self.assertEqual(sorted(os.path.basename(call[0][1]) for call in encode.call_args_list),
+                         ["B1.PNG", "B2.PNG", "B3.PNG"])
+
+
+if __name__ == "__main__":
+    unittest.main()
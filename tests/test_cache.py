@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+from padtexturetool import cache
+from padtexturetool.bench.synthetic import encrypt_binary_blob, synthesize_image_data, synthesize_texture_block
+from padtexturetool.cache import CACHE_FILE_NAME
+from padtexturetool.encoding import R4G4B4A4, R8G8B8A8
+from padtexturetool.extract import do_extract
+from padtexturetool.output_sink import DirectoryOutputSink
+from padtexturetool.settings import Settings
+
+# {input file name: [(texture name, encoding, seed for its image data)]}
+input_files = {
+    "a.bin": [("A1.PNG", R8G8B8A8, 1), ("A2.PNG", R4G4B4A4, 2)],
+    "b.bc": [("B1.PNG", R8G8B8A8, 3)],
+}
+all_output_file_names = ["A1.PNG", "A2.PNG", "B1.PNG"]
+
+
+class ExtractionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.input_directory_path = os.path.join(temporary_directory.name, "in")
+        self.output_directory_path = os.path.join(temporary_directory.name, "out")
+        os.makedirs(self.input_directory_path)
+        for input_file_name, textures in input_files.items():
+            self.write_input_file(input_file_name, textures)
+        logging.disable(logging.INFO)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def write_input_file(self, input_file_name, textures, modified_time_ns=None):
+        binary_blob = synthesize_texture_block([
+            (name, encoding, 16, 16, synthesize_image_data(encoding, 16, 16, random.Random(seed)))
+            for name, encoding, seed in textures])
+        if input_file_name.endswith(".bc"):
+            binary_blob = encrypt_binary_blob(binary_blob)
+        input_file_path = os.path.join(self.input_directory_path, input_file_name)
+        with open(input_file_path, 'wb') as input_file:
+            input_file.write(binary_blob)
+        if modified_time_ns is not None:
+            # Changed files are given a later modification time, in case they are rewritten within the same tick.
+            os.utime(input_file_path, ns=(modified_time_ns, modified_time_ns))
+
+    def extract(self, **settings_arguments):
+        """Extracts every input file and returns the names of the files written (not reused) by the extraction."""
+        output_sink = DirectoryOutputSink()
+        output_file_paths = do_extract(Settings(self.input_directory_path, self.output_directory_path,
+                                                **settings_arguments), output_sink)
+        self.assertEqual(sorted(os.path.basename(output_file_path) for output_file_path in output_file_paths),
+                         all_output_file_names)
+        return sorted(os.path.basename(written_path) for written_path in output_sink.written_paths)
+
+    def read_output_file(self, output_file_name):
+        with open(os.path.join(self.output_directory_path, output_file_name), 'rb') as output_file:
+            return output_file.read()
+
+    def test_unchanged_inputs_are_skipped(self):
+        self.assertEqual(self.extract(), all_output_file_names)
+        self.assertTrue(os.path.isfile(os.path.join(self.output_directory_path, CACHE_FILE_NAME)))
+        self.assertEqual(self.extract(), [])
+
+    def test_changed_textures_are_rewritten(self):
+        self.extract()
+        unchanged_image_data = self.read_output_file("A2.PNG")
+        modified_time_ns = os.stat(os.path.join(self.input_directory_path, "a.bin")).st_mtime_ns + 10 ** 9
+        self.write_input_file("a.bin", [("A1.PNG", R8G8B8A8, 10), ("A2.PNG", R4G4B4A4, 2)], modified_time_ns)
+        # Only the texture which changed is written again; the rest of its input file is reused.
+        self.assertEqual(self.extract(), ["A1.PNG"])
+        self.assertEqual(self.read_output_file("A2.PNG"), unchanged_image_data)
+        self.assertEqual(self.extract(), [])
+
+    def test_deleted_outputs_are_rewritten(self):
+        self.extract()
+        os.remove(os.path.join(self.output_directory_path, "B1.PNG"))
+        self.assertEqual(self.extract(), ["B1.PNG"])
+        self.assertEqual(self.extract(), [])
+
+    def test_changed_settings_rewrite_everything(self):
+        self.extract()
+        for settings_arguments in ({"png_compression_level": 9}, {"trimming": False}, {"blackening": False},
+                                   {"exclude": ["NONE*"]}):
+            with self.subTest(**settings_arguments):
+                self.assertEqual(self.extract(**settings_arguments), all_output_file_names)
+                self.assertEqual(self.extract(**settings_arguments), [])
+        self.assertEqual(self.extract(), all_output_file_names)
+
+    def test_force_rewrites_everything(self):
+        self.extract()
+        self.assertEqual(self.extract(force=True), all_output_file_names)
+        self.assertEqual(self.extract(), [])
+
+    def test_caches_from_other_versions_are_ignored(self):
+        self.extract()
+        cache_file_path = os.path.join(self.output_directory_path, CACHE_FILE_NAME)
+        with open(cache_file_path, 'r', encoding='UTF-8') as cache_file:
+            cache_contents = json.load(cache_file)
+        self.assertEqual(cache_contents["version"], cache.CACHE_FORMAT_VERSION)
+
+        # Version 1 caches recorded PVRTC textures as they were before they could be decoded.
+        cache_contents["version"] = 1
+        with open(cache_file_path, 'w', encoding='UTF-8') as cache_file:
+            json.dump(cache_contents, cache_file)
+        self.assertEqual(self.extract(), all_output_file_names)
+        with open(cache_file_path, 'r', encoding='UTF-8') as cache_file:
+            self.assertEqual(json.load(cache_file)["version"], cache.CACHE_FORMAT_VERSION)
+
+        # Caches written by a later version are ignored too.
+        with mock.patch.object(cache, "CACHE_FORMAT_VERSION", cache.CACHE_FORMAT_VERSION + 1):
+            self.assertEqual(self.extract(), all_output_file_names)
+        self.assertEqual(self.extract(), all_output_file_names)
+        self.assertEqual(self.extract(), [])
+
+    def test_unreadable_caches_are_ignored(self):
+        self.extract()
+        with open(os.path.join(self.output_directory_path, CACHE_FILE_NAME), 'w', encoding='UTF-8') as cache_file:
+            cache_file.write("{not json")
+        logging.disable(logging.NOTSET)
+        with self.assertLogs(level=logging.WARNING) as logs:
+            self.assertEqual(self.extract(), all_output_file_names)
+        self.assertTrue(any("unreadable extraction cache" in output for output in logs.output))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+import importlib
+import json
+import logging
+import os
+import random
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from padtexturetool.bench.synthetic import synthesize_image_data, synthesize_texture_block
+from padtexturetool.dedup import DEDUP_MANIFEST_FILE_NAME
+from padtexturetool.encoding import R8G8B8A8
+from padtexturetool.extract import do_extract
+from padtexturetool.settings import Settings
+
+# The package's extract function shadows its extract module.
+extract = importlib.import_module("padtexturetool.extract")
+
+# {input file name: [(texture name, seed for its image data)]}; textures with the same seed are identical.
+input_files = {
+    "a.bin": [("A1.PNG", 1), ("A2.PNG", 1), ("A3.PNG", 2)],
+    "b.bin": [("B1.PNG", 2), ("B2.PNG", 3)],
+}
+# Two textures named X.PNG; the second overwrites the first, whose duplicates have to be written out in full.
+overwriting_input_files = {
+    "a.bin": [("X.PNG", 1), ("Z.PNG", 1)],
+    "b.bin": [("X.PNG", 5), ("Y.PNG", 1)],
+}
+
+
+class DeduplicationTest(unittest.TestCase):
+
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.directory_path = temporary_directory.name
+        logging.disable(logging.INFO)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def write_input_files(self, input_files, name="in"):
+        input_directory_path = os.path.join(self.directory_path, name)
+        os.makedirs(input_directory_path)
+        for input_file_name, textures in input_files.items():
+            with open(os.path.join(input_directory_path, input_file_name), 'wb') as input_file:
+                input_file.write(synthesize_texture_block([
+                    (name, R8G8B8A8, 16, 16, synthesize_image_data(R8G8B8A8, 16, 16, random.Random(seed)))
+                    for name, seed in textures]))
+        return input_directory_path
+
+    def extract(self, input_path, output_name, **settings_arguments):
+        """Extracts into a new directory (or archive) under the temporary directory, and returns its path and the
+        names of the textures which were encoded."""
+        output_path = os.path.join(self.directory_path, output_name)
+        with mock.patch.object(extract, "encode_exported_texture_with_cpu_time",
+                               wraps=extract.encode_exported_texture_with_cpu_time) as encode:
+            do_extract(Settings(input_path, output_path, **settings_arguments))
+        return output_path, sorted(os.path.basename(call[0][1]) for call in encode.call_args_list)
+
+    def read_files(self, directory_path):
+        files = {}
+        for file_name in os.listdir(directory_path):
+            if file_name.endswith(".PNG"):
+                with open(os.path.join(directory_path, file_name), 'rb') as image_file:
+                    files[file_name] = image_file.read()
+        return files
+
+    def read_manifest(self, directory_path):
+        with open(os.path.join(directory_path, DEDUP_MANIFEST_FILE_NAME), 'r', encoding='UTF-8') as manifest_file:
+            return json.load(manifest_file)
+
+    def assert_same_file(self, directory_path, output_file_name, original_output_file_name):
+        self.assertTrue(os.path.samefile(os.path.join(directory_path, output_file_name),
+                                         os.path.join(directory_path, original_output_file_name)))
+
+    def test_link_directory(self):
+        input_directory_path = self.write_input_files(input_files)
+        expected_path, _ = self.extract(input_directory_path, "expected")
+        output_path, encoded_names = self.extract(input_directory_path, "out", dedup="link")
+        self.assertEqual(encoded_names, ["A1.PNG", "A3.PNG", "B2.PNG"])
+        self.assertEqual(self.read_files(output_path), self.read_files(expected_path))
+        self.assert_same_file(output_path, "A2.PNG", "A1.PNG")
+        self.assert_same_file(output_path, "B1.PNG", "A3.PNG")
+        self.assertFalse(os.path.exists(os.path.join(output_path, DEDUP_MANIFEST_FILE_NAME)))
+
+    def test_link_tar(self):
+        input_directory_path = self.write_input_files(input_files)
+        expected_path, _ = self.extract(input_directory_path, "expected")
+        expected_files = self.read_files(expected_path)
+        archive_path, _ = self.extract(input_directory_path, "out.tar", dedup="link", output_format="tar")
+        with tarfile.open(archive_path) as tar_file:
+            members = dict((member.name, member) for member in tar_file.getmembers())
+            self.assertEqual(sorted(members), sorted(expected_files))
+            for duplicate_name, original_name in (("A2.PNG", "A1.PNG"), ("B1.PNG", "A3.PNG")):
+                self.assertEqual(members[duplicate_name].type, tarfile.LNKTYPE)
+                self.assertEqual(members[duplicate_name].linkname, original_name)
+            for name, member in members.items():
+                self.assertEqual(tar_file.extractfile(member).read(), expected_files[name], name)
+
+    def test_link_zip(self):
+        input_directory_path = self.write_input_files(input_files)
+        expected_path, _ = self.extract(input_directory_path, "expected")
+        archive_path, encoded_names = self.extract(input_directory_path, "out.zip", dedup="link", output_format="zip")
+        # Zip files cannot link members, so duplicates are stored as copies, but are still only encoded once.
+        self.assertEqual(encoded_names, ["A1.PNG", "A3.PNG", "B2.PNG"])
+        with zipfile.ZipFile(archive_path) as zip_file:
+            self.assertEqual(dict((name, zip_file.read(name)) for name in zip_file.namelist()),
+                             self.read_files(expected_path))
+
+    def test_manifest(self):
+        input_directory_path = self.write_input_files(input_files)
+        expected_path, _ = self.extract(input_directory_path, "expected")
+        expected_files = self.read_files(expected_path)
+        output_path, encoded_names = self.extract(input_directory_path, "out", dedup="manifest")
+        self.assertEqual(encoded_names, ["A1.PNG", "A3.PNG", "B2.PNG"])
+        self.assertEqual(self.read_manifest(output_path), {"A2.PNG": "A1.PNG", "B1.PNG": "A3.PNG"})
+        output_files = self.read_files(output_path)
+        self.assertEqual(sorted(output_files), ["A1.PNG", "A3.PNG", "B2.PNG"])
+        for output_file_name, original_output_file_name in self.read_manifest(output_path).items():
+            self.assertEqual(output_files[original_output_file_name], expected_files[output_file_name])
+
+    def test_overwritten_originals(self):
+        input_directory_path = self.write_input_files(overwriting_input_files)
+        expected_path, _ = self.extract(input_directory_path, "expected")
+        expected_files = self.read_files(expected_path)
+        self.assertNotEqual(expected_files["X.PNG"], expected_files["Y.PNG"])
+
+        output_path, encoded_names = self.extract(input_directory_path, "link", dedup="link")
+        self.assertEqual(encoded_names, ["X.PNG", "X.PNG"])
+        self.assertEqual(self.read_files(output_path), expected_files)
+        # Z.PNG was linked to the first X.PNG, which kept its image when the second replaced it.
+        self.assertFalse(os.path.samefile(os.path.join(output_path, "X.PNG"), os.path.join(output_path, "Z.PNG")))
+
+        output_path, encoded_names = self.extract(input_directory_path, "manifest", dedup="manifest")
+        self.assertEqual(encoded_names, ["X.PNG", "X.PNG"])
+        # Z.PNG was listed as a duplicate of the first X.PNG, so it is written out in full once that is replaced;
+        # Y.PNG then has Z.PNG as its original.
+        self.assertEqual(self.read_files(output_path), dict(
+            (name, image_data) for name, image_data in expected_files.items() if name != "Y.PNG"))
+        self.assertEqual(self.read_manifest(output_path), {"Y.PNG": "Z.PNG"})
+
+    def test_duplicates_of_earlier_extractions(self):
+        input_directory_path = self.write_input_files(input_files)
+        expected_path, _ = self.extract(input_directory_path, "expected")
+        expected_files = self.read_files(expected_path)
+
+        for dedup_mode in ("link", "manifest"):
+            with self.subTest(dedup=dedup_mode):
+                output_path, encoded_names = self.extract(os.path.join(input_directory_path, "a.bin"), dedup_mode,
+                                                          dedup=dedup_mode)
+                self.assertEqual(encoded_names, ["A1.PNG", "A3.PNG"])
+                # B1.PNG is a duplicate of A3.PNG, which the cache shows was written by the extraction before.
+                _, encoded_names = self.extract(os.path.join(input_directory_path, "b.bin"), dedup_mode,
+                                                dedup=dedup_mode)
+                self.assertEqual(encoded_names, ["B2.PNG"])
+                if dedup_mode == "link":
+                    self.assert_same_file(output_path, "B1.PNG", "A3.PNG")
+                    self.assertEqual(self.read_files(output_path), expected_files)
+                else:
+                    self.assertEqual(self.read_manifest(output_path), {"A2.PNG": "A1.PNG", "B1.PNG": "A3.PNG"})
+                    self.assertEqual(sorted(self.read_files(output_path)), ["A1.PNG", "A3.PNG", "B2.PNG"])
+
+    def test_earlier_extractions_with_other_settings_are_not_reused(self):
+        input_directory_path = self.write_input_files(input_files)
+        output_path, _ = self.extract(os.path.join(input_directory_path, "a.bin"), "out", dedup="link")
+        _, encoded_names = self.extract(os.path.join(input_directory_path, "b.bin"), "out", dedup="link",
+                                        blackening=False)
+        self.assertEqual(encoded_names, ["B1.PNG", "B2.PNG"])
+        self.assertFalse(os.path.samefile(os.path.join(output_path, "B1.PNG"), os.path.join(output_path, "A3.PNG")))
+
+
+if __name__ == "__main__":
+    unittest.main()
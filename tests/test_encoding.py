@@ -0,0 +1,59 @@
+import random
+import struct
+import unittest
+
+from padtexturetool.encoding import L8, R4G4B4A4, R5G5B5A1, R5G6B5, R8G8B8A8, np
+
+target_bit_depth = 8
+
+
+def unpack_pixels_per_channel(encoding, packed_pixels, target_bit_depth):
+    # The original per-channel formula, which every faster path has to match exactly.
+    bit_shifts = [sum(encoding.channels[channel_index + 1:]) for channel_index in range(len(encoding.channels))]
+    bit_masks = [(((2 ** bit_count) - 1) << bit_shift) for bit_count, bit_shift in zip(encoding.channels, bit_shifts)]
+    conversion_tables = [[int(round(value * (float((2 ** target_bit_depth) - 1) / float((2 ** bit_count) - 1))))
+                          for value in range(2 ** bit_count)] for bit_count in encoding.channels]
+    return [conversion_table[(packed_pixel_value & bit_mask) >> bit_shift]
+            for packed_pixel_value in packed_pixels
+            for bit_shift, bit_mask, conversion_table in zip(bit_shifts, bit_masks, conversion_tables)]
+
+
+def build_buffer(encoding):
+    """Returns (width, height, buffer, packed pixel values) for an image holding a spread of packed values."""
+    if encoding.stride_in_bits == 32:
+        generator = random.Random(encoding.name)
+        packed_pixels = [0, 0xFFFFFFFF, 0x12345678, 0xFF00FF00] + [generator.getrandbits(32) for _ in range(64 * 64 - 4)]
+        return 64, 64, struct.pack(">{}L".format(len(packed_pixels)), *packed_pixels), packed_pixels
+
+    # Every packed value appears once.
+    packed_pixels = list(range(2 ** encoding.stride_in_bits))
+    struct_format = "<{}H" if encoding.stride_in_bits == 16 else "<{}B"
+    buffer = struct.pack(struct_format.format(len(packed_pixels)), *packed_pixels)
+    return 256, len(packed_pixels) // 256, buffer, packed_pixels
+
+
+class UnpackPixelsTest(unittest.TestCase):
+    encodings = (R8G8B8A8, R5G6B5, R4G4B4A4, R5G5B5A1, L8)
+
+    def test_pure_python_matches_per_channel_formula(self):
+        for encoding in self.encodings:
+            with self.subTest(encoding=encoding.name):
+                _, _, _, packed_pixels = build_buffer(encoding)
+                self.assertEqual(encoding.unpack_pixels(packed_pixels, target_bit_depth),
+                                 unpack_pixels_per_channel(encoding, packed_pixels, target_bit_depth))
+
+    @unittest.skipIf(np is None, "NumPy is not installed.")
+    def test_numpy_matches_pure_python_and_per_channel_formula(self):
+        for encoding in self.encodings:
+            with self.subTest(encoding=encoding.name):
+                width, height, buffer, packed_pixels = build_buffer(encoding)
+                pixel_array = encoding.unpack_pixel_array(encoding.unpack_packed_pixels(buffer, width * height),
+                                                          width, height, target_bit_depth)
+                self.assertEqual(pixel_array.shape, (height, width, len(encoding.channels)))
+                self.assertEqual(pixel_array.ravel().tolist(), encoding.unpack_pixels(packed_pixels, target_bit_depth))
+                self.assertEqual(pixel_array.ravel().tolist(),
+                                 unpack_pixels_per_channel(encoding, packed_pixels, target_bit_depth))
+
+
+if __name__ == "__main__":
+    unittest.main()
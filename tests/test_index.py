@@ -0,0 +1,135 @@
+import logging
+import os
+import random
+import struct
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from padtexturetool import index
+from padtexturetool.bench.synthetic import synthesize_image_data, synthesize_texture_block
+from padtexturetool.encoding import R8G8B8A8
+from padtexturetool.index import do_index, load_index, read_index
+from padtexturetool.settings import Settings
+from padtexturetool.texture_reader import (animated_texture_magic_string, texture_block_header_alignment,
+                                           texture_block_header_format)
+
+
+def build_texture_block(names, seed):
+    generator = random.Random(seed)
+    return synthesize_texture_block([(name, R8G8B8A8, 8, 8, synthesize_image_data(R8G8B8A8, 8, 8, generator))
+                                     for name in names])
+
+
+class IndexTest(unittest.TestCase):
+
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.directory_path = temporary_directory.name
+        self.input_directory_path = os.path.join(self.directory_path, "in")
+        self.output_directory_path = os.path.join(self.directory_path, "out")
+        os.makedirs(self.input_directory_path)
+        # An animated blob (one with an ISC block) and a plain one, whose texture names would collide.
+        animated_binary_blob = build_texture_block(["A.PNG", "B.PNG"], 1)
+        # The reader resumes its search a block past the end of the last image, so the ISC block comes after a gap.
+        animated_binary_blob += bytes(-len(animated_binary_blob) % texture_block_header_alignment +
+                                      texture_block_header_alignment)
+        animated_binary_blob += struct.pack(texture_block_header_format, animated_texture_magic_string, 0) + bytes(16)
+        with open(os.path.join(self.input_directory_path, "mons_12.bin"), 'wb') as input_file:
+            input_file.write(animated_binary_blob)
+        with open(os.path.join(self.input_directory_path, "plain.bin"), 'wb') as input_file:
+            input_file.write(build_texture_block(["C.PNG"], 2))
+        # A zip file which could hold textures, but does not.
+        with zipfile.ZipFile(os.path.join(self.input_directory_path, "empty.apk"), 'w') as zip_file:
+            zip_file.writestr("assets/readme.txt", b"no textures here")
+        logging.disable(logging.INFO)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def get_settings(self, index_file_name="index.json", animations=False, selected_texture_names=()):
+        settings = Settings(self.input_directory_path, self.output_directory_path, animations=animations)
+        settings.set_index_path(os.path.join(self.directory_path, index_file_name))
+        settings.set_selected_texture_names(selected_texture_names)
+        return settings
+
+    def load_index(self, settings):
+        """Returns the index entries, and the names of the input files which had to be indexed again."""
+        with mock.patch.object(index, "index_input_file", wraps=index.index_input_file) as index_input_file:
+            entries = load_index(settings)
+        return entries, sorted(os.path.basename(call[0][0]) for call in index_input_file.call_args_list)
+
+    def test_animated_textures_are_skipped(self):
+        entries, _ = self.load_index(self.get_settings())
+        self.assertEqual([(entry["name"], entry["animated"], entry["skipped"]) for entry in entries],
+                         [("A.PNG", True, True), ("B.PNG", True, True), ("C.PNG", False, False)])
+
+    def test_animated_textures_are_renamed_when_animations_are_enabled(self):
+        entries, _ = self.load_index(self.get_settings(animations=True))
+        self.assertEqual([(entry["name"], entry["animated"], entry["skipped"]) for entry in entries],
+                         [("MONS_0012_001.PNG", True, False), ("MONS_0012_002.PNG", True, False),
+                          ("C.PNG", False, False)])
+
+    def test_selecting_skipped_textures(self):
+        logging.disable(logging.NOTSET)
+        with self.assertLogs(level=logging.WARNING) as logs:
+            written_paths = do_index(self.get_settings(selected_texture_names=["A.PNG", "C.PNG"]))
+        self.assertEqual(written_paths, [os.path.join(self.output_directory_path, "C.PNG")])
+        self.assertEqual([output for output in logs.output if "A.PNG" in output],
+                         ["WARNING:root:Skipping A.PNG; animations not enabled"])
+
+        written_paths = do_index(self.get_settings(animations=True, selected_texture_names=["MONS_0012_001.PNG"]))
+        self.assertEqual(written_paths, [os.path.join(self.output_directory_path, "MONS_0012_001.PNG")])
+
+    def test_indexes_are_reused(self):
+        for index_file_name in ("index.json", "index.csv"):
+            with self.subTest(index_file_name=index_file_name):
+                entries, indexed_file_names = self.load_index(self.get_settings(index_file_name))
+                self.assertEqual(indexed_file_names, ["empty.apk", "mons_12.bin", "plain.bin"])
+                # Inputs without textures are recorded, but only texture entries are returned.
+                self.assertEqual([entry["name"] for entry in entries], ["A.PNG", "B.PNG", "C.PNG"])
+                self.assertEqual([entry["name"] for entry in read_index(os.path.join(self.directory_path,
+                                                                                     index_file_name))
+                                  if entry["input_file"].endswith("empty.apk")], [None])
+
+                reused_entries, indexed_file_names = self.load_index(self.get_settings(index_file_name))
+                self.assertEqual(indexed_file_names, [])
+                self.assertEqual(reused_entries, entries)
+
+    def test_changing_animations_indexes_animated_inputs_again(self):
+        self.load_index(self.get_settings())
+        entries, indexed_file_names = self.load_index(self.get_settings(animations=True))
+        self.assertEqual(indexed_file_names, ["mons_12.bin"])
+        self.assertFalse(any(entry["skipped"] for entry in entries))
+        _, indexed_file_names = self.load_index(self.get_settings(animations=True))
+        self.assertEqual(indexed_file_names, [])
+
+    def test_changed_inputs_are_indexed_again(self):
+        self.load_index(self.get_settings())
+        empty_input_file_path = os.path.join(self.input_directory_path, "empty.apk")
+        with zipfile.ZipFile(empty_input_file_path, 'a') as zip_file:
+            zip_file.writestr("assets/other.txt", b"still no textures")
+        modified_time_ns = os.stat(empty_input_file_path).st_mtime_ns + 10 ** 9
+        os.utime(empty_input_file_path, ns=(modified_time_ns, modified_time_ns))
+        _, indexed_file_names = self.load_index(self.get_settings())
+        self.assertEqual(indexed_file_names, ["empty.apk"])
+
+    def test_csv_indexes_without_skipped_fields_are_indexed_again(self):
+        index_file_path = os.path.join(self.directory_path, "index.csv")
+        self.load_index(self.get_settings("index.csv"))
+        with open(index_file_path, 'r', encoding='UTF-8') as index_file:
+            lines = index_file.read().splitlines()
+        # Drop the "skipped" column, as indexes written before it was added lack it.
+        column_index = lines[0].split(",").index("skipped")
+        with open(index_file_path, 'w', encoding='UTF-8') as index_file:
+            for line in lines:
+                fields = line.split(",")
+                index_file.write(",".join(fields[:column_index] + fields[column_index + 1:]) + "\n")
+        logging.disable(logging.NOTSET)
+        with self.assertLogs(level=logging.WARNING):
+            _, indexed_file_names = self.load_index(self.get_settings("index.csv"))
+        self.assertEqual(indexed_file_names, ["empty.apk", "mons_12.bin", "plain.bin"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from padtexturetool.output_sink import (BackgroundOutputWriter, DirectoryOutputSink, MemoryOutputSink, TarOutputSink,
+                                        ZipOutputSink)
+
+first_image_data = b'\x89PNG first'
+second_image_data = b'\x89PNG second, which is longer'
+
+
+class OutputSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.directory_path = temporary_directory.name
+        self.archive_path = os.path.join(self.directory_path, "out", "textures.archive")
+
+    def get_output_file_path(self, output_file_name):
+        # Archive members are named relative to the archive's path, as if it were the output directory.
+        return os.path.join(self.archive_path, output_file_name)
+
+    def write_files(self, output_sink):
+        with output_sink:
+            output_sink.write(self.get_output_file_path("A.PNG"), first_image_data)
+            output_sink.write(self.get_output_file_path(os.path.join("sub", "B.PNG")), second_image_data)
+            output_sink.link(self.get_output_file_path("C.PNG"), self.get_output_file_path("A.PNG"), first_image_data)
+
+    def test_zip(self):
+        output_sink = ZipOutputSink(self.archive_path)
+        self.write_files(output_sink)
+        self.assertEqual(output_sink.written_paths, ["A.PNG", "sub/B.PNG", "C.PNG"])
+        with zipfile.ZipFile(self.archive_path) as zip_file:
+            self.assertEqual(zip_file.namelist(), ["A.PNG", "sub/B.PNG", "C.PNG"])
+            self.assertEqual([zip_file.read(name) for name in zip_file.namelist()],
+                             [first_image_data, second_image_data, first_image_data])
+            self.assertTrue(all(info.compress_type == zipfile.ZIP_STORED for info in zip_file.infolist()))
+        # Zip files cannot link members, so the duplicate is stored again.
+        self.assertEqual(output_sink.linked_byte_count, 0)
+
+    def test_tar(self):
+        output_sink = TarOutputSink(self.archive_path)
+        self.write_files(output_sink)
+        self.assertEqual(output_sink.written_paths, ["A.PNG", "sub/B.PNG", "C.PNG"])
+        with tarfile.open(self.archive_path) as tar_file:
+            members = tar_file.getmembers()
+            self.assertEqual([member.name for member in members], ["A.PNG", "sub/B.PNG", "C.PNG"])
+            self.assertEqual(members[2].type, tarfile.LNKTYPE)
+            self.assertEqual(members[2].linkname, "A.PNG")
+            self.assertEqual([tar_file.extractfile(member).read() for member in members],
+                             [first_image_data, second_image_data, first_image_data])
+        self.assertEqual(output_sink.linked_byte_count, len(first_image_data))
+
+    def test_memory(self):
+        output_sink = MemoryOutputSink()
+        self.write_files(output_sink)
+        self.assertEqual(output_sink.files, {
+            self.get_output_file_path("A.PNG"): first_image_data,
+            self.get_output_file_path(os.path.join("sub", "B.PNG")): second_image_data,
+            self.get_output_file_path("C.PNG"): first_image_data})
+        self.assertIs(output_sink.files[self.get_output_file_path("C.PNG")],
+                      output_sink.files[self.get_output_file_path("A.PNG")])
+        self.assertEqual(output_sink.linked_byte_count, len(first_image_data))
+
+    def test_directory(self):
+        output_sink = DirectoryOutputSink()
+        self.write_files(output_sink)
+        expected_files = (("A.PNG", first_image_data), (os.path.join("sub", "B.PNG"), second_image_data),
+                          ("C.PNG", first_image_data))
+        for output_file_name, image_data in expected_files:
+            with open(self.get_output_file_path(output_file_name), 'rb') as output_file:
+                self.assertEqual(output_file.read(), image_data)
+        if os.path.samefile(self.get_output_file_path("A.PNG"), self.get_output_file_path("C.PNG")):
+            self.assertEqual(output_sink.linked_byte_count, len(first_image_data))
+
+    def test_directory_writes_replace_linked_files(self):
+        output_sink = DirectoryOutputSink()
+        self.write_files(output_sink)
+        output_sink.write(self.get_output_file_path("A.PNG"), second_image_data)
+        with open(self.get_output_file_path("C.PNG"), 'rb') as output_file:
+            self.assertEqual(output_file.read(), first_image_data)
+
+    def test_memory_collisions_keep_the_last_write(self):
+        output_sink = MemoryOutputSink()
+        output_sink.write("A.PNG", first_image_data)
+        output_sink.write("A.PNG", second_image_data)
+        self.assertEqual(output_sink.files, {"A.PNG": second_image_data})
+
+    def test_archive_collisions_are_rejected(self):
+        for output_sink_class in (ZipOutputSink, TarOutputSink):
+            for collide in ("write", "link"):
+                with self.subTest(output_sink=output_sink_class.__name__, collide=collide):
+                    output_sink = output_sink_class(self.archive_path)
+                    with output_sink:
+                        output_sink.write(self.get_output_file_path("A.PNG"), first_image_data)
+                        output_sink.write(self.get_output_file_path("B.PNG"), second_image_data)
+                        with self.assertRaisesRegex(ValueError, "B.PNG"):
+                            if collide == "write":
+                                output_sink.write(self.get_output_file_path("B.PNG"), first_image_data)
+                            else:
+                                output_sink.link(self.get_output_file_path("B.PNG"),
+                                                 self.get_output_file_path("A.PNG"), first_image_data)
+                    self.assertEqual(output_sink.written_paths, ["A.PNG", "B.PNG"])
+                    if output_sink_class is ZipOutputSink:
+                        with zipfile.ZipFile(self.archive_path) as zip_file:
+                            self.assertEqual(zip_file.namelist(), ["A.PNG", "B.PNG"])
+                            self.assertEqual(zip_file.read("B.PNG"), second_image_data)
+                    else:
+                        with tarfile.open(self.archive_path) as tar_file:
+                            self.assertEqual(tar_file.getnames(), ["A.PNG", "B.PNG"])
+                            self.assertEqual(tar_file.extractfile("B.PNG").read(), second_image_data)
+
+    def test_background_writer_raises_collisions(self):
+        output_sink = ZipOutputSink(self.archive_path)
+        output_writer = BackgroundOutputWriter(output_sink)
+        output_writer.write(self.get_output_file_path("A.PNG"), first_image_data)
+        output_writer.write(self.get_output_file_path("A.PNG"), second_image_data)
+        with self.assertRaises(ValueError):
+            output_writer.close()
+        with zipfile.ZipFile(self.archive_path) as zip_file:
+            self.assertEqual(zip_file.read("A.PNG"), first_image_data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,209 @@
+import io
+import random
+import struct
+import unittest
+import zlib
+from unittest import mock
+
+from padtexturetool import png_writer
+from padtexturetool.png_writer import (GREYSCALE, INDEXED, TRUECOLOR, TRUECOLOR_WITH_ALPHA, get_rows,
+                                       iter_compressed_image_data_in_parallel, write_png)
+
+
+def build_rows(width, height, channel_count, seed):
+    # Runs of repeated bytes mixed with noise, so that deflate finds matches within and across rows.
+    generator = random.Random(seed)
+    rows = []
+    for _ in range(height):
+        row = bytearray()
+        while len(row) < width * channel_count:
+            row += bytes([generator.randrange(256)]) * generator.choice((1, 1, 3, 17, 64))
+        rows.append(bytes(row[:width * channel_count]))
+    return rows
+
+
+def filter_rows(rows):
+    return b''.join(png_writer.no_filter + row for row in rows)
+
+
+def read_chunks(png_data):
+    """Returns a PNG file's chunks as (type, data, stored CRC) tuples."""
+    offset = len(png_writer.png_signature)
+    chunks = []
+    while offset < len(png_data):
+        chunk_length, chunk_type = struct.unpack(">I4s", png_data[offset:offset + 8])
+        chunk_data = png_data[offset + 8:offset + 8 + chunk_length]
+        crc, = struct.unpack(">I", png_data[offset + 8 + chunk_length:offset + 12 + chunk_length])
+        chunks.append((chunk_type, chunk_data, crc))
+        offset += 12 + chunk_length
+    return chunks
+
+
+def read_image_data(png_data):
+    # The joined data of every IDAT chunk.
+    return b''.join(chunk_data for chunk_type, chunk_data, _ in read_chunks(png_data) if chunk_type == b'IDAT')
+
+
+class ParallelCompressionTest(unittest.TestCase):
+    levels = (zlib.Z_DEFAULT_COMPRESSION, 0, 1, 6, 9)
+    thread_counts = (2, 3, 8)
+
+    def setUp(self):
+        # Bands of a few rows each, so that even a small image is split into many of them.
+        patcher = mock.patch.multiple(png_writer, parallel_compression_band_size=1000,
+                                      parallel_compression_threshold=4096)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_parallel_stream_decompresses_to_the_filtered_rows(self):
+        rows = build_rows(97, 61, 4, 1)
+        for level in self.levels:
+            for threads in self.thread_counts:
+                with self.subTest(level=level, threads=threads):
+                    image_data = b''.join(iter_compressed_image_data_in_parallel(rows, level, threads))
+                    self.assertEqual(zlib.decompress(image_data), filter_rows(rows))
+
+    def test_back_references_span_bands(self):
+        # Every row is the same, so later bands can only compress well by referring back into earlier ones.
+        rows = [bytes(range(256)) * 2] * 64
+        image_data = b''.join(iter_compressed_image_data_in_parallel(rows, 9, 4))
+        self.assertEqual(zlib.decompress(image_data), filter_rows(rows))
+        self.assertLess(len(image_data), 3 * len(zlib.compress(filter_rows(rows), 9)))
+
+    def test_rows_longer_than_a_band(self):
+        rows = build_rows(700, 9, 3, 2)
+        for threads in self.thread_counts:
+            with self.subTest(threads=threads):
+                image_data = b''.join(iter_compressed_image_data_in_parallel(rows, 6, threads))
+                self.assertEqual(zlib.decompress(image_data), filter_rows(rows))
+
+    def test_write_png_compresses_large_images_in_parallel(self):
+        width, height = 64, 80
+        rows = build_rows(width, height, 4, 3)
+        for level in self.levels:
+            for threads in self.thread_counts:
+                with self.subTest(level=level, threads=threads):
+                    stream = io.BytesIO()
+                    with mock.patch.object(png_writer, "iter_compressed_image_data_in_parallel",
+                                           wraps=iter_compressed_image_data_in_parallel) as compress_in_parallel:
+                        write_png(stream, width, height, get_rows(b''.join(rows), width * 4), TRUECOLOR_WITH_ALPHA,
+                                  compression_level=level, threads=threads)
+                    compress_in_parallel.assert_called_once()
+                    self.assertEqual(zlib.decompress(read_image_data(stream.getvalue())), filter_rows(rows))
+
+    def test_single_thread_output_is_unchanged(self):
+        # One thread (the default) always writes a single zlib stream, compressed a row at a time, whatever the size.
+        width, height = 64, 80
+        rows = build_rows(width, height, 4, 4)
+        for level in self.levels:
+            with self.subTest(level=level):
+                compressor = zlib.compressobj(level)
+                expected_image_data = b''.join(compressor.compress(png_writer.no_filter) + compressor.compress(row)
+                                               for row in rows) + compressor.flush()
+                expected_stream = io.BytesIO()
+                expected_stream.write(png_writer.png_signature)
+                png_writer.write_chunk(expected_stream, b'IHDR',
+                                       struct.pack(">IIBBBBB", width, height, 8, TRUECOLOR_WITH_ALPHA, 0, 0, 0))
+                png_writer.write_chunk(expected_stream, b'IDAT', expected_image_data)
+                png_writer.write_chunk(expected_stream, b'IEND')
+
+                for threads in (1, None):
+                    stream = io.BytesIO()
+                    keyword_arguments = {"threads": threads} if threads else {}
+                    write_png(stream, width, height, iter(rows), TRUECOLOR_WITH_ALPHA, compression_level=level,
+                              **keyword_arguments)
+                    self.assertEqual(stream.getvalue(), expected_stream.getvalue())
+
+    def test_small_images_are_compressed_on_one_thread(self):
+        width, height = 16, 16
+        rows = build_rows(width, height, 4, 5)
+        outputs = []
+        for threads in (1, 4):
+            stream = io.BytesIO()
+            with mock.patch.object(png_writer, "iter_compressed_image_data_in_parallel") as compress_in_parallel:
+                write_png(stream, width, height, iter(rows), TRUECOLOR_WITH_ALPHA, threads=threads)
+            compress_in_parallel.assert_not_called()
+            outputs.append(stream.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+
+
+class WritePngTest(unittest.TestCase):
+
+    def write_and_read(self, width, height, rows, colour_type, palette=None, text=None):
+        """Writes a PNG, checks its signature, chunk order and CRCs, and returns (chunks, pixel rows); palette images
+        have each index replaced by its palette colour."""
+        stream = io.BytesIO()
+        write_png(stream, width, height, iter(rows), colour_type, palette=palette, text=text)
+        png_data = stream.getvalue()
+        self.assertEqual(png_data[:len(png_writer.png_signature)], b'\x89PNG\r\n\x1a\n')
+
+        chunks = read_chunks(png_data)
+        for chunk_type, chunk_data, crc in chunks:
+            self.assertEqual(crc, zlib.crc32(chunk_type + chunk_data), chunk_type)
+        chunk_types = [chunk_type for chunk_type, _, _ in chunks]
+        expected_header_types = [b'IHDR'] + ([b'PLTE'] if palette else []) + (
+            [b'tRNS'] if palette and any(len(colour) == 4 for colour in palette) else [])
+        image_data_count = chunk_types.count(b'IDAT')
+        self.assertGreater(image_data_count, 0)
+        self.assertEqual(chunk_types, expected_header_types + [b'IDAT'] * image_data_count + [b'tEXt'] * len(
+            text or {}) + [b'IEND'])
+
+        self.assertEqual(chunks[0][1], struct.pack(">IIBBBBB", width, height, 8, colour_type, 0, 0, 0))
+        self.assertEqual(chunks[-1][1], b'')
+        text_chunks = [chunk_data for chunk_type, chunk_data, _ in chunks if chunk_type == b'tEXt']
+        self.assertEqual(text_chunks, [keyword.encode('latin-1') + b'\0' + value
+                                       for keyword, value in (text or {}).items()])
+
+        filtered_rows = zlib.decompress(read_image_data(png_data))
+        row_size = width * png_writer.channels_per_colour_type[colour_type]
+        self.assertEqual(len(filtered_rows), height * (row_size + 1))
+        pixel_rows = []
+        for row_start in range(0, len(filtered_rows), row_size + 1):
+            self.assertEqual(filtered_rows[row_start:row_start + 1], png_writer.no_filter)
+            pixel_rows.append(filtered_rows[row_start + 1:row_start + 1 + row_size])
+
+        if palette:
+            colours = chunks[1][1]
+            alpha_values = chunks[2][1] if chunk_types[2] == b'tRNS' else b''
+            palette_colours = [colours[index * 3:index * 3 + 3] + alpha_values[index:index + 1]
+                               for index in range(len(colours) // 3)]
+            pixel_rows = [b''.join(palette_colours[index] for index in row) for row in pixel_rows]
+        return chunks, pixel_rows
+
+    def test_colour_types_round_trip(self):
+        for colour_type in (GREYSCALE, TRUECOLOR, TRUECOLOR_WITH_ALPHA):
+            for text in (None, {"Software": b"padtexturetool", "Comment": b"\xe9t\xe9"}):
+                with self.subTest(colour_type=colour_type, text=text):
+                    width, height = 13, 7
+                    rows = build_rows(width, height, png_writer.channels_per_colour_type[colour_type], colour_type)
+                    _, pixel_rows = self.write_and_read(width, height, rows, colour_type, text=text)
+                    self.assertEqual(pixel_rows, rows)
+
+    def test_palette_round_trips(self):
+        # Translucent colours come first, so that tRNS only has to cover them.
+        for palette in ([(255, 0, 0, 0), (0, 255, 0, 128), (0, 0, 255), (10, 20, 30)],
+                        [(255, 0, 0), (0, 255, 0), (0, 0, 255)]):
+            with self.subTest(palette=palette):
+                width, height = 5, 3
+                generator = random.Random(len(palette))
+                rows = [bytes(generator.randrange(len(palette)) for _ in range(width)) for _ in range(height)]
+                chunks, pixel_rows = self.write_and_read(width, height, rows, INDEXED, palette=palette,
+                                                         text={"Source": b"MONS_1.PNG"})
+                self.assertEqual(chunks[1][1], b''.join(bytes(colour[:3]) for colour in palette))
+                if len(palette[0]) == 4:
+                    self.assertEqual(chunks[2][1], bytes([0, 128]))
+                self.assertEqual(pixel_rows, [b''.join(bytes(palette[index]) for index in row) for row in rows])
+
+    def test_large_image_data_is_split_into_several_chunks(self):
+        # Noise, which deflate cannot shrink, so that compressed data comes out as the rows go in.
+        width, height = 256, 128
+        generator = random.Random(6)
+        rows = [generator.randbytes(width * 4) for _ in range(height)]
+        with mock.patch.object(png_writer, "image_data_chunk_size", 2 ** 14):
+            chunks, pixel_rows = self.write_and_read(width, height, rows, TRUECOLOR_WITH_ALPHA, text={"a": b"b"})
+        self.assertGreater([chunk_type for chunk_type, _, _ in chunks].count(b'IDAT'), 2)
+        self.assertEqual(pixel_rows, rows)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,301 @@
+import importlib
+import logging
+import random
+import struct
+import unittest
+from unittest import mock
+
+from padtexturetool.encoding import PVRTC2BPP, PVRTC4BPP
+from padtexturetool.pvrtc import np
+from padtexturetool.settings import Settings
+from padtexturetool.texture import Texture
+
+if np is not None:
+    from padtexturetool.pvrtc import decode_pvrtc
+
+# The package's extract function shadows its extract module.
+extract = importlib.import_module("padtexturetool.extract")
+texture_writer = importlib.import_module("padtexturetool.texture_writer")
+
+block_height = 4
+
+
+def twiddle(x_block_count, y_block_count, x_index, y_index):
+    # A direct port of the reference decoder's TwiddleUV.
+    min_dimension, max_value = x_block_count, y_index
+    if y_block_count < x_block_count:
+        min_dimension, max_value = y_block_count, x_index
+    twiddled, source_bit, destination_bit, shift_count = 0, 1, 1, 0
+    while source_bit < min_dimension:
+        if y_index & source_bit:
+            twiddled |= destination_bit
+        if x_index & source_bit:
+            twiddled |= destination_bit << 1
+        source_bit <<= 1
+        destination_bit <<= 2
+        shift_count += 1
+    return twiddled | ((max_value >> shift_count) << (2 * shift_count))
+
+
+def get_colour_a(colour_data):
+    if colour_data & 0x8000:
+        return [(colour_data >> 10) & 0x1F, (colour_data >> 5) & 0x1F,
+                (colour_data & 0x1E) | ((colour_data & 0x1E) >> 4), 0xF]
+    return [((colour_data >> 7) & 0x1E) | ((colour_data >> 11) & 1), ((colour_data >> 3) & 0x1E) | ((colour_data >> 7) & 1),
+            ((colour_data << 1) & 0x1C) | ((colour_data >> 2) & 3), (colour_data >> 11) & 0xE]
+
+
+def get_colour_b(colour_data):
+    if colour_data & 0x80000000:
+        return [(colour_data >> 26) & 0x1F, (colour_data >> 21) & 0x1F, (colour_data >> 16) & 0x1F, 0xF]
+    return [((colour_data >> 23) & 0x1E) | ((colour_data >> 27) & 1),
+            ((colour_data >> 19) & 0x1E) | ((colour_data >> 23) & 1),
+            ((colour_data >> 15) & 0x1E) | ((colour_data >> 19) & 1), (colour_data >> 27) & 0xE]
+
+
+def reference_decode(buffer, width, height, bits_per_pixel):
+    """Decodes PVRTC one pixel at a time, as the reference decoder (PVRTDecompress) does; returns rows of RGBA tuples."""
+    block_width = 8 if bits_per_pixel == 2 else 4
+    x_block_count = max(-(-width // block_width), 2)
+    y_block_count = max(-(-height // block_height), 2)
+    full_width, full_height = x_block_count * block_width, y_block_count * block_height
+    words = struct.unpack("<{}I".format(2 * x_block_count * y_block_count),
+                          bytes(buffer).ljust(8 * x_block_count * y_block_count, b'\0'))
+
+    def get_word(x_index, y_index):
+        word_index = twiddle(x_block_count, y_block_count, x_index % x_block_count, y_index % y_block_count)
+        return words[2 * word_index], words[2 * word_index + 1]
+
+    # unpackModulations, for every block of the image at once.
+    values = [[0] * full_width for _ in range(full_height)]
+    modes = [[0] * full_width for _ in range(full_height)]
+    for y_index in range(y_block_count):
+        for x_index in range(x_block_count):
+            modulation_bits, colour_data = get_word(x_index, y_index)
+            mode = colour_data & 1
+            if bits_per_pixel == 2 and mode:
+                if modulation_bits & 1:
+                    mode = 3 if modulation_bits & (1 << 20) else 2
+                    if modulation_bits & (1 << 21):
+                        modulation_bits |= 1 << 20
+                    else:
+                        modulation_bits &= ~(1 << 20)
+                if modulation_bits & 2:
+                    modulation_bits |= 1
+                else:
+                    modulation_bits &= ~1
+            for y in range(block_height):
+                for x in range(block_width):
+                    pixel_x, pixel_y = x_index * block_width + x, y_index * block_height + y
+                    modes[pixel_y][pixel_x] = mode
+                    if bits_per_pixel == 2 and mode:
+                        if ((x ^ y) & 1) == 0:
+                            values[pixel_y][pixel_x] = modulation_bits & 3
+                            modulation_bits >>= 2
+                    elif bits_per_pixel == 2:
+                        values[pixel_y][pixel_x] = 3 if modulation_bits & 1 else 0
+                        modulation_bits >>= 1
+                    elif mode:
+                        values[pixel_y][pixel_x] = {0: 0, 1: 4, 2: 14, 3: 8}[modulation_bits & 3]
+                        modulation_bits >>= 2
+                    else:
+                        value = (modulation_bits & 3) * 3
+                        values[pixel_y][pixel_x] = value - 1 if value > 3 else value
+                        modulation_bits >>= 2
+
+    def get_modulation(pixel_x, pixel_y):
+        # getModulationValues; neighbours wrap around the image.
+        if bits_per_pixel == 4:
+            return values[pixel_y][pixel_x]
+        weights = [0, 3, 5, 8]
+
+        def get_weight(x, y):
+            return weights[values[y % full_height][x % full_width]]
+
+        mode = modes[pixel_y][pixel_x]
+        if mode == 0 or ((pixel_x ^ pixel_y) & 1) == 0:
+            return get_weight(pixel_x, pixel_y)
+        if mode == 1:
+            return (get_weight(pixel_x, pixel_y - 1) + get_weight(pixel_x, pixel_y + 1) +
+                    get_weight(pixel_x - 1, pixel_y) + get_weight(pixel_x + 1, pixel_y) + 2) // 4
+        if mode == 2:
+            return (get_weight(pixel_x - 1, pixel_y) + get_weight(pixel_x + 1, pixel_y) + 1) // 2
+        return (get_weight(pixel_x, pixel_y - 1) + get_weight(pixel_x, pixel_y + 1) + 1) // 2
+
+    def interpolate(p, q, r, s, x, y):
+        # interpolateColours, for one pixel x across and y down from the centre of block P.
+        result = []
+        for channel_index in range(4):
+            h_p = p[channel_index] * block_width + x * (q[channel_index] - p[channel_index])
+            h_r = r[channel_index] * block_width + x * (s[channel_index] - r[channel_index])
+            value = 4 * h_p + y * (h_r - h_p)
+            if channel_index < 3:
+                result.append((value >> 7) + (value >> 2) if bits_per_pixel == 2 else (value >> 6) + (value >> 1))
+            else:
+                result.append((value >> 5) + (value >> 1) if bits_per_pixel == 2 else (value >> 4) + value)
+        return result
+
+    rows = []
+    for pixel_y in range(height):
+        row = []
+        for pixel_x in range(width):
+            u, v = pixel_x - block_width // 2, pixel_y - block_height // 2
+            x_index, y_index = u // block_width, v // block_height
+            x, y = u - x_index * block_width, v - y_index * block_height
+            corners = [get_word(x_index + dx, y_index + dy)[1] for dy in (0, 1) for dx in (0, 1)]
+            colour_a = interpolate(*map(get_colour_a, corners), x, y)
+            colour_b = interpolate(*map(get_colour_b, corners), x, y)
+            modulation = get_modulation(pixel_x, pixel_y)
+            punch_through = modulation > 10
+            if punch_through:
+                modulation -= 10
+            pixel = [(a * (8 - modulation) + b * modulation) // 8 for a, b in zip(colour_a, colour_b)]
+            if punch_through:
+                pixel[3] = 0
+            row.append(tuple(pixel))
+        rows.append(row)
+    return rows
+
+
+def build_blocks(x_block_count, y_block_count, get_word):
+    """Returns PVRTC image data made of the (modulation data, colour data) words get_word gives for each block."""
+    words = [None] * (x_block_count * y_block_count)
+    for y_index in range(y_block_count):
+        for x_index in range(x_block_count):
+            words[twiddle(x_block_count, y_block_count, x_index, y_index)] = get_word(x_index, y_index)
+    return b''.join(struct.pack("<II", *word) for word in words)
+
+
+def widen(value, bit_count, new_bit_count):
+    # Widens a value by repeating its high bits in the new low bits.
+    return (value << (new_bit_count - bit_count)) | (value >> (2 * bit_count - new_bit_count))
+
+
+def expand(value, bit_count):
+    # Colours are widened to 5 bits before being widened to 8.
+    return widen(widen(value, bit_count, 5), 5, 8)
+
+
+@unittest.skipIf(np is None, "NumPy is not installed.")
+class DecodePvrtcTest(unittest.TestCase):
+
+    def assert_matches_reference(self, buffer, width, height, bits_per_pixel):
+        pixel_array = decode_pvrtc(buffer, width, height, bits_per_pixel)
+        self.assertEqual(pixel_array.shape, (height, width, 4))
+        self.assertEqual([[tuple(pixel) for pixel in row] for row in pixel_array.tolist()],
+                         reference_decode(buffer, width, height, bits_per_pixel))
+        return pixel_array
+
+    def test_opaque_colours_are_expanded(self):
+        # Colour A is RGB554 (0x1F, 0x0A, 0x9) and colour B RGB555 (0x03, 0x1F, 0x11); both are opaque.
+        colour_data = 0x8000 | (0x1F << 10) | (0x0A << 5) | (0x9 << 1) | 0x80000000 | (0x03 << 26) | (0x1F << 21) | (
+            0x11 << 16)
+        for modulation_data, expected_colour in ((0x00000000, (expand(0x1F, 5), expand(0x0A, 5), expand(0x9, 4), 0xFF)),
+                                                 (0xFFFFFFFF, (expand(0x03, 5), expand(0x1F, 5), expand(0x11, 5), 0xFF))):
+            with self.subTest(modulation_data=hex(modulation_data)):
+                buffer = build_blocks(2, 2, lambda x, y: (modulation_data, colour_data))
+                pixel_array = self.assert_matches_reference(buffer, 8, 8, 4)
+                self.assertTrue((pixel_array == expected_colour).all())
+
+    def test_translucent_colours_are_expanded(self):
+        # Colour A is ARGB3443 (alpha 5, red 0xC, green 0x3, blue 0x6); colour B is ARGB3444 (3, 0x1, 0xE, 0x9). Alpha
+        # gains a low zero bit, rather than a copy of its high bit.
+        colour_data = (5 << 12) | (0xC << 8) | (0x3 << 4) | (0x6 << 1) | (3 << 28) | (0x1 << 24) | (0xE << 20) | (
+            0x9 << 16)
+        for modulation_data, expected_colour in (
+                (0x00000000, (expand(0xC, 4), expand(0x3, 4), expand(0x6, 3), widen(5 << 1, 4, 8))),
+                (0xFFFFFFFF, (expand(0x1, 4), expand(0xE, 4), expand(0x9, 4), widen(3 << 1, 4, 8)))):
+            with self.subTest(modulation_data=hex(modulation_data)):
+                buffer = build_blocks(2, 2, lambda x, y: (modulation_data, colour_data))
+                pixel_array = self.assert_matches_reference(buffer, 8, 8, 4)
+                self.assertTrue((pixel_array == expected_colour).all())
+
+    def test_4bpp_punch_through_is_transparent(self):
+        # Opaque black A, opaque white B, and punch-through mode; each 2-bit modulation value in turn across a row.
+        colour_data = 0x8000 | 0x80000000 | (0x7FFF << 16) | 1
+        modulation_data = 0b11100100 * 0x01010101
+        buffer = build_blocks(2, 2, lambda x, y: (modulation_data, colour_data))
+        pixel_array = self.assert_matches_reference(buffer, 8, 8, 4)
+        self.assertEqual(pixel_array[0, :4].tolist(), [[0, 0, 0, 255], [127, 127, 127, 255], [127, 127, 127, 0],
+                                                       [255, 255, 255, 255]])
+        self.assertTrue((pixel_array[..., 3][:, 2::4] == 0).all())
+
+    def test_4bpp_standard_modulation_has_no_punch_through(self):
+        colour_data = 0x8000 | 0x80000000 | (0x7FFF << 16)
+        modulation_data = 0b11100100 * 0x01010101
+        buffer = build_blocks(2, 2, lambda x, y: (modulation_data, colour_data))
+        pixel_array = self.assert_matches_reference(buffer, 8, 8, 4)
+        self.assertEqual(pixel_array[0, :4, 0].tolist(), [0, 95, 159, 255])
+        self.assertTrue((pixel_array[..., 3] == 255).all())
+
+    def test_2bpp_direct_modulation(self):
+        # One bit per pixel picks colour A (black) or colour B (white).
+        colour_data = 0x8000 | 0x80000000 | (0x7FFF << 16)
+        modulation_data = 0x0F0FA5C3
+        buffer = build_blocks(2, 2, lambda x, y: (modulation_data, colour_data))
+        pixel_array = self.assert_matches_reference(buffer, 16, 8, 2)
+        for y in range(block_height):
+            for x in range(8):
+                self.assertEqual(pixel_array[y, x, 0], 255 if modulation_data >> (y * 8 + x) & 1 else 0, (x, y))
+
+    def test_2bpp_interpolated_modulation_modes(self):
+        colour_data = 0x8000 | 0x80000000 | (0x7FFF << 16) | 1
+        generator = random.Random(2)
+        # Bit 0 clear interpolates horizontally and vertically; set, bit 20 chooses vertically or horizontally only.
+        for mode_name, mode_bits in (("both", 0), ("horizontal", 1), ("vertical", 1 | (1 << 20))):
+            with self.subTest(mode=mode_name):
+                buffer = build_blocks(2, 2, lambda x, y: ((generator.getrandbits(32) & ~(1 | (1 << 20))) | mode_bits,
+                                                          colour_data))
+                self.assert_matches_reference(buffer, 16, 8, 2)
+
+    def test_mixed_2bpp_blocks_interpolate_across_block_edges(self):
+        generator = random.Random(3)
+        buffer = build_blocks(4, 4, lambda x, y: (generator.getrandbits(32), 0x8000 | 0x80000000 | (0x7FFF << 16) | (
+            (x + y) & 1)))
+        self.assert_matches_reference(buffer, 32, 16, 2)
+
+    def test_blocks_are_read_in_twiddled_order(self):
+        # Every block has its own colour, so any block read from the wrong place changes the blended result.
+        for bits_per_pixel, x_block_count, y_block_count in ((4, 8, 2), (4, 2, 8), (4, 4, 4), (2, 4, 8), (2, 8, 2)):
+            with self.subTest(bits_per_pixel=bits_per_pixel, blocks=(x_block_count, y_block_count)):
+                buffer = build_blocks(x_block_count, y_block_count, lambda x, y: (
+                    0, 0x8000 | ((x * 7 + y * 3) & 0x1F) << 10 | ((y * 5) & 0x1F) << 5 | 0x80000000))
+                self.assert_matches_reference(buffer, x_block_count * (4 if bits_per_pixel == 4 else 8),
+                                              y_block_count * block_height, bits_per_pixel)
+
+    def test_random_non_square_images(self):
+        generator = random.Random(4)
+        for bits_per_pixel, width, height in ((4, 32, 8), (4, 8, 32), (4, 16, 16), (2, 32, 8), (2, 16, 32)):
+            with self.subTest(bits_per_pixel=bits_per_pixel, size=(width, height)):
+                buffer = generator.randbytes(width * height * bits_per_pixel // 8)
+                self.assert_matches_reference(buffer, width, height, bits_per_pixel)
+
+    def test_images_smaller_than_two_blocks_are_cropped(self):
+        generator = random.Random(5)
+        for bits_per_pixel, width, height in ((4, 4, 4), (4, 8, 2), (4, 2, 8), (2, 8, 8), (2, 16, 4), (2, 4, 2)):
+            with self.subTest(bits_per_pixel=bits_per_pixel, size=(width, height)):
+                # Image data is always at least 2x2 blocks long.
+                buffer = generator.randbytes(4 * 8)
+                self.assert_matches_reference(buffer, width, height, bits_per_pixel)
+
+    def test_short_image_data_is_padded(self):
+        self.assert_matches_reference(random.Random(6).randbytes(20), 8, 8, 4)
+
+
+class SkipWithoutNumpyTest(unittest.TestCase):
+
+    def test_pvrtc_textures_are_skipped_with_a_warning(self):
+        settings = Settings()
+        for encoding in (PVRTC4BPP, PVRTC2BPP):
+            with self.subTest(encoding=encoding.name):
+                texture = Texture(16, 16, "MONS_1.PNG", bytes(16 * 16 * encoding.stride_in_bits // 8), encoding)
+                with mock.patch.object(extract, "np", None), mock.patch.object(texture_writer, "np", None), \
+                        self.assertLogs(level=logging.WARNING) as logs:
+                    self.assertIsNone(extract.encode_exported_texture(texture, "/out/MONS_1.PNG", settings))
+                    self.assertEqual(bytes(texture_writer.encode_texture(texture, settings)), b'')
+                self.assertIn("MONS_1.PNG", logs.output[0])
+                self.assertIn("NumPy", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
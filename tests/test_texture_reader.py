@@ -0,0 +1,203 @@
+import io
+import random
+import struct
+import unittest
+from unittest import mock
+
+from padtexturetool import texture_reader
+from padtexturetool.bench.synthetic import encrypt_binary_blob, synthesize_image_data, synthesize_texture_block
+from padtexturetool.encoding import L8, PVRTC4BPP, R4G4B4A4, R8G8B8A8
+from padtexturetool.texture_reader import (animated_texture_magic_string, decrypt_and_decompress_binary_blob,
+                                           decrypt_and_decompress_binary_stream,
+                                           encrypted_texture_header_format_size, extract_textures_from_binary_blob,
+                                           find_texture_block_header, iter_decrypted_and_decompressed_chunks,
+                                           texture_block_header_alignment, texture_block_header_format,
+                                           texture_block_header_size, texture_manifest_format,
+                                           unencrypted_texture_magic_string)
+
+block_magic_strings = (unencrypted_texture_magic_string, animated_texture_magic_string)
+
+
+def find_texture_block_header_by_stepping(binary_blob, offset):
+    # The original scanner, which unpacked a block header every 16 bytes.
+    while offset + texture_block_header_size < len(binary_blob):
+        magic_string, _ = struct.unpack_from(texture_block_header_format, binary_blob, offset)
+        if magic_string in block_magic_strings:
+            return offset
+        offset += texture_block_header_alignment
+    return -1
+
+
+def build_block_header(magic_string, texture_count=0):
+    return struct.pack(texture_block_header_format, magic_string, texture_count)
+
+
+class FindTextureBlockHeaderTest(unittest.TestCase):
+    window_sizes = (16, 17, 31, 64, 100, texture_reader.texture_block_search_window_size)
+
+    def assert_matches_stepping(self, binary_blob, offsets=None):
+        for window_size in self.window_sizes:
+            with mock.patch.object(texture_reader, "texture_block_search_window_size", window_size):
+                for offset in (offsets if offsets is not None else range(len(binary_blob) + 1)):
+                    self.assertEqual(find_texture_block_header(binary_blob, offset),
+                                     find_texture_block_header_by_stepping(binary_blob, offset),
+                                     (window_size, offset))
+
+    def test_misaligned_magic_strings_are_skipped(self):
+        # Magic strings at every offset within a few alignments; only those a multiple of 16 bytes on count.
+        for magic_string in block_magic_strings:
+            for magic_offset in range(3 * texture_block_header_alignment):
+                with self.subTest(magic_string=magic_string, magic_offset=magic_offset):
+                    binary_blob = bytearray(128)
+                    binary_blob[magic_offset:magic_offset + 3] = magic_string
+                    self.assert_matches_stepping(bytes(binary_blob))
+
+    def test_magic_strings_straddling_search_windows(self):
+        # With a 16- or 17-byte window, each magic string starts just before the end of one window or another.
+        for magic_offset in range(20, 40):
+            with self.subTest(magic_offset=magic_offset):
+                binary_blob = bytearray(96)
+                binary_blob[magic_offset:magic_offset + 3] = unencrypted_texture_magic_string
+                binary_blob[magic_offset + 5:magic_offset + 8] = animated_texture_magic_string
+                self.assert_matches_stepping(bytes(binary_blob))
+
+    def test_partial_and_overlapping_magic_strings(self):
+        pieces = (b"TEX", b"ISC", b"TE", b"X", b"IS", b"TEXTEX", b"ISCTEX", b"\0" * 5)
+        generator = random.Random(1)
+        for _ in range(300):
+            binary_blob = bytearray(generator.randbytes(generator.randrange(0, 200)))
+            for _ in range(generator.randrange(0, 8)):
+                piece_offset = generator.randrange(0, len(binary_blob) + 1)
+                binary_blob[piece_offset:piece_offset] = generator.choice(pieces)
+            self.assert_matches_stepping(bytes(binary_blob))
+
+    def test_magic_strings_too_close_to_the_end(self):
+        # A block header needs the 16 bytes after its offset (and a byte more) to be found.
+        for blob_size in range(30, 40):
+            with self.subTest(blob_size=blob_size):
+                binary_blob = bytearray(blob_size)
+                binary_blob[16:19] = unencrypted_texture_magic_string
+                self.assert_matches_stepping(bytes(binary_blob))
+
+    def test_memoryviews_are_searched(self):
+        binary_blob = bytearray(256)
+        binary_blob[100:103] = unencrypted_texture_magic_string
+        binary_blob[160:163] = animated_texture_magic_string
+        self.assertEqual(find_texture_block_header(memoryview(bytes(binary_blob)), 4), 100)
+        self.assertEqual(find_texture_block_header(memoryview(bytes(binary_blob)), 0), 160)
+
+
+class ExtractTexturesTest(unittest.TestCase):
+
+    def build_pvr_blob(self):
+        """Returns a blob whose PVR texture's 12-byte footer shifts the next block 12 bytes off the 16-byte grid, with
+        an unrelated TEX magic string on the grid before it."""
+        pvr_data_start = 64
+        pvr_data_size = 8 * 8 // 2
+        pvr_data_end = pvr_data_start + 52 + pvr_data_size
+        # The scan resumes 16 bytes after the footer's offset.
+        next_block_start = (pvr_data_end & ~(texture_block_header_alignment - 1)) + 12 + 3 * 16
+        binary_blob = bytearray(next_block_start + 16 + 32 + 16)
+        binary_blob[0:16] = build_block_header(unencrypted_texture_magic_string, 1)
+        binary_blob[16:48] = struct.pack(texture_manifest_format, pvr_data_start, 8 | (0xB << 12), 8, b"PVR.PNG")
+        decoy_start = next_block_start - 12 - 16
+        binary_blob[decoy_start:decoy_start + 16] = build_block_header(unencrypted_texture_magic_string, 1)
+        binary_blob[next_block_start:next_block_start + 16] = build_block_header(unencrypted_texture_magic_string, 1)
+        binary_blob[next_block_start + 16:next_block_start + 48] = struct.pack(
+            texture_manifest_format, 48, 2 | (0x0 << 12), 2, b"NEXT.PNG")
+        return bytes(binary_blob), next_block_start
+
+    def test_pvr_footer_shifts_the_block_alignment(self):
+        binary_blob, next_block_start = self.build_pvr_blob()
+        for window_size in FindTextureBlockHeaderTest.window_sizes:
+            with self.subTest(window_size=window_size), \
+                    mock.patch.object(texture_reader, "texture_block_search_window_size", window_size):
+                textures, is_animated = extract_textures_from_binary_blob(binary_blob)
+                self.assertEqual([(texture.name, texture.encoding, texture.offset) for texture in textures],
+                                 [("PVR.PNG", PVRTC4BPP, 64 + 52), ("NEXT.PNG", R8G8B8A8, next_block_start + 48)])
+                self.assertFalse(is_animated)
+
+    def test_animated_blocks(self):
+        binary_blob = bytearray(160)
+        binary_blob[32:48] = build_block_header(unencrypted_texture_magic_string, 0)
+        binary_blob[37:40] = b"TEX"
+        for window_size in FindTextureBlockHeaderTest.window_sizes:
+            with mock.patch.object(texture_reader, "texture_block_search_window_size", window_size):
+                self.assertEqual(extract_textures_from_binary_blob(bytes(binary_blob)), ([], False))
+        binary_blob[96:112] = build_block_header(animated_texture_magic_string)
+        self.assertEqual(extract_textures_from_binary_blob(bytes(binary_blob)), ([], True))
+
+
+class ShortReadStream(io.RawIOBase):
+    """An unbuffered stream which returns at most `read_size` bytes from each read, like a pipe."""
+
+    def __init__(self, data, read_size):
+        super(ShortReadStream, self).__init__()
+        self.stream = io.BytesIO(data)
+        self.read_size = read_size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(min(len(buffer), self.read_size))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class DecryptTest(unittest.TestCase):
+    # Chunks of these sizes split the header's decryption key from its magic string and padding, and split the deflate
+    # stream inside its block headers and at arbitrary points in its compressed data.
+    chunk_sizes = (1, 3, 5, 6, 7, 11, 12, 13, 64, 1000, 2 ** 16)
+
+    def setUp(self):
+        generator = random.Random(1)
+        self.binary_blob = synthesize_texture_block([
+            (name, encoding, width, height, synthesize_image_data(encoding, width, height, generator))
+            for name, encoding, width, height in (("A.PNG", R8G8B8A8, 32, 32), ("B.PNG", R4G4B4A4, 64, 16),
+                                                  ("C.PNG", L8, 48, 48))])
+
+    def test_round_trip(self):
+        for decryption_key in (0x00, 0x5A, 0xFF):
+            encrypted_blob = encrypt_binary_blob(self.binary_blob, decryption_key)
+            self.assertNotIn(self.binary_blob[:64], encrypted_blob)
+            encrypted_data = encrypted_blob[encrypted_texture_header_format_size:]
+            for chunk_size in self.chunk_sizes:
+                with self.subTest(decryption_key=decryption_key, chunk_size=chunk_size):
+                    encrypted_chunks = (encrypted_data[chunk_start:chunk_start + chunk_size]
+                                        for chunk_start in range(0, len(encrypted_data), chunk_size))
+                    self.assertEqual(b''.join(iter_decrypted_and_decompressed_chunks(encrypted_chunks,
+                                                                                     decryption_key)),
+                                     self.binary_blob)
+                    with mock.patch.object(texture_reader, "decryption_chunk_size", chunk_size):
+                        self.assertEqual(decrypt_and_decompress_binary_blob(encrypted_blob), self.binary_blob)
+                        self.assertEqual(decrypt_and_decompress_binary_blob(memoryview(encrypted_blob)),
+                                         self.binary_blob)
+                        self.assertEqual(decrypt_and_decompress_binary_stream(io.BytesIO(encrypted_blob)),
+                                         self.binary_blob)
+                        # Reads which stop short split the header, too.
+                        self.assertEqual(decrypt_and_decompress_binary_stream(ShortReadStream(encrypted_blob,
+                                                                                              chunk_size)),
+                                         self.binary_blob)
+
+    def test_unencrypted_blobs(self):
+        for binary_blob in (self.binary_blob, self.binary_blob[:encrypted_texture_header_format_size],
+                            self.binary_blob[:5], b''):
+            for read_size in (1, 7, 2 ** 16):
+                with self.subTest(length=len(binary_blob), read_size=read_size):
+                    self.assertEqual(decrypt_and_decompress_binary_stream(ShortReadStream(binary_blob, read_size)),
+                                     binary_blob)
+        self.assertEqual(decrypt_and_decompress_binary_blob(self.binary_blob), self.binary_blob)
+
+    def test_textures_from_encrypted_blobs(self):
+        textures, is_animated = extract_textures_from_binary_blob(encrypt_binary_blob(self.binary_blob))
+        expected_textures, _ = extract_textures_from_binary_blob(self.binary_blob)
+        self.assertFalse(is_animated)
+        self.assertEqual([(texture.name, texture.encoding, texture.width, texture.height, texture.offset,
+                           bytes(texture.buffer)) for texture in textures],
+                         [(texture.name, texture.encoding, texture.width, texture.height, texture.offset,
+                           bytes(texture.buffer)) for texture in expected_textures])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+import random
+import unittest
+from unittest import mock
+
+from padtexturetool import texture_writer
+from padtexturetool.encoding import R8G8B8A8
+from padtexturetool.texture_writer import (blacken_transparent_pixels, build_palette, maximum_palette_size, np,
+                                           trim_transparent_edges)
+
+if np is not None:
+    from padtexturetool.texture_writer import (blacken_transparent_pixel_array, build_palette_from_array,
+                                               trim_transparent_edges_array)
+
+
+def build_pixels(colours, width, height, seed):
+    """Returns a flat list of channel values for an image using every one of the colours, in a shuffled order."""
+    generator = random.Random(seed)
+    pixels = list(colours) + [generator.choice(colours) for _ in range(width * height - len(colours))]
+    generator.shuffle(pixels)
+    return [channel for pixel in pixels for channel in pixel]
+
+
+def build_colours(colour_count, channel_count, seed):
+    generator = random.Random(seed)
+    colours = set()
+    while len(colours) < colour_count:
+        # A few alpha values, opaque and transparent among them, so that some colours share an alpha.
+        colour = tuple(generator.randrange(256) for _ in range(channel_count - 1)) + (
+            generator.choice((0, 0x40, 0x80, 0xFF, 0xFF)) if channel_count == 4 else generator.randrange(256),)
+        colours.add(colour)
+    return sorted(colours)
+
+
+class BuildPaletteTest(unittest.TestCase):
+    # (colour count, channel count, width, height)
+    images = ((1, 4, 5, 3), (17, 4, 16, 16), (255, 4, 40, 20), (256, 4, 40, 20), (256, 3, 33, 17), (200, 3, 25, 9))
+
+    def assert_palette_is_valid(self, flat_pixel_array, channel_count, palette, palette_indices):
+        # Looking each index up in the palette gives back the image.
+        palette_pixels = [palette[palette_index] for palette_index in palette_indices]
+        if channel_count == 4:
+            palette_pixels = [colour + (0xFF,) * (4 - len(colour)) for colour in palette_pixels]
+        self.assertEqual([channel for colour in palette_pixels for channel in colour], flat_pixel_array)
+        self.assertEqual(len(set(palette)), len(palette))
+
+        # Only the leading colours are translucent and keep their alpha, so tRNS only has to cover those.
+        if channel_count == 4:
+            translucent_count = sum(1 for colour in palette if len(colour) == 4)
+            self.assertTrue(all(len(colour) == 4 and colour[3] != 0xFF for colour in palette[:translucent_count]))
+            self.assertTrue(all(len(colour) == 3 for colour in palette[translucent_count:]))
+            self.assertEqual([colour[3] for colour in palette[:translucent_count]],
+                             sorted(colour[3] for colour in palette[:translucent_count]))
+        else:
+            self.assertTrue(all(len(colour) == 3 for colour in palette))
+
+    def test_pure_python(self):
+        for colour_count, channel_count, width, height in self.images:
+            with self.subTest(colour_count=colour_count, channel_count=channel_count):
+                flat_pixel_array = build_pixels(build_colours(colour_count, channel_count, colour_count), width,
+                                                height, width)
+                palette, palette_indices = build_palette(flat_pixel_array, channel_count, channel_count == 4)
+                self.assertEqual(len(palette), colour_count)
+                self.assert_palette_is_valid(flat_pixel_array, channel_count, palette, palette_indices)
+
+    def test_too_many_colours(self):
+        for channel_count in (3, 4):
+            with self.subTest(channel_count=channel_count):
+                flat_pixel_array = build_pixels(build_colours(maximum_palette_size + 1, channel_count, 1), 40, 20, 2)
+                self.assertEqual(build_palette(flat_pixel_array, channel_count, channel_count == 4), (None, None))
+
+    @unittest.skipIf(np is None, "NumPy is not installed.")
+    def test_numpy_matches_pure_python(self):
+        # Chunks of a few rows (and, for 7 pixels, of less than a row), so that colours are gathered across chunks.
+        for chunk_size in (7, 100, texture_writer.palette_search_chunk_size):
+            for colour_count, channel_count, width, height in self.images + ((257, 4, 40, 20), (257, 3, 40, 20)):
+                with self.subTest(chunk_size=chunk_size, colour_count=colour_count, channel_count=channel_count):
+                    flat_pixel_array = build_pixels(build_colours(colour_count, channel_count, colour_count), width,
+                                                    height, width)
+                    pixel_array = np.array(flat_pixel_array, dtype=np.uint8).reshape(height, width, channel_count)
+                    with mock.patch.object(texture_writer, "palette_search_chunk_size", chunk_size):
+                        palette, palette_index_array = build_palette_from_array(pixel_array, channel_count == 4)
+                    expected_palette, expected_palette_indices = build_palette(flat_pixel_array, channel_count,
+                                                                               channel_count == 4)
+                    self.assertEqual(palette, expected_palette)
+                    if expected_palette is None:
+                        self.assertIsNone(palette_index_array)
+                        continue
+                    self.assertEqual(palette_index_array.shape, (height, width))
+                    self.assertEqual(palette_index_array.tobytes(), expected_palette_indices)
+
+    @unittest.skipIf(np is None, "NumPy is not installed.")
+    def test_numpy_trimmed_view(self):
+        # Trimmed images are views into the full image, whose rows are not contiguous.
+        flat_pixel_array = build_pixels(build_colours(30, 4, 3), 20, 20, 4)
+        pixel_array = np.array(flat_pixel_array, dtype=np.uint8).reshape(20, 20, 4)[3:17, 2:11]
+        with mock.patch.object(texture_writer, "palette_search_chunk_size", 20):
+            palette, palette_index_array = build_palette_from_array(pixel_array, True)
+        self.assertEqual((palette, palette_index_array.tobytes()),
+                         build_palette(pixel_array.ravel().tolist(), 4, True))
+
+    @unittest.skipIf(np is None, "NumPy is not installed.")
+    def test_numpy_stops_at_the_first_chunk_with_too_many_colours(self):
+        # A first band of rows with every colour it can hold; the rest of the image is never packed.
+        pixel_array = np.zeros((64, 64, 4), dtype=np.uint8)
+        pixel_array[:5].reshape(-1, 4)[:, 0] = np.arange(5 * 64) % 256
+        pixel_array[:5].reshape(-1, 4)[:, 1] = np.arange(5 * 64) // 256
+        with mock.patch.object(texture_writer, "palette_search_chunk_size", 64 * 5), \
+                mock.patch.object(texture_writer, "pack_pixel_array", wraps=texture_writer.pack_pixel_array) as pack:
+            self.assertEqual(build_palette_from_array(pixel_array, True), (None, None))
+        self.assertEqual(pack.call_count, 1)
+        self.assertEqual(pack.call_args[0][0].shape, (5, 64, 4))
+
+
+def build_alpha_pixels(width, height, opaque_pixels, seed):
+    """Returns a flat list of RGBA channel values with random colours, opaque only at the given (x, y) pixels, and
+    transparent (with a random alpha of 0 or not) everywhere else."""
+    generator = random.Random(seed)
+    flat_pixel_array = []
+    for y in range(height):
+        for x in range(width):
+            alpha = generator.choice((0x01, 0x80, 0xFF)) if (x, y) in opaque_pixels else 0
+            flat_pixel_array.extend([generator.randrange(256) for _ in range(3)] + [alpha])
+    return flat_pixel_array
+
+
+@unittest.skipIf(np is None, "NumPy is not installed.")
+class TrimAndBlackenTest(unittest.TestCase):
+    # (width, height, opaque (x, y) pixels, given width, given height)
+    cases = (
+        ("fully transparent", 8, 6, (), 8, 6),
+        ("fully transparent within the given size", 8, 6, ((7, 5),), 6, 4),
+        ("fully opaque", 3, 2, tuple((x, y) for x in range(3) for y in range(2)), 3, 2),
+        ("transparent edges", 8, 6, ((1, 2), (5, 4), (3, 3)), 8, 6),
+        ("single pixel", 5, 5, ((4, 0),), 5, 5),
+        ("single row", 7, 1, ((2, 0), (4, 0)), 7, 1),
+        ("opaque beyond the given size", 8, 6, ((1, 1), (6, 1), (2, 5)), 4, 3),
+        ("opaque only beyond the given width", 8, 6, ((6, 2),), 4, 6),
+        ("opaque only beyond the given height", 8, 6, ((2, 5),), 8, 4),
+        ("given size of zero", 4, 4, ((1, 1),), 0, 0),
+        ("given size larger than the image", 8, 6, ((1, 2), (5, 4)), 10, 9),
+    )
+
+    def assert_matches_list(self, pixel_array, width, height, flat_pixel_array):
+        self.assertEqual(pixel_array.shape, (height, width, 4))
+        self.assertEqual(pixel_array.reshape(-1).tolist(), flat_pixel_array)
+
+    def test_matches_list(self):
+        channels = R8G8B8A8.channels
+        for name, width, height, opaque_pixels, given_width, given_height in self.cases:
+            for seed in range(3):
+                with self.subTest(name, seed=seed):
+                    flat_pixel_array = build_alpha_pixels(width, height, opaque_pixels, seed)
+                    pixel_array = np.array(flat_pixel_array, dtype=np.uint8).reshape(height, width, 4)
+
+                    trimmed_width, trimmed_height, trimmed_pixels = trim_transparent_edges(
+                        list(flat_pixel_array), width, height, channels, given_width, given_height)
+                    trimmed_pixel_array = trim_transparent_edges_array(pixel_array, given_width, given_height)
+                    self.assert_matches_list(trimmed_pixel_array, trimmed_width, trimmed_height, trimmed_pixels)
+                    # Trimmed images are views, which the PNG writer compresses row by row without copying.
+                    self.assertTrue(trimmed_pixel_array.size == 0 or np.shares_memory(trimmed_pixel_array, pixel_array))
+
+                    self.assert_matches_list(blacken_transparent_pixel_array(trimmed_pixel_array), trimmed_width,
+                                             trimmed_height, blacken_transparent_pixels(
+                                                 trimmed_pixels, trimmed_width, trimmed_height, channels))
+                    self.assert_matches_list(blacken_transparent_pixel_array(pixel_array.copy()), width, height,
+                                             blacken_transparent_pixels(list(flat_pixel_array), width, height,
+                                                                        channels))
+
+    def test_blacken(self):
+        flat_pixel_array = build_alpha_pixels(6, 4, ((0, 0), (3, 2), (5, 3)), 0)
+        pixel_array = blacken_transparent_pixel_array(np.array(flat_pixel_array, dtype=np.uint8).reshape(4, 6, 4))
+        for pixel, original_pixel in zip(pixel_array.reshape(-1, 4).tolist(),
+                                         np.array(flat_pixel_array).reshape(-1, 4).tolist()):
+            self.assertEqual(pixel, [0, 0, 0, 0] if original_pixel[3] == 0 else original_pixel)
+
+
+if __name__ == "__main__":
+    unittest.main()
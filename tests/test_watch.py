@@ -0,0 +1,121 @@
+import importlib
+import io
+import logging
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+from padtexturetool import cache
+from padtexturetool.bench.synthetic import synthesize_image_data, synthesize_texture_block
+from padtexturetool.encoding import R8G8B8A8
+from padtexturetool.metrics import Profiler
+from padtexturetool.settings import Settings
+from padtexturetool.watch import WATCH_STDIN, do_watch
+
+# The package's extract function shadows its extract module.
+extract = importlib.import_module("padtexturetool.extract")
+
+# {input file name: [(texture name, seed for its image data)]}; B1.PNG and C1.PNG are duplicates of A1.PNG.
+input_files = {
+    "a.bin": [("A1.PNG", 1), ("A2.PNG", 2)],
+    "b.bin": [("B1.PNG", 1)],
+    "c.bin": [("C1.PNG", 1), ("C2.PNG", 3)],
+}
+
+
+class WatchTest(unittest.TestCase):
+
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.input_directory_path = os.path.join(temporary_directory.name, "in")
+        self.output_directory_path = os.path.join(temporary_directory.name, "out")
+        os.makedirs(self.input_directory_path)
+        for input_file_name, textures in input_files.items():
+            with open(os.path.join(self.input_directory_path, input_file_name), 'wb') as input_file:
+                input_file.write(synthesize_texture_block([
+                    (name, R8G8B8A8, 16, 16, synthesize_image_data(R8G8B8A8, 16, 16, random.Random(seed)))
+                    for name, seed in textures]))
+        logging.disable(logging.INFO)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def watch(self, input_file_names, **settings_arguments):
+        """Runs watch mode over input files read from standard input; returns the number of jobs extracted."""
+        settings = Settings(output_dir=self.output_directory_path, **settings_arguments)
+        settings.set_watch_path(WATCH_STDIN)
+        job_paths = "".join(os.path.join(self.input_directory_path, input_file_name) + "\n"
+                            for input_file_name in input_file_names)
+        with mock.patch("sys.stdin", io.StringIO(job_paths)):
+            return settings, len(do_watch(settings))
+
+    def get_output_file_path(self, output_file_name):
+        return os.path.join(self.output_directory_path, output_file_name)
+
+    def test_caches_are_loaded_once(self):
+        with mock.patch.object(extract, "ExtractionCache", wraps=cache.ExtractionCache) as extraction_cache, \
+                mock.patch.object(cache.ExtractionCache, "save", autospec=True,
+                                  side_effect=cache.ExtractionCache.save) as save:
+            _, job_count = self.watch(["a.bin", "b.bin", "a.bin", "c.bin"])
+        self.assertEqual(job_count, 4)
+        extraction_cache.assert_called_once_with(self.output_directory_path)
+        # The third job finds a.bin unchanged, so it has nothing to save.
+        self.assertEqual(save.call_count, 3)
+
+        cached_inputs = cache.ExtractionCache(self.output_directory_path).inputs
+        self.assertEqual(sorted(os.path.basename(input_file_path) for input_file_path in cached_inputs),
+                         ["a.bin", "b.bin", "c.bin"])
+
+    def test_deduplicator_is_kept_across_jobs(self):
+        with mock.patch.object(cache.ExtractionCache, "iter_written_textures", autospec=True,
+                               side_effect=cache.ExtractionCache.iter_written_textures) as iter_written_textures, \
+                mock.patch.object(extract, "encode_exported_texture_with_cpu_time",
+                                  wraps=extract.encode_exported_texture_with_cpu_time) as encode:
+            self.watch(["a.bin", "b.bin", "c.bin"], dedup="link")
+        # Earlier extractions are only looked up once, rather than for every job.
+        self.assertEqual(iter_written_textures.call_count, 1)
+        self.assertEqual(sorted(os.path.basename(call[0][1]) for call in encode.call_args_list),
+                         ["A1.PNG", "A2.PNG", "C2.PNG"])
+        for duplicate_name in ("B1.PNG", "C1.PNG"):
+            self.assertTrue(os.path.samefile(self.get_output_file_path(duplicate_name),
+                                             self.get_output_file_path("A1.PNG")))
+
+    def test_deleted_originals_are_exported_again(self):
+        self.watch(["a.bin"], dedup="link")
+        os.remove(self.get_output_file_path("A1.PNG"))
+        with mock.patch.object(extract, "encode_exported_texture_with_cpu_time",
+                               wraps=extract.encode_exported_texture_with_cpu_time) as encode:
+            self.watch(["b.bin", "a.bin"], dedup="link")
+        self.assertEqual([os.path.basename(call[0][1]) for call in encode.call_args_list], ["B1.PNG"])
+        self.assertTrue(os.path.samefile(self.get_output_file_path("A1.PNG"), self.get_output_file_path("B1.PNG")))
+
+    def test_jobs_have_settings_of_their_own(self):
+        job_settings = []
+        original_do_extract = extract.do_extract
+
+        def do_extract(settings, *arguments, **keyword_arguments):
+            job_settings.append(settings)
+            return original_do_extract(settings, *arguments, **keyword_arguments)
+
+        with mock.patch("padtexturetool.watch.do_extract", side_effect=do_extract):
+            settings, _ = self.watch(["a.bin", "b.bin"], profiler=Profiler(), trimming=False, include=["*1.PNG"])
+        self.assertEqual([job.input_files for job in job_settings],
+                         [[os.path.join(self.input_directory_path, "a.bin")],
+                          [os.path.join(self.input_directory_path, "b.bin")]])
+        self.assertEqual(settings.input_files, [])
+        for job in job_settings:
+            self.assertEqual(job.cache_key, settings.cache_key)
+            self.assertIsNot(job.profiler, settings.profiler)
+            self.assertIsNot(job.included_texture_patterns, settings.included_texture_patterns)
+        # Each job's stage records are merged into the session's profiler.
+        self.assertEqual(sorted(set(stage_record.input_file for stage_record in settings.profiler.stage_records
+                                    if stage_record.input_file)),
+                         [os.path.join(self.input_directory_path, "a.bin"),
+                          os.path.join(self.input_directory_path, "b.bin")])
+        self.assertEqual(len(settings.profiler.stage_records),
+                         sum(len(job.profiler.stage_records) for job in job_settings))
+
+
+if __name__ == "__main__":
+    unittest.main()